@@ -0,0 +1,21 @@
+"""AI分析热路径基准测试：各分辨率下 detect_faces / detect_persons / analyze_frame 单帧耗时"""
+from common import RESOLUTIONS, synth_frame, measure
+
+
+def run_suite(app, resolutions=tuple(RESOLUTIONS), repeat=10, time_budget=10):
+    from src.routes.ai_analysis import ai_engine
+
+    results = {}
+    for name in resolutions:
+        frame = synth_frame(RESOLUTIONS[name])
+
+        results[f'analysis.detect_faces.{name}'] = measure(
+            lambda: ai_engine.detect_faces(frame), repeat, time_budget=time_budget)
+        results[f'analysis.detect_persons.{name}'] = measure(
+            lambda: ai_engine.detect_persons(frame), repeat, time_budget=time_budget)
+
+        with app.app_context():
+            results[f'analysis.analyze_frame.{name}'] = measure(
+                lambda: ai_engine.analyze_frame(frame, 'bench-cam'), repeat, time_budget=time_budget)
+
+    return results
@@ -0,0 +1,106 @@
+"""事件分区基准测试：一年历史数据归档前后的事件查询延迟、归档吞吐量和归档文件大小
+
+在ai_events现有数据之外写入100~365天前的历史事件，归档后热分区只保留最近几个月，
+历史月份存为压缩分区文件。结束时删除分区目录记录，数据库恢复为写入历史事件之前的状态。
+
+用法:
+    python benchmarks/bench_archive.py --rows 1000000
+"""
+from datetime import datetime, timedelta
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from common import create_app, measure, throughput_result
+from bench_query import EVENT_TYPES, NUM_DEVICES
+
+HISTORY_DAYS = (100, 365)
+
+
+def seed_history(app, rows, chunk_size=50000):
+    """写入热分区范围之前的历史事件"""
+    from src.models.device import AIEvent, db
+
+    table = AIEvent.__table__
+    rng = np.random.default_rng(rows)
+    now = datetime.utcnow()
+    with app.app_context():
+        for start in range(0, rows, chunk_size):
+            n = min(chunk_size, rows - start)
+            offsets = rng.integers(HISTORY_DAYS[0] * 86400, HISTORY_DAYS[1] * 86400, n)
+            devices = rng.integers(0, NUM_DEVICES, n)
+            types = rng.integers(0, len(EVENT_TYPES), n)
+            confidences = rng.random(n)
+            db.session.execute(table.insert(), [{
+                'device_id': f'bench-cam-{int(devices[i])}',
+                'event_type': EVENT_TYPES[types[i]],
+                'confidence': float(confidences[i]),
+                'bbox_x': 100,
+                'bbox_y': 100,
+                'bbox_width': 64,
+                'bbox_height': 128,
+                'image_path': None,
+                'metadata': {'source': 'bench', 'track_id': int(offsets[i] % 1000)},
+                'created_at': now - timedelta(seconds=int(offsets[i]))
+            } for i in range(n)])
+            db.session.commit()
+
+
+def run_suite(app, rows=1000000, repeat=20, time_budget=30):
+    from src.models.device import EventPartition, db
+    from src.services import event_archive
+    from src.services.event_archive import EventArchive
+
+    seed_start = time.perf_counter()
+    seed_history(app, rows)
+    print(f'写入 {rows} 行历史事件（{time.perf_counter() - seed_start:.1f}s）')
+
+    client = app.test_client()
+    end = datetime.utcnow()
+    queries = {
+        'events_page': '/api/events',
+        'events_device': '/api/events?device_id=bench-cam-7',
+        'events_recent': f'/api/events?start_time={(end - timedelta(days=1)).isoformat()}&end_time={end.isoformat()}',
+        'events_old_month': (f'/api/events?start_time={(end - timedelta(days=300)).isoformat()}'
+                             f'&end_time={(end - timedelta(days=270)).isoformat()}')
+    }
+    results = {}
+    before = {}
+    for name, url in queries.items():
+        before[name] = measure(lambda: client.get(url), repeat, time_budget=time_budget)
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        archive = EventArchive(directory=archive_dir)
+        event_archive._archive = archive
+
+        with app.app_context():
+            start = time.perf_counter()
+            months = archive.roll_over()
+            elapsed = time.perf_counter() - start
+            status = archive.status()
+        print(f'归档 {len(months)} 个月, {status["archived_rows"]} 行, {elapsed:.1f}s')
+
+        results['archive.rollover_rows_per_second'] = throughput_result(status['archived_rows'], elapsed, 'rows/s')
+        results['archive.bytes_per_row'] = {
+            'unit': 'bytes', 'better': 'lower', 'value': status['archived_bytes'] / max(status['archived_rows'], 1)
+        }
+        for name, url in queries.items():
+            after = measure(lambda: client.get(url), repeat, time_budget=time_budget)
+            results[f'archive.{name}.{rows}'] = {**after, 'before': before[name]['value']}
+            print(f'{name}: 归档前 {before[name]["value"] * 1000:.2f}ms, 归档后 {after["value"] * 1000:.2f}ms')
+
+        event_archive._archive = None
+        with app.app_context():
+            EventPartition.query.delete()
+            db.session.commit()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='事件分区基准测试')
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run_suite(create_app(os.path.join(tmp_dir, 'bench.db')), args.rows)
@@ -0,0 +1,81 @@
+"""录像离线分析基准测试：统计不同并行进程数下的分析吞吐量
+
+测试视频优先使用ffmpeg合成（testsrc），没有ffmpeg时使用OpenCV写入。
+该测试耗时较长，不包含在 run.py 的默认套件中（可用 --suites batch 运行）。
+
+用法:
+    python benchmarks/bench_batch_analysis.py --duration 120 --workers 1,2,4
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing
+from common import synth_video
+
+from src.services.batch_analysis import split_chunks, analyze_chunk
+
+
+def run(video_path, workers_list, chunk_seconds, frame_step,
+        analysis_types=('face_detection', 'person_detection')):
+    chunks = split_chunks(video_path, chunk_seconds)
+    results = []
+    baseline = None
+
+    for workers in workers_list:
+        start = time.perf_counter()
+        frames = 0
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(analyze_chunk, 'bench', video_path, 'bench', s, e, fps,
+                                       frame_step, list(analysis_types))
+                       for s, e, fps in chunks]
+            for future in futures:
+                frames += future.result()['frames_processed']
+        elapsed = time.perf_counter() - start
+
+        fps = frames / elapsed
+        baseline = baseline or fps
+        entry = {
+            'workers': workers,
+            'chunks': len(chunks),
+            'frames_analyzed': frames,
+            'seconds': elapsed,
+            'analyzed_fps': fps,
+            'speedup': fps / baseline,
+            'efficiency': fps / baseline / workers
+        }
+        results.append(entry)
+        print(entry)
+
+    return results
+
+
+def run_suite(app, duration=60, workers_list=None, chunk_seconds=10, frame_step=5):
+    cpu_count = os.cpu_count() or 1
+    workers_list = workers_list or sorted({1, cpu_count})
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = synth_video(os.path.join(tmp_dir, 'bench.mp4'), duration)
+        for entry in run(video_path, workers_list, chunk_seconds, frame_step):
+            results[f"batch.analyzed_fps.workers{entry['workers']}"] = {
+                'unit': 'frames/s', 'better': 'higher', 'value': entry['analyzed_fps'],
+                'speedup': entry['speedup']
+            }
+    return results
+
+
+if __name__ == '__main__':
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='录像离线分析基准测试')
+    parser.add_argument('--video', help='使用已有视频文件，不指定则合成测试视频')
+    parser.add_argument('--duration', type=int, default=60, help='合成视频时长（秒）')
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, max(1, cpu_count // 2), cpu_count})))
+    parser.add_argument('--chunk-seconds', type=float, default=10)
+    parser.add_argument('--frame-step', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = args.video or synth_video(os.path.join(tmp_dir, 'bench.mp4'), args.duration)
+        run(video_path, [int(w) for w in args.workers.split(',')], args.chunk_seconds, args.frame_step)
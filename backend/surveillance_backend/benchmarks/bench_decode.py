@@ -0,0 +1,106 @@
+"""解码模式基准测试：比较各解码模式下每路视频流占用的CPU
+
+CPU占用 = 解码消耗的CPU时间（本进程 + ffmpeg子进程）/ 视频时长，即每路流需要的CPU核数。
+测试视频为含B帧的H.264（关键帧间隔2秒），需要ffmpeg；没有ffmpeg时跳过。
+
+用法:
+    python benchmarks/bench_decode.py --duration 20 --resolution 1080p
+"""
+import os
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import common
+
+from src.services.frame_source import open_frame_source
+
+# 名称: (解码模式, 输出宽度, 输出帧率)
+CASES = {
+    'opencv_full': ('full', None, None),
+    'ffmpeg_full_fps5': ('full', None, 5),
+    'noref_fps5': ('noref', None, 5),
+    'keyframe': ('keyframe', None, None),
+    'scaled640_fps5': ('full', 640, 5),
+    'keyframe_scaled640': ('keyframe', 640, None)
+}
+
+
+def make_video(path, duration, size, fps=25):
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size[0]}x{size[1]}:rate={fps}:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-g', str(fps * 2), '-bf', '2',
+        path
+    ], check=True)
+    return path
+
+
+def cpu_seconds():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def decode(video_path, mode, width, fps):
+    start_cpu = cpu_seconds()
+    start = time.perf_counter()
+    source = open_frame_source(video_path, mode, width, fps)
+    frames = 0
+    shape = None
+    while True:
+        ok, frame = source.read()
+        if not ok:
+            break
+        frames += 1
+        shape = frame.shape
+    source.release()
+    return {
+        'frames': frames,
+        'output': f'{shape[1]}x{shape[0]}' if shape else None,
+        'seconds': time.perf_counter() - start,
+        'cpu_seconds': cpu_seconds() - start_cpu
+    }
+
+
+def run(video_path, duration):
+    results = []
+    baseline = None
+    for name, (mode, width, fps) in CASES.items():
+        entry = {'case': name, **decode(video_path, mode, width, fps)}
+        entry['cores_per_stream'] = entry['cpu_seconds'] / duration
+        baseline = baseline or entry['cores_per_stream']
+        entry['relative'] = entry['cores_per_stream'] / baseline
+        results.append(entry)
+        print(entry)
+    return results
+
+
+def run_suite(app, duration=20, resolution='1080p'):
+    if not shutil.which('ffmpeg'):
+        print('未找到ffmpeg，跳过解码模式测试')
+        return {}
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = make_video(os.path.join(tmp_dir, 'bench.mp4'), duration, common.RESOLUTIONS[resolution])
+        for entry in run(video_path, duration):
+            results[f"decode.cores_per_stream.{entry['case']}.{resolution}"] = {
+                'unit': 'cores', 'better': 'lower', 'value': entry['cores_per_stream'],
+                'frames': entry['frames'], 'output': entry['output']
+            }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='解码模式基准测试')
+    parser.add_argument('--duration', type=int, default=20)
+    parser.add_argument('--resolution', default='1080p', choices=list(common.RESOLUTIONS))
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        raise SystemExit('需要ffmpeg')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = make_video(os.path.join(tmp_dir, 'bench.mp4'), args.duration, common.RESOLUTIONS[args.resolution])
+        run(path, args.duration)
@@ -0,0 +1,104 @@
+"""事件导出基准测试：流式导出（NDJSON/CSV）与分页接口逐页拉取的吞吐量和峰值内存对比
+
+每种方式在独立子进程中运行，内存统计互不影响；峰值内存为导出过程中RSS相对开始时的最大增量。
+
+用法:
+    python benchmarks/bench_export.py --rows 1000000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from common import create_app, throughput_result
+
+MODES = ['paginated', 'ndjson', 'csv']
+
+
+def current_rss_mb():
+    """当前RSS（Linux读取/proc，其他平台退化为进程峰值RSS）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(database_path, mode, per_page=10000):
+    """在当前进程中执行一种导出方式"""
+    app = create_app(database_path)
+    client = app.test_client()
+    startup_rss = peak_rss = current_rss_mb()
+    rows = 0
+    start = time.perf_counter()
+
+    if mode == 'paginated':
+        page = 1
+        while True:
+            data = client.get(f'/api/events?page={page}&per_page={per_page}').get_json()
+            rows += len(data['data'])
+            peak_rss = max(peak_rss, current_rss_mb())
+            if page >= data['pagination']['pages']:
+                break
+            page += 1
+    else:
+        response = client.get(f'/api/events/export?format={mode}', buffered=False)
+        for chunk in response.response:
+            rows += chunk.count(b'\n')
+            peak_rss = max(peak_rss, current_rss_mb())
+        response.close()
+        if mode == 'csv':
+            rows -= 1
+
+    elapsed = time.perf_counter() - start
+    return {
+        'mode': mode,
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed > 0 else 0,
+        'peak_rss_mb': peak_rss,
+        'startup_rss_mb': startup_rss
+    }
+
+
+def run_suite(app, rows=100000):
+    """在给定应用的数据库上补齐数据，然后逐个子进程测量各导出方式"""
+    from bench_query import seed_events
+
+    seed_events(app, rows)
+    database_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '', 1)
+
+    results = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', mode, '--database', database_path],
+            capture_output=True, text=True, check=True
+        ).stdout
+        entry = json.loads(output.strip().splitlines()[-1])
+        print(entry)
+
+        results[f'export.{mode}.rows_per_second.{rows}'] = throughput_result(
+            entry['rows'], entry['seconds'], 'rows/s')
+        results[f'export.{mode}.peak_rss_mb.{rows}'] = {
+            'unit': 'MB', 'better': 'lower', 'value': entry['peak_rss_mb'] - entry['startup_rss_mb'],
+            'peak_rss_mb': entry['peak_rss_mb']
+        }
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='事件导出基准测试')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.database, args.child)))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_suite(create_app(os.path.join(tmp_dir, 'bench.db')), args.rows)
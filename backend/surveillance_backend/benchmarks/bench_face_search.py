@@ -0,0 +1,97 @@
+"""人脸特征检索基准测试：统计不同特征库规模下的每秒查询数
+
+用法:
+    python benchmarks/bench_face_search.py --sizes 1000,100000,1000000 --dim 128
+"""
+import time
+import argparse
+import tempfile
+import numpy as np
+from common import throughput_result
+
+from src.services.face_index import FaceIndex, normalize
+
+
+def synth_faces(rng, identities, n, noise=0.35):
+    """模拟人脸特征：每个身份的多张人脸分布在身份中心附近"""
+    centers = identities[rng.integers(0, identities.shape[0], n)]
+    return centers + noise * rng.standard_normal(centers.shape, dtype=np.float32) / np.sqrt(centers.shape[1])
+
+
+def build_index(data_dir, size, identities, chunk_size=100000):
+    """生成模拟特征库（入库期间不触发IVF构建）"""
+    rng = np.random.default_rng(42)
+    index = FaceIndex(data_dir=data_dir, dim=identities.shape[1], initial_capacity=size,
+                      ivf_threshold=size + 1)
+    for start in range(0, size, chunk_size):
+        n = min(chunk_size, size - start)
+        index.add_batch(np.arange(start, start + n), synth_faces(rng, identities, n))
+    index.flush()
+    return index
+
+
+def measure_qps(index, queries, k):
+    """顺序执行查询，返回每秒查询数"""
+    index.search(queries[0], k)
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query, k)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def run(sizes, dim=128, k=10, num_queries=200, ivf_threshold=1000000):
+    results = []
+
+    for size in sizes:
+        rng = np.random.default_rng(7)
+        identities = normalize(rng.standard_normal((max(1, size // 10), dim), dtype=np.float32))
+        queries = normalize(synth_faces(rng, identities, num_queries))
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            index = build_index(data_dir, size, identities)
+            entry = {'gallery_size': size, 'flat_qps': measure_qps(index, queries, k)}
+
+            if size >= ivf_threshold:
+                # 暴力检索结果作为基准，计算IVF召回率
+                truth = [set(e for e, _ in index.search(q, k)) for q in queries[:50]]
+                index.ivf_threshold = ivf_threshold
+
+                build_start = time.perf_counter()
+                index.build_ivf()
+                entry['ivf_build_seconds'] = time.perf_counter() - build_start
+                entry['ivf_qps'] = measure_qps(index, queries, k)
+                hits = [len(t & set(e for e, _ in index.search(q, k))) for t, q in zip(truth, queries)]
+                entry['ivf_recall_at_k'] = sum(hits) / (len(truth) * k)
+
+            results.append(entry)
+            print(entry)
+
+    return results
+
+
+def run_suite(app, sizes=(1000, 10000, 100000, 1000000), num_queries=200):
+    results = {}
+    for entry in run(sizes, num_queries=num_queries):
+        size = entry['gallery_size']
+        results[f'faces.flat_qps.{size}'] = throughput_result(
+            num_queries, num_queries / entry['flat_qps'], 'queries/s')
+        if 'ivf_qps' in entry:
+            results[f'faces.ivf_qps.{size}'] = throughput_result(
+                num_queries, num_queries / entry['ivf_qps'], 'queries/s')
+            results[f'faces.ivf_recall.{size}'] = {
+                'unit': 'recall@k', 'better': 'higher', 'value': entry['ivf_recall_at_k']
+            }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='人脸特征检索基准测试')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--ivf-threshold', type=int, default=1000000)
+    args = parser.parse_args()
+
+    run([int(s) for s in args.sizes.split(',')], args.dim, args.top_k,
+        args.queries, args.ivf_threshold)
@@ -0,0 +1,49 @@
+"""事件写入基准测试：save_detection_result、save_detection_batch 和 POST /api/events 吞吐量"""
+import time
+from common import RESOLUTIONS, synth_frame, throughput_result
+
+
+def run_suite(app, count=500, batch_size=100):
+    from src.routes.ai_analysis import ai_engine
+
+    frame = synth_frame(RESOLUTIONS['720p'])
+    result = {
+        'type': 'person_detection',
+        'confidence': 0.9,
+        'bbox': {'x': 100, 'y': 100, 'width': 64, 'height': 128}
+    }
+    results = {}
+
+    with app.app_context():
+        start = time.perf_counter()
+        for _ in range(count):
+            ai_engine.save_detection_result('bench-cam', result, frame)
+        results['ingest.save_detection_result'] = throughput_result(
+            count, time.perf_counter() - start, 'events/s')
+
+        image_path, _ = ai_engine.save_detection_image('bench-cam', result, frame, 'bench_batch')
+        batch = [dict(result, image_path=image_path) for _ in range(batch_size)]
+        batches = max(1, count // batch_size)
+        start = time.perf_counter()
+        for _ in range(batches):
+            ai_engine.save_detection_batch('bench-cam', batch, {'source': 'bench'})
+        results['ingest.save_detection_batch'] = throughput_result(
+            batches * batch_size, time.perf_counter() - start, 'events/s')
+
+    client = app.test_client()
+    payload = {
+        'device_id': 'bench-cam',
+        'event_type': 'person_detection',
+        'confidence': 0.9,
+        'bbox_x': 100,
+        'bbox_y': 100,
+        'bbox_width': 64,
+        'bbox_height': 128,
+        'metadata': {'source': 'bench'}
+    }
+    start = time.perf_counter()
+    for _ in range(count):
+        client.post('/api/events', json=payload)
+    results['ingest.post_events'] = throughput_result(count, time.perf_counter() - start, 'requests/s')
+
+    return results
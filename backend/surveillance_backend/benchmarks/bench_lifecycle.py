@@ -0,0 +1,158 @@
+"""视频流生命周期基准测试：按需启动与预热的首帧时间、空闲流自动停止
+
+每路流使用本地合成源（testsrc2经realtime滤镜按实时速率输出，FLV经TCP发送），设备的 rtsp_url 指向该地址。
+    按需启动  流未运行时请求 /api/stream/play/<device_id>，计时到返回可播放的播放列表
+    预热      固定预热的设备由生命周期管理预先启动，计时同一请求
+    自动停止  若干路流启动后无人观看，空闲超时后检查被停止的流数（固定预热的流应保留）
+
+用法:
+    python benchmarks/bench_lifecycle.py --trials 5
+"""
+import os
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+from common import create_app, latency_result
+
+SOURCE_SIZE = '1280x720'
+SOURCE_FPS = 25
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_source():
+    """启动等待一个连接的合成源，返回 (进程, 输入地址)"""
+    port = free_port()
+    process = subprocess.Popen([
+        'ffmpeg', '-hide_banner', '-loglevel', 'quiet',
+        '-f', 'lavfi', '-i', f'testsrc2=size={SOURCE_SIZE}:rate={SOURCE_FPS},realtime',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-g', str(SOURCE_FPS),
+        '-f', 'flv', f'tcp://127.0.0.1:{port}?listen=1'
+    ], stdin=subprocess.DEVNULL)
+    time.sleep(0.3)
+    return process, f'tcp://127.0.0.1:{port}'
+
+
+def stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def add_device(app, device_id, url, pinned=False):
+    from src.models.device import Device, db
+
+    with app.app_context():
+        device = Device.query.filter_by(device_id=device_id).first()
+        if device is None:
+            device = Device(device_id=device_id, name=device_id, protocol='RTSP', ip_address='127.0.0.1', port=554)
+            db.session.add(device)
+        device.rtsp_url = url
+        device.stream_pinned = pinned
+        db.session.commit()
+
+
+def play(client, device_id):
+    """请求播放列表直到可以播放，返回耗时"""
+    start = time.perf_counter()
+    while True:
+        response = client.get(f'/api/stream/play/{device_id}')
+        if response.status_code == 200:
+            return time.perf_counter() - start
+        if time.perf_counter() - start > 30:
+            raise RuntimeError(f'播放失败: {response.status_code} {response.get_data(as_text=True)[:200]}')
+        time.sleep(0.1)
+
+
+def run(app, trials, idle_timeout=2, streams=3):
+    from src.routes.stream import StreamManager, active_streams
+    from src.services.stream_lifecycle import get_lifecycle
+
+    lifecycle = get_lifecycle()
+    # 由测试显式调用预热和回收
+    lifecycle.stop()
+    client = app.test_client()
+    sources = []
+    results = {'on_demand': [], 'prewarmed': []}
+    try:
+        for i in range(trials):
+            source, url = start_source()
+            sources.append(source)
+            add_device(app, f'bench-demand-{i}', url)
+            results['on_demand'].append(play(client, f'bench-demand-{i}'))
+            with app.app_context():
+                StreamManager.reap_stream(f'bench-demand-{i}')
+
+            source, url = start_source()
+            sources.append(source)
+            add_device(app, f'bench-warm-{i}', url, pinned=True)
+            with app.app_context():
+                lifecycle.prewarm(lifecycle.warm_devices())
+            lifecycle.wait_ready(f'bench-warm-{i}', 30)
+            results['prewarmed'].append(play(client, f'bench-warm-{i}'))
+            with app.app_context():
+                add_device(app, f'bench-warm-{i}', url, pinned=False)
+                StreamManager.reap_stream(f'bench-warm-{i}')
+            print({'trial': i, 'on_demand': results['on_demand'][-1], 'prewarmed': results['prewarmed'][-1]})
+
+        # 无人观看的流在空闲超时后停止，固定预热的流保留
+        lifecycle.idle_timeout = idle_timeout
+        for i in range(streams):
+            source, url = start_source()
+            sources.append(source)
+            add_device(app, f'bench-idle-{i}', url, pinned=(i == 0))
+            play(client, f'bench-idle-{i}')
+        reaped_before = lifecycle.reaped
+        deadline = time.time() + lifecycle.viewer_timeout + idle_timeout + 5
+        while time.time() < deadline and lifecycle.reaped - reaped_before < streams - 1:
+            with app.app_context():
+                lifecycle.reap(lifecycle.warm_devices())
+            time.sleep(0.5)
+        results['reaped'] = lifecycle.reaped - reaped_before
+        results['pinned_kept'] = 'bench-idle-0' in active_streams
+        results['status'] = lifecycle.status()
+        print({'reaped': results['reaped'], 'pinned_kept': results['pinned_kept']})
+    finally:
+        with app.app_context():
+            for device_id in list(active_streams):
+                StreamManager.reap_stream(device_id)
+        for source in sources:
+            stop(source)
+    return results
+
+
+def run_suite(app, trials=5):
+    if not shutil.which('ffmpeg'):
+        print('未找到ffmpeg，跳过视频流生命周期测试')
+        return {}
+
+    results = run(app, trials)
+    return {
+        'lifecycle.first_frame.on_demand': latency_result(results['on_demand']),
+        'lifecycle.first_frame.prewarmed': latency_result(results['prewarmed']),
+        'lifecycle.idle_reaped': {
+            'unit': 'streams', 'better': 'higher', 'value': results['reaped'],
+            'pinned_kept': results['pinned_kept']
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='视频流生命周期基准测试')
+    parser.add_argument('--trials', type=int, default=5)
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        raise SystemExit('需要ffmpeg')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run(create_app(os.path.join(tmp_dir, 'bench.db')), args.trials)
@@ -0,0 +1,259 @@
+"""低延迟直播基准测试：本地合成RTSP源下LL-HLS与普通HLS的端到端延迟
+
+合成源（testsrc2经realtime滤镜按实时速率输出）推送到本地RTSP地址，打包进程以RTSP监听模式接收。
+媒体时间0对应合成源启动的时间（包含ffmpeg启动耗时，延迟略为偏高）：
+    LL-HLS  模拟播放器循环发送阻塞式播放列表刷新（_HLS_msn/_HLS_part），取回最新的部分分片，
+            延迟 = 收到分片的时间 - 分片末尾画面由合成源产生的时间
+    HLS     使用原有的 -hls_time 2 -hls_list_size 3 设置，轮询播放列表，
+            延迟 = 新分片出现在播放列表的时间 - 分片末尾画面由合成源产生的时间
+原有设置重新编码时没有指定关键帧间隔（libx264默认250帧），分片只能在关键帧处切分，实际分片长度约10秒。
+播放器在直播边缘之后还会保留缓冲（LL-HLS为PART-HOLD-BACK，普通HLS一般为3个目标时长），
+估计的端到端延迟 = 可用延迟中位数 + 缓冲。另外用大量并发的阻塞请求验证等待中的请求不占用线程。
+
+用法:
+    python benchmarks/bench_llhls.py --seconds 20 --viewers 200
+"""
+import os
+import re
+import time
+import shutil
+import socket
+import struct
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import urllib.request
+from common import latency_result
+
+from src.services import llhls
+
+SOURCE_SIZE = '1280x720'
+SOURCE_FPS = 25
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_source(url):
+    """以实时速率向RTSP地址推送合成视频，返回 (进程, 启动时间)"""
+    started = time.time()
+    process = subprocess.Popen([
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={SOURCE_SIZE}:rate={SOURCE_FPS},realtime',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-g', str(SOURCE_FPS),
+        '-f', 'rtsp', '-rtsp_transport', 'tcp', url
+    ], stdin=subprocess.DEVNULL)
+    return process, started
+
+
+def stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+def part_times(data, init_info):
+    """部分分片开头和末尾的媒体时间（秒）"""
+    start, end = llhls.find_box(data, 'moof')
+    moof = data[start:end]
+    tfdt = llhls.find_box(moof, 'traf/tfdt')
+    version = moof[tfdt[0]]
+    decode_time = struct.unpack_from('>Q' if version == 1 else '>I', moof, tfdt[0] + 4)[0]
+    duration, _ = llhls.parse_fragment(moof, init_info)
+    begin = decode_time / init_info['timescale']
+    return begin, begin + duration
+
+
+def measure_llhls(seconds, viewers):
+    server = llhls.get_server()
+    url = f'rtsp://127.0.0.1:{free_port()}/live'
+    packager = subprocess.Popen(llhls.ffmpeg_command(url, ['-rtsp_flags', 'listen', '-timeout', '30']),
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    server.call(server.add_stream('bench', packager))
+    time.sleep(0.5)
+
+    base = f'http://127.0.0.1:{server.port}/bench'
+    init_ready = {}
+
+    def wait_init():
+        # 初始化分片在打包进程探测完输入后写出，阻塞请求返回的时间即起播耗时
+        init_ready['init'] = fetch(f'{base}/init.mp4')
+        init_ready['time'] = time.time()
+
+    waiter = threading.Thread(target=wait_init)
+    waiter.start()
+    source, started = start_source(url)
+    waiter.join()
+    startup = init_ready['time'] - started
+
+    latencies = []
+    fanout = []
+    threads = {}
+    try:
+        init = init_ready['init']
+        init_info = llhls.parse_init(init[init.index(b'moov') + 4:])
+        # 解码时间不一定从0开始，以第一个部分分片的开头为媒体时间原点
+        origin, _ = part_times(fetch(f'{base}/part0.0.m4s'), init_info)
+        msn, part = 0, 0
+        deadline = time.time() + seconds
+        viewers_started = False
+        while time.time() < deadline:
+            playlist = fetch(f'{base}/playlist.m3u8?_HLS_msn={msn}&_HLS_part={part}').decode()
+            newest = re.findall(r'#EXT-X-PART:.*URI="([^"]+)"', playlist)[-1]
+            data = fetch(f'{base}/{newest}')
+            received = time.time()
+            latency = received - (started + part_times(data, init_info)[1] - origin)
+            # 跳过启动阶段
+            if received - started > 3:
+                latencies.append(latency)
+            msn, part = map(int, re.search(r'PRELOAD-HINT:TYPE=PART,URI="part(\d+)\.(\d+)', playlist).groups())
+
+            if not viewers_started and received - started > 3:
+                viewers_started = True
+                threads['before'] = threading.active_count()
+                fanout, threads['during'] = concurrent_reloads(server.port, msn, part, viewers)
+    finally:
+        stop(source)
+        stop(packager)
+
+    status = next(iter(server.status()['streams'].values()), {})
+    hold_back = (status.get('part_target') or llhls.PART_TARGET) * 3
+    return latencies, hold_back, fanout, threads, startup
+
+
+def concurrent_reloads(port, msn, part, viewers):
+    """viewers个连接同时阻塞等待同一个部分分片，返回各请求完成时间相对最早完成的延迟（毫秒）和等待期间的线程数"""
+    request = (f'GET /bench/playlist.m3u8?_HLS_msn={msn}&_HLS_part={part + 1} HTTP/1.1\r\n'
+               f'Host: 127.0.0.1\r\nConnection: close\r\n\r\n').encode()
+    thread_count = []
+
+    async def viewer():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request)
+        await writer.drain()
+        await reader.read()
+        writer.close()
+        return time.perf_counter()
+
+    async def run():
+        tasks = [asyncio.ensure_future(viewer()) for _ in range(viewers)]
+        await asyncio.sleep(0.05)
+        thread_count.append(threading.active_count())
+        return await asyncio.gather(*tasks)
+
+    done = asyncio.run(run())
+    first = min(done)
+    return [(t - first) * 1000 for t in done], thread_count[0]
+
+
+def measure_hls(seconds):
+    """原有HLS设置：轮询播放列表文件，记录新分片出现的时间"""
+    url = f'rtsp://127.0.0.1:{free_port()}/live'
+    with tempfile.TemporaryDirectory() as output_dir:
+        playlist_path = os.path.join(output_dir, 'playlist.m3u8')
+        packager = subprocess.Popen([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-rtsp_flags', 'listen', '-timeout', '30',
+            '-i', url, '-an', '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+            '-f', 'hls', '-hls_time', '2', '-hls_list_size', '3', '-hls_flags', 'delete_segments',
+            playlist_path
+        ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(0.5)
+        source, started = start_source(url)
+
+        latencies = []
+        seen = set()
+        media_end = 0.0
+        target = 2
+        deadline = time.time() + seconds
+        try:
+            while time.time() < deadline:
+                try:
+                    with open(playlist_path) as f:
+                        content = f.read()
+                except FileNotFoundError:
+                    content = ''
+                now = time.time()
+                sequence = int((re.search(r'#EXT-X-MEDIA-SEQUENCE:(\d+)', content) or [0, 0])[1])
+                target = int((re.search(r'#EXT-X-TARGETDURATION:(\d+)', content) or [0, target])[1])
+                for offset, duration in enumerate(re.findall(r'#EXTINF:([\d.]+)', content)):
+                    if sequence + offset not in seen:
+                        seen.add(sequence + offset)
+                        media_end += float(duration)
+                        if now - started > 3:
+                            latencies.append(now - (started + media_end))
+                time.sleep(0.02)
+        finally:
+            stop(source)
+            stop(packager)
+    return latencies, target
+
+
+def run(seconds, viewers):
+    latencies, hold_back, fanout, threads, startup = measure_llhls(seconds, viewers)
+    hls_latencies, hls_target = measure_hls(seconds)
+    part_latency = latency_result(latencies)
+    results = {
+        'llhls_p50': part_latency['value'],
+        'llhls_p95': part_latency['p95'],
+        'llhls_estimate': part_latency['value'] + hold_back,
+        'hls_p50': statistics.median(hls_latencies) if hls_latencies else None,
+        'hls_estimate': statistics.median(hls_latencies) + 3 * hls_target if hls_latencies else None,
+        'hls_target_duration': hls_target,
+        'fanout_p95_ms': sorted(fanout)[int(len(fanout) * 0.95)] if fanout else None,
+        'startup': startup,
+        'viewers': viewers,
+        'threads_before': threads.get('before'),
+        'threads_waiting': threads.get('during')
+    }
+    print(results)
+    return results
+
+
+def run_suite(app, seconds=20, viewers=200):
+    if not shutil.which('ffmpeg'):
+        print('未找到ffmpeg，跳过低延迟直播测试')
+        return {}
+
+    entry = run(seconds, viewers)
+    results = {
+        'llhls.part_latency': {
+            'unit': 'seconds', 'better': 'lower', 'value': entry['llhls_p50'], 'p95': entry['llhls_p95']
+        },
+        'llhls.glass_to_glass_estimate': {
+            'unit': 'seconds', 'better': 'lower', 'value': entry['llhls_estimate'],
+            'hls_estimate': entry['hls_estimate'], 'hls_target_duration': entry['hls_target_duration']
+        },
+        'llhls.blocked_reload_fanout_p95': {
+            'unit': 'ms', 'better': 'lower', 'value': entry['fanout_p95_ms'], 'viewers': viewers,
+            'threads_before': entry['threads_before'], 'threads_waiting': entry['threads_waiting']
+        },
+        'llhls.startup': {'unit': 'seconds', 'better': 'lower', 'value': entry['startup']}
+    }
+    if entry['hls_p50'] is not None:
+        results['hls.segment_latency'] = {'unit': 'seconds', 'better': 'lower', 'value': entry['hls_p50']}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='低延迟直播基准测试')
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--viewers', type=int, default=200)
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        raise SystemExit('需要ffmpeg')
+    run(args.seconds, args.viewers)
@@ -0,0 +1,82 @@
+"""设备归属基准测试：一致性哈希的负载均衡度、节点加入/离开时的迁移比例和查询耗时
+
+理想情况下N个节点时加入一个节点迁移约1/(N+1)的设备，离开一个节点迁移约1/N的设备。
+
+用法:
+    python benchmarks/bench_ownership.py --devices 10000 --nodes 2,4,8,16
+"""
+import argparse
+import statistics
+from common import measure
+
+from src.services.ownership import HashRing
+
+
+def assignment(ring, device_ids):
+    return {device_id: ring.owner(device_id) for device_id in device_ids}
+
+
+def moved_fraction(before, after):
+    return sum(1 for device_id in before if before[device_id] != after[device_id]) / len(before)
+
+
+def run(device_count, node_counts):
+    device_ids = [f'device-{n:06d}' for n in range(device_count)]
+    results = []
+    for count in node_counts:
+        nodes = [f'node-{n}' for n in range(count)]
+        ring = HashRing(nodes)
+        before = assignment(ring, device_ids)
+
+        loads = [sum(1 for owner in before.values() if owner == node) for node in nodes]
+        mean = device_count / count
+
+        ring.add(f'node-{count}')
+        joined = assignment(ring, device_ids)
+        ring.remove(f'node-{count}')
+        ring.remove(nodes[-1])
+        left = assignment(ring, device_ids)
+
+        lookup = measure(lambda: [ring.owner(device_id) for device_id in device_ids], repeat=5)
+        lookup_us = lookup['value'] / device_count * 1e6
+
+        entry = {
+            'nodes': count,
+            'max_load_ratio': max(loads) / mean,
+            'load_stddev_ratio': statistics.pstdev(loads) / mean,
+            'join_moved': moved_fraction(before, joined),
+            'join_ideal': 1 / (count + 1),
+            'leave_moved': moved_fraction(before, left),
+            'leave_ideal': 1 / count,
+            'lookup_us': lookup_us
+        }
+        results.append(entry)
+        print(entry)
+    return results
+
+
+def run_suite(app, devices=10000, node_counts=(2, 4, 8, 16)):
+    results = {}
+    for entry in run(devices, node_counts):
+        nodes = entry['nodes']
+        results[f'ownership.max_load_ratio.nodes{nodes}'] = {
+            'unit': 'x', 'better': 'lower', 'value': entry['max_load_ratio'],
+            'stddev_ratio': entry['load_stddev_ratio']
+        }
+        results[f'ownership.join_moved_excess.nodes{nodes}'] = {
+            'unit': 'x', 'better': 'lower', 'value': entry['join_moved'] / entry['join_ideal'],
+            'moved': entry['join_moved']
+        }
+        results[f'ownership.lookup_us.nodes{nodes}'] = {
+            'unit': 'us', 'better': 'lower', 'value': entry['lookup_us']
+        }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='设备归属基准测试')
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--nodes', default='2,4,8,16')
+    args = parser.parse_args()
+
+    run(args.devices, [int(n) for n in args.nodes.split(',')])
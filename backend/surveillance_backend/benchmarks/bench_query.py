@@ -0,0 +1,70 @@
+"""事件查询基准测试：在不同规模的ai_events表上测量 GET /api/events 和 /api/statistics 延迟
+
+表按规模递增补齐数据（10k -> 1M -> 10M），同一数据库复用之前写入的数据。
+"""
+from datetime import datetime, timedelta
+import time
+import numpy as np
+from common import measure
+
+EVENT_TYPES = ['person_detection', 'face_detection', 'intrusion_detection']
+NUM_DEVICES = 50
+
+
+def seed_events(app, target_rows, chunk_size=50000, days=30):
+    """向ai_events补齐数据到target_rows行，返回实际写入行数"""
+    from src.models.device import AIEvent, db
+
+    table = AIEvent.__table__
+    rng = np.random.default_rng(target_rows)
+    now = datetime.utcnow()
+
+    with app.app_context():
+        existing = db.session.query(db.func.count(AIEvent.id)).scalar()
+        remaining = target_rows - existing
+
+        while remaining > 0:
+            n = min(chunk_size, remaining)
+            offsets = rng.integers(0, days * 86400, n)
+            devices = rng.integers(0, NUM_DEVICES, n)
+            types = rng.integers(0, len(EVENT_TYPES), n)
+            confidences = rng.random(n)
+            db.session.execute(table.insert(), [{
+                'device_id': f'bench-cam-{int(devices[i])}',
+                'event_type': EVENT_TYPES[types[i]],
+                'confidence': float(confidences[i]),
+                'bbox_x': 100,
+                'bbox_y': 100,
+                'bbox_width': 64,
+                'bbox_height': 128,
+                'image_path': None,
+                'metadata': {'source': 'bench'},
+                'created_at': now - timedelta(seconds=int(offsets[i]))
+            } for i in range(n)])
+            db.session.commit()
+            remaining -= n
+
+        return target_rows - existing
+
+
+def run_suite(app, sizes=(10000, 1000000, 10000000), repeat=20, time_budget=30):
+    client = app.test_client()
+    end = datetime.utcnow()
+    start = end - timedelta(days=1)
+    results = {}
+
+    for size in sizes:
+        seed_start = time.perf_counter()
+        seeded = seed_events(app, size)
+        print(f'ai_events补齐到 {size} 行（新写入 {seeded} 行，{time.perf_counter() - seed_start:.1f}s）')
+
+        queries = {
+            'events_page': '/api/events',
+            'events_device': '/api/events?device_id=bench-cam-7',
+            'events_range': f'/api/events?start_time={start.isoformat()}&end_time={end.isoformat()}',
+            'statistics': '/api/statistics'
+        }
+        for name, url in queries.items():
+            results[f'query.{name}.{size}'] = measure(lambda: client.get(url), repeat, time_budget=time_budget)
+
+    return results
@@ -0,0 +1,174 @@
+"""分析调度基准测试：在虚拟时钟上模拟大量摄像头，检验预算遵守、运动提升延迟和帧率分配
+
+摄像头分为出入口（频繁运动）、普通区域（偶尔运动）和走廊（很少运动）三类，
+按帧率逐帧驱动调度器，检测耗时和检测数为模拟值，不运行真实检测模型。
+结束时通过 /api/ai/status 读取分配结果。
+
+用法:
+    python benchmarks/bench_scheduler.py --cameras 300 --seconds 120 --budget 4000
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from common import create_app
+
+from src.services import scheduler as scheduler_module
+from src.services.scheduler import AnalysisScheduler
+
+# 类别: (占比, 平均运动间隔秒, 运动持续秒范围)
+PROFILES = {
+    'entrance': (0.1, 15, (5, 20)),
+    'office': (0.3, 60, (3, 10)),
+    'corridor': (0.6, 600, (2, 5))
+}
+
+
+class VirtualClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def motion_windows(rng, profile, seconds):
+    """生成一台摄像头的运动时间段"""
+    _, interval, (low, high) = PROFILES[profile]
+    windows = []
+    t = rng.expovariate(1 / interval)
+    while t < seconds:
+        duration = rng.uniform(low, high)
+        windows.append((t, t + duration))
+        t += duration + rng.expovariate(1 / interval)
+    return windows
+
+
+def simulate(cameras=300, seconds=120, budget_ms=4000, input_fps=25, seed=0):
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    scheduler = AnalysisScheduler(budget_ms, clock=clock)
+
+    devices = []
+    for n in range(cameras):
+        fraction = n / cameras
+        profile = 'entrance' if fraction < PROFILES['entrance'][0] else \
+            'office' if fraction < PROFILES['entrance'][0] + PROFILES['office'][0] else 'corridor'
+        device_id = f'cam-{n:04d}'
+        scheduler.add_device(device_id, priority=2 if profile == 'entrance' else 1)
+        devices.append({
+            'device_id': device_id,
+            'profile': profile,
+            'cost_ms': rng.uniform(30, 60),
+            'windows': motion_windows(rng, profile, seconds),
+            'window_index': 0,
+            'motion_analyses': 0,
+            'idle_analyses': 0,
+            'boost_pending': None
+        })
+
+    boost_latencies = []
+    used = []
+    motion_seconds = 0.0
+    idle_seconds = 0.0
+    step = 1 / input_fps
+    frames = 0
+    overhead = 0.0
+
+    for tick in range(int(seconds * input_fps)):
+        now = clock.now = tick * step
+        if tick % input_fps == 0 and now >= 1:
+            used.append(scheduler.used_ms)
+
+        for device in devices:
+            windows = device['windows']
+            while device['window_index'] < len(windows) and windows[device['window_index']][1] < now:
+                device['window_index'] += 1
+            window = windows[device['window_index']] if device['window_index'] < len(windows) else None
+            moving = window is not None and window[0] <= now
+            if moving and device['boost_pending'] is None and now - window[0] < step:
+                device['boost_pending'] = now
+            if moving:
+                motion_seconds += step
+            else:
+                idle_seconds += step
+
+            start = time.perf_counter()
+            decision = scheduler.wants_frame(device['device_id'], now)
+            if decision is not None:
+                scheduler.observe_motion(device['device_id'], score=20.0 if moving else 1.0, now=now)
+                if decision == 'analyze' or scheduler.wants_frame(device['device_id'], now) == 'analyze':
+                    detections = rng.randint(1, 3) if moving else 0
+                    scheduler.record(device['device_id'], device['cost_ms'], detections, now)
+                    if moving:
+                        device['motion_analyses'] += 1
+                    else:
+                        device['idle_analyses'] += 1
+                    if moving and device['boost_pending'] is not None:
+                        boost_latencies.append(now - device['boost_pending'])
+                        device['boost_pending'] = None
+            overhead += time.perf_counter() - start
+            frames += 1
+
+    boost_latencies.sort()
+    status = scheduler.status()
+    return {
+        'cameras': cameras,
+        'seconds': seconds,
+        'budget_ms': budget_ms,
+        'uniform_fps': budget_ms / sum(d['cost_ms'] for d in devices),
+        'motion_fps': sum(d['motion_analyses'] for d in devices) / motion_seconds if motion_seconds else 0,
+        'idle_fps': sum(d['idle_analyses'] for d in devices) / idle_seconds if idle_seconds else 0,
+        'boost_latency_p50_ms': boost_latencies[len(boost_latencies) // 2] * 1000 if boost_latencies else None,
+        'boost_latency_p99_ms': boost_latencies[int(len(boost_latencies) * 0.99)] * 1000 if boost_latencies else None,
+        'used_ms_mean': statistics.mean(used) if used else 0,
+        'used_ms_max': max(used) if used else 0,
+        'overhead_us_per_frame': overhead / frames * 1e6,
+        'scheduler': scheduler,
+        'status': status
+    }
+
+
+def run_suite(app, cameras=300, seconds=120, budget_ms=4000):
+    result = simulate(cameras, seconds, budget_ms)
+
+    # 通过接口读取同一调度器的分配结果
+    scheduler_module._scheduler = result.pop('scheduler')
+    status = app.test_client().get('/api/ai/status').get_json()['data']
+    scheduler_module._scheduler = None
+    result.pop('status')
+    result['api_device_count'] = status['device_count']
+    result['api_allocated_ms'] = status['allocated_ms']
+    print(result)
+
+    return {
+        f'scheduler.motion_fps.{cameras}': {
+            'unit': 'fps', 'better': 'higher', 'value': result['motion_fps'],
+            'uniform_fps': result['uniform_fps'], 'idle_fps': result['idle_fps']
+        },
+        f'scheduler.boost_latency_p99_ms.{cameras}': {
+            'unit': 'ms', 'better': 'lower', 'value': result['boost_latency_p99_ms'],
+            'p50': result['boost_latency_p50_ms']
+        },
+        f'scheduler.budget_used_max_ms.{cameras}': {
+            'unit': 'ms/s', 'better': 'lower', 'value': result['used_ms_max'],
+            'budget_ms': budget_ms, 'mean': result['used_ms_mean']
+        },
+        f'scheduler.overhead_us_per_frame.{cameras}': {
+            'unit': 'us', 'better': 'lower', 'value': result['overhead_us_per_frame']
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='分析调度基准测试')
+    parser.add_argument('--cameras', type=int, default=300)
+    parser.add_argument('--seconds', type=int, default=120, help='模拟时长（虚拟时间）')
+    parser.add_argument('--budget', type=float, default=4000, help='每秒检测耗时预算（毫秒）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run_suite(create_app(os.path.join(tmp_dir, 'bench.db')), args.cameras, args.seconds, args.budget)
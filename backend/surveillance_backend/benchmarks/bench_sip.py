@@ -0,0 +1,340 @@
+"""GB28181信令负载测试：本地模拟大量设备的注册、心跳、目录查询与点播
+
+模拟器在一个UDP套接字上复用所有模拟设备，按Call-ID和目标设备ID分发消息。
+默认会以子进程方式启动 flask gb28181 serve（使用临时数据库并预置设备），
+统计注册速率、心跳往返延迟、服务进程CPU占用以及设备状态是否正确写回数据库。
+
+用法:
+    # 10000台设备，60秒心跳，持续观察120秒
+    python benchmarks/bench_sip.py --devices 10000 --keepalive 60 --duration 120
+    # 对已运行的信令服务施压
+    python benchmarks/bench_sip.py --server 127.0.0.1:5060 --devices 1000
+"""
+import os
+import sys
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from common import BACKEND_DIR, create_app
+
+from src.services.gb28181 import SipMessage, digest_response, parse_digest, sip_user, random_token
+
+SERVER_ID = '34020000002000000001'
+DOMAIN = SERVER_ID[:10]
+PASSWORD = '12345678'
+
+
+def device_ids(count):
+    """模拟设备ID（类型码132为IPC）"""
+    return [f'{DOMAIN}132{n:07d}' for n in range(count)]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def process_cpu_seconds(pid):
+    """读取/proc中进程的用户态+内核态CPU时间"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class SimulatedDevices(asyncio.DatagramProtocol):
+    """在同一UDP端口上模拟多台GB28181设备"""
+
+    def __init__(self, server_addr, ids, password=PASSWORD, channels=4):
+        self.server_addr = server_addr
+        self.ids = ids
+        self.password = password
+        self.channels = channels
+        self.transport = None
+        self.local_addr = None
+        self.pending = {}
+        self.stats = {'register_failures': 0, 'keepalive_timeouts': 0, 'catalog_queries': 0, 'invites': 0}
+        self.keepalive_latencies = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.local_addr = transport.get_extra_info('sockname')
+
+    def datagram_received(self, data, addr):
+        message = SipMessage.parse(data)
+        if not message.is_request:
+            future = self.pending.pop(message.call_id, None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        elif message.method == 'MESSAGE':
+            self.reply(message, 200, 'OK')
+            if b'<CmdType>Catalog</CmdType>' in message.body:
+                self.stats['catalog_queries'] += 1
+                self.send_catalog(message)
+        elif message.method == 'INVITE':
+            self.stats['invites'] += 1
+            device_id = sip_user(message.header('to'))
+            sdp = (f'v=0\r\no={device_id} 0 0 IN IP4 {self.local_addr[0]}\r\ns=Play\r\n'
+                   f'c=IN IP4 {self.local_addr[0]}\r\nt=0 0\r\nm=video 15060 RTP/AVP 96\r\n'
+                   f'a=sendonly\r\na=rtpmap:96 PS/90000\r\n').encode()
+            self.reply(message, 200, 'OK', [('content-type', 'APPLICATION/SDP')], sdp)
+        elif message.method in ('BYE', 'OPTIONS'):
+            self.reply(message, 200, 'OK')
+
+    def reply(self, request, code, reason, headers=(), body=b''):
+        response_headers = [(name, value) for name, value in request.headers
+                            if name in ('via', 'from', 'to', 'call-id', 'cseq')]
+        response_headers[2:3] = [('to', f"{request.header('to')};tag={random_token(8)}")]
+        response_headers.extend(headers)
+        self.transport.sendto(SipMessage(f'SIP/2.0 {code} {reason}', response_headers, body).to_bytes(),
+                              self.server_addr)
+
+    def request(self, method, device_id, call_id=None, cseq=1, headers=(), body=b''):
+        call_id = call_id or random_token(20)
+        request_headers = [
+            ('via', f'SIP/2.0/UDP {self.local_addr[0]}:{self.local_addr[1]};rport;branch=z9hG4bK{random_token(12)}'),
+            ('from', f'<sip:{device_id}@{DOMAIN}>;tag={random_token(8)}'),
+            ('to', f'<sip:{device_id}@{DOMAIN}>' if method == 'REGISTER' else f'<sip:{SERVER_ID}@{DOMAIN}>'),
+            ('call-id', call_id),
+            ('cseq', f'{cseq} {method}'),
+            ('max-forwards', '70')
+        ]
+        request_headers.extend(headers)
+        uri = f'sip:{DOMAIN}' if method == 'REGISTER' else f'sip:{SERVER_ID}@{DOMAIN}'
+        return SipMessage(f'{method} {uri} SIP/2.0', request_headers, body)
+
+    async def send(self, request, timeout=5):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request.call_id] = future
+        self.transport.sendto(request.to_bytes(), self.server_addr)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request.call_id, None)
+
+    async def register(self, device_id, expires=3600):
+        """REGISTER -> 401 -> 带摘要认证的REGISTER -> 200"""
+        call_id = random_token(20)
+        try:
+            response = await self.send(self.request('REGISTER', device_id, call_id, 1,
+                                                    [('expires', str(expires))]))
+            if response.status_code == 401:
+                challenge = parse_digest(response.header('www-authenticate'))
+                params = {'username': device_id, 'realm': challenge['realm'], 'nonce': challenge['nonce'],
+                          'uri': f'sip:{DOMAIN}'}
+                params['response'] = digest_response(params, 'REGISTER', self.password)
+                authorization = 'Digest ' + ', '.join(f'{key}="{value}"' for key, value in params.items())
+                response = await self.send(self.request('REGISTER', device_id, call_id, 2, [
+                    ('expires', str(expires)), ('authorization', authorization + ', algorithm=MD5')
+                ]))
+            if response.status_code != 200:
+                self.stats['register_failures'] += 1
+                return False
+            return True
+        except asyncio.TimeoutError:
+            self.stats['register_failures'] += 1
+            return False
+
+    async def keepalive(self, device_id, sn):
+        body = (f'<?xml version="1.0" encoding="GB2312"?>\r\n<Notify>\r\n<CmdType>Keepalive</CmdType>\r\n'
+                f'<SN>{sn}</SN>\r\n<DeviceID>{device_id}</DeviceID>\r\n<Status>OK</Status>\r\n</Notify>\r\n')
+        request = self.request('MESSAGE', device_id, headers=[('content-type', 'Application/MANSCDP+xml')],
+                               body=body.encode('gb2312'))
+        start = time.perf_counter()
+        try:
+            await self.send(request)
+            self.keepalive_latencies.append(time.perf_counter() - start)
+        except asyncio.TimeoutError:
+            self.stats['keepalive_timeouts'] += 1
+
+    def send_catalog(self, query):
+        device_id = sip_user(query.uri) or sip_user(query.header('to'))
+        sn = query.body.split(b'<SN>', 1)[1].split(b'</SN>', 1)[0].decode()
+        items = ''.join(
+            f'<Item>\r\n<DeviceID>{device_id[:10]}131{n:07d}</DeviceID>\r\n<Name>通道{n + 1}</Name>\r\n'
+            f'<Manufacturer>模拟设备</Manufacturer>\r\n<Model>SIM</Model>\r\n<Status>ON</Status>\r\n</Item>\r\n'
+            for n in range(self.channels))
+        body = (f'<?xml version="1.0" encoding="GB2312"?>\r\n<Response>\r\n<CmdType>Catalog</CmdType>\r\n'
+                f'<SN>{sn}</SN>\r\n<DeviceID>{device_id}</DeviceID>\r\n<SumNum>{self.channels}</SumNum>\r\n'
+                f'<DeviceList Num="{self.channels}">\r\n{items}</DeviceList>\r\n</Response>\r\n')
+        request = self.request('MESSAGE', device_id, headers=[('content-type', 'Application/MANSCDP+xml')],
+                               body=body.encode('gb2312'))
+        self.transport.sendto(request.to_bytes(), self.server_addr)
+
+
+async def run_load(server_addr, count, keepalive_interval, duration, register_rate, server_pid=None):
+    loop = asyncio.get_running_loop()
+    ids = device_ids(count)
+    transport, devices = await loop.create_datagram_endpoint(
+        lambda: SimulatedDevices(server_addr, ids), local_addr=('127.0.0.1', 0))
+    sock = transport.get_extra_info('socket')
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+
+    # 按给定速率发起注册
+    start = time.perf_counter()
+    cpu_start = process_cpu_seconds(server_pid) if server_pid else None
+    tasks = []
+    for n, device_id in enumerate(ids):
+        tasks.append(asyncio.create_task(devices.register(device_id)))
+        delay = start + (n + 1) / register_rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    registered = sum(await asyncio.gather(*tasks))
+    register_seconds = time.perf_counter() - start
+    register_cpu = process_cpu_seconds(server_pid) - cpu_start if server_pid else None
+    print(f'注册完成: {registered}/{count}，用时 {register_seconds:.1f}s')
+
+    # 心跳阶段：每台设备在随机相位上按固定周期发心跳
+    async def keepalive_loop(device_id):
+        await asyncio.sleep(random.uniform(0, keepalive_interval))
+        sn = 1
+        while True:
+            await devices.keepalive(device_id, sn)
+            sn += 1
+            await asyncio.sleep(keepalive_interval)
+
+    cpu_start = process_cpu_seconds(server_pid) if server_pid else None
+    keepalive_tasks = [asyncio.create_task(keepalive_loop(device_id)) for device_id in ids]
+    await asyncio.sleep(duration)
+    keepalive_cpu = process_cpu_seconds(server_pid) - cpu_start if server_pid else None
+    for task in keepalive_tasks:
+        task.cancel()
+    await asyncio.gather(*keepalive_tasks, return_exceptions=True)
+
+    transport.close()
+    latencies = devices.keepalive_latencies
+    return {
+        'devices': count,
+        'registered': registered,
+        'register_seconds': register_seconds,
+        'registrations_per_second': registered / register_seconds,
+        'register_cpu_seconds': register_cpu,
+        'keepalive_interval': keepalive_interval,
+        'keepalives': len(latencies),
+        'keepalives_per_second': len(latencies) / duration,
+        'keepalive_timeouts': devices.stats['keepalive_timeouts'],
+        'keepalive_p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'keepalive_p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        'keepalive_p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        'server_cpu_percent': keepalive_cpu / duration * 100 if server_pid else None,
+        'register_failures': devices.stats['register_failures']
+    }
+
+
+def seed_devices(app, count):
+    """预置GB28181设备记录"""
+    from src.models.device import Device, db
+
+    with app.app_context():
+        existing = {row[0] for row in db.session.query(Device.gb_device_id).filter(Device.protocol == 'GB28181')}
+        rows = [{
+            'device_id': f'gb-{device_id}',
+            'name': f'模拟设备{n}',
+            'protocol': 'GB28181',
+            'ip_address': '127.0.0.1',
+            'port': 5060,
+            'status': 'offline',
+            'gb_device_id': device_id,
+            'gb_channel_id': device_id
+        } for n, device_id in enumerate(device_ids(count)) if device_id not in existing]
+        if rows:
+            db.session.execute(Device.__table__.insert(), rows)
+            db.session.commit()
+
+
+def count_online(app):
+    from src.models.device import Device
+
+    with app.app_context():
+        return Device.query.filter(Device.protocol == 'GB28181', Device.status == 'online').count()
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(database_path, port, flush_interval=1):
+    """以子进程启动信令服务，等待其可以应答"""
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database_path}', LOG_LEVEL='WARNING',
+               GB28181_FLUSH_INTERVAL=str(flush_interval), GB28181_SIP_IP='127.0.0.1',
+               GB28181_SIP_ID=SERVER_ID, GB28181_PASSWORD=PASSWORD)
+    process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'src.main', 'gb28181', 'serve',
+                                '--host', '127.0.0.1', '--port', str(port)], cwd=BACKEND_DIR, env=env)
+
+    options = SipMessage('OPTIONS sip:127.0.0.1 SIP/2.0', [
+        ('via', 'SIP/2.0/UDP 127.0.0.1:1;branch=z9hG4bKprobe'), ('from', '<sip:probe@127.0.0.1>;tag=1'),
+        ('to', '<sip:probe@127.0.0.1>'), ('call-id', 'probe'), ('cseq', '1 OPTIONS')
+    ]).to_bytes()
+    deadline = time.time() + 60
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.settimeout(0.5)
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('信令服务启动失败')
+            s.sendto(options, ('127.0.0.1', port))
+            try:
+                s.recv(4096)
+                return process
+            except socket.timeout:
+                continue
+    process.kill()
+    raise RuntimeError('信令服务启动超时')
+
+
+def run_suite(app, devices=10000, keepalive=60, duration=60, register_rate=1000, flush_interval=1):
+    """在给定应用的数据库上预置设备并启动信令服务子进程进行负载测试"""
+    seed_devices(app, devices)
+    database_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '', 1)
+    port = free_port()
+    process = spawn_server(database_path, port, flush_interval)
+    try:
+        result = asyncio.run(run_load(('127.0.0.1', port), devices, keepalive, duration,
+                                      register_rate, process.pid))
+        time.sleep(flush_interval * 2)
+        result['db_online'] = count_online(app)
+    finally:
+        process.terminate()
+        process.wait(10)
+    print(result)
+
+    return {
+        f'sip.registrations_per_second.{devices}': {
+            'unit': 'registrations/s', 'better': 'higher', 'value': result['registrations_per_second'],
+            'register_failures': result['register_failures']
+        },
+        f'sip.keepalive_p99_ms.{devices}': {
+            'unit': 'ms', 'better': 'lower', 'value': result['keepalive_p99_ms'],
+            'p50': result['keepalive_p50_ms'], 'p95': result['keepalive_p95_ms'],
+            'timeouts': result['keepalive_timeouts']
+        },
+        f'sip.server_cpu_percent.{devices}': {
+            'unit': '%', 'better': 'lower', 'value': result['server_cpu_percent'],
+            'keepalives_per_second': result['keepalives_per_second'], 'db_online': result['db_online']
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GB28181信令负载测试')
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--keepalive', type=float, default=60, help='心跳周期（秒）')
+    parser.add_argument('--duration', type=float, default=120, help='心跳阶段观察时长（秒）')
+    parser.add_argument('--register-rate', type=float, default=1000, help='每秒发起的注册数')
+    parser.add_argument('--server', help='已运行的信令服务地址 host:port，不指定则启动子进程')
+    args = parser.parse_args()
+
+    if args.server:
+        host, port = args.server.rsplit(':', 1)
+        print(asyncio.run(run_load((host, int(port)), args.devices, args.keepalive, args.duration,
+                                   args.register_rate)))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_suite(create_app(os.path.join(tmp_dir, 'bench.db')), args.devices, args.keepalive,
+                      args.duration, args.register_rate)
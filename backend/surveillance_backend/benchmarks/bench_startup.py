@@ -0,0 +1,99 @@
+"""进程启动基准测试：各进程角色的启动耗时和常驻内存
+
+每次启动一个新的Python进程，以指定的 PROCESS_ROLE 导入应用（临时SQLite数据库），记录：
+    wall      从创建进程到应用初始化完成的时间（含解释器启动和模块导入）
+    startup   应用报告的初始化耗时（main.py开始执行到初始化完成）
+    rss       初始化完成后的常驻内存
+另外比较api进程跳过建表（DB_CREATE_TABLES=0）的启动耗时，并在api进程中测量第一次检测（触发模型加载）与之后检测的耗时差，即延迟加载的一次性开销。
+
+用法:
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from common import BACKEND_DIR, latency_result
+
+# 名称: (PROCESS_ROLE, 额外环境变量)
+CASES = {
+    'api': ('api', {}),
+    'api_no_create_all': ('api', {'DB_CREATE_TABLES': '0'}),
+    'analysis': ('analysis', {}),
+    'stream': ('stream', {}),
+    'all': ('all', {})
+}
+
+CHILD = '''
+import os, sys, json, time
+sys.path.insert(0, os.environ['BACKEND_DIR'])
+from src.main import app
+from src.services import roles
+result = {'startup': roles.startup_seconds, 'rss': roles.rss_bytes()}
+if os.environ.get('MEASURE_DETECT'):
+    import numpy as np
+    from src.routes.ai_analysis import ai_engine
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    result['models_loaded'] = ai_engine.models_loaded
+    for name in ('first_detect', 'second_detect'):
+        start = time.perf_counter()
+        ai_engine.detect(frame)
+        result[name] = time.perf_counter() - start
+print(json.dumps(result), flush=True)
+'''
+
+
+def launch(role, database_path, measure_detect=False, extra_env=None):
+    env = dict(os.environ, PROCESS_ROLE=role, BACKEND_DIR=BACKEND_DIR, LOG_LEVEL='WARNING',
+               DATABASE_URL=f'sqlite:///{database_path}', **(extra_env or {}))
+    if measure_detect:
+        env['MEASURE_DETECT'] = '1'
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD], env=env, capture_output=True, text=True,
+                            check=True).stdout
+    wall = time.perf_counter() - start
+    return {'wall': wall, **json.loads(output.strip().splitlines()[-1])}
+
+
+def run(repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_path = os.path.join(tmp_dir, 'bench.db')
+        # 先建表，之后的启动与生产环境一样面对已有的数据库
+        launch('api', database_path)
+        for name, (role, extra_env) in CASES.items():
+            samples = [launch(role, database_path, extra_env=extra_env) for _ in range(repeat)]
+            results[name] = {
+                'wall': [s['wall'] for s in samples],
+                'startup': [s['startup'] for s in samples],
+                'rss_mb': statistics.median(s['rss'] for s in samples) / 2 ** 20
+            }
+            print({'case': name, 'wall': statistics.median(results[name]['wall']),
+                   'startup': statistics.median(results[name]['startup']), 'rss_mb': results[name]['rss_mb']})
+        detect = launch('api', database_path, measure_detect=True)
+        results['lazy_load'] = detect['first_detect'] - detect['second_detect']
+        print({'models_loaded_at_start': detect['models_loaded'], 'lazy_load_seconds': results['lazy_load']})
+    return results
+
+
+def run_suite(app, repeat=5):
+    results = {}
+    for name, entry in run(repeat).items():
+        if name == 'lazy_load':
+            results['startup.model_lazy_load'] = {'unit': 'seconds', 'better': 'lower', 'value': entry}
+            continue
+        results[f'startup.wall.{name}'] = latency_result(entry['wall'])
+        results[f'startup.init.{name}'] = latency_result(entry['startup'])
+        results[f'startup.rss.{name}'] = {'unit': 'MB', 'better': 'lower', 'value': entry['rss_mb']}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='进程启动基准测试')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeat)
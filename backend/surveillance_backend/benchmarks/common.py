@@ -0,0 +1,114 @@
+"""基准测试公共工具：合成数据、计时统计、临时应用"""
+import os
+import sys
+import time
+import shutil
+import subprocess
+import statistics
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import cv2
+
+RESOLUTIONS = {
+    '480p': (854, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160)
+}
+
+
+def synth_frame(size, seed=0):
+    """合成测试帧：渐变背景 + 运动矩形 + 人脸状椭圆 + 噪声，保证检测器有实际工作量"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (x + y) / 2
+    frame[..., 1] = x
+    frame[..., 2] = y
+
+    for _ in range(8):
+        cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(width * 0.05), int(height * 0.25)
+        cv2.rectangle(frame, (cx, cy), (cx + w, cy + h), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        cv2.ellipse(frame, (cx + w // 2, cy - h // 6), (w // 3, h // 6), 0, 0, 360, (180, 200, 230), -1)
+
+    noise = rng.integers(0, 24, frame.shape, dtype=np.uint8)
+    return cv2.add(frame, noise)
+
+
+def synth_video(path, duration, size=(1280, 720), fps=25):
+    """合成测试视频，优先使用ffmpeg（testsrc + H.264），否则使用OpenCV写入MJPG"""
+    if shutil.which('ffmpeg'):
+        subprocess.run([
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f'testsrc=size={size[0]}x{size[1]}:rate={fps}:duration={duration}',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(fps * 2),
+            path
+        ], check=True)
+        return path
+
+    path = os.path.splitext(path)[0] + '.avi'
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    for i in range(int(duration * fps)):
+        frame = synth_frame(size, seed=i % 50)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def measure(function, repeat=20, warmup=1, time_budget=None):
+    """多次执行并统计单次耗时（秒）
+
+    time_budget: 总耗时上限（秒），慢速用例（如4K HOG检测）达到上限后提前结束，至少执行一次
+    """
+    for _ in range(warmup):
+        function()
+
+    samples = []
+    deadline = time.perf_counter() + time_budget if time_budget else None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+        if deadline and time.perf_counter() > deadline:
+            break
+
+    return latency_result(samples)
+
+
+def latency_result(samples):
+    """耗时统计结果，越低越好"""
+    ordered = sorted(samples)
+    return {
+        'unit': 'seconds',
+        'better': 'lower',
+        'value': statistics.median(ordered),
+        'mean': statistics.fmean(ordered),
+        'min': ordered[0],
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'samples': len(ordered)
+    }
+
+
+def throughput_result(count, seconds, unit='ops/s'):
+    """吞吐量结果，越高越好"""
+    return {
+        'unit': unit,
+        'better': 'higher',
+        'value': count / seconds if seconds > 0 else 0.0,
+        'count': count,
+        'seconds': seconds
+    }
+
+
+def create_app(database_path):
+    """以临时数据库导入Flask应用（每个进程只能导入一次）"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{database_path}'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from src.main import app
+    return app
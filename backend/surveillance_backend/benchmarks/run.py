@@ -0,0 +1,195 @@
+"""基准测试套件入口（完全离线运行）
+
+用法:
+    # 运行默认套件并保存结果
+    python benchmarks/run.py --out results.json
+    # 快速模式（较小的分辨率和数据规模）
+    python benchmarks/run.py --quick --out results.json
+    # 运行并与基线比较，出现回退时退出码为1
+    python benchmarks/run.py --out results.json --baseline baseline.json
+    # 只比较两份已有结果
+    python benchmarks/run.py --compare results.json --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import common
+import numpy as np
+import cv2
+
+SUITES = ['analysis', 'ingest', 'query', 'export', 'faces', 'scheduler', 'ownership', 'decode', 'archive', 'batch', 'sip', 'llhls', 'lifecycle', 'startup']
+DEFAULT_SUITES = ['analysis', 'ingest', 'query', 'export', 'faces', 'scheduler', 'ownership', 'decode', 'archive', 'startup']
+
+
+def suite_options(suite, quick):
+    """各套件参数；快速模式用于开发时快速回归"""
+    if suite == 'analysis':
+        return {'resolutions': ('480p', '720p') if quick else tuple(common.RESOLUTIONS)}
+    if suite == 'ingest':
+        return {'count': 200 if quick else 1000}
+    if suite == 'query':
+        return {'sizes': (10000, 100000) if quick else (10000, 1000000, 10000000)}
+    if suite == 'export':
+        return {'rows': 100000 if quick else 1000000}
+    if suite == 'faces':
+        return {'sizes': (1000, 100000) if quick else (1000, 10000, 100000, 1000000)}
+    if suite == 'scheduler':
+        return {'seconds': 30 if quick else 120}
+    if suite == 'decode':
+        return {'duration': 10 if quick else 30}
+    if suite == 'archive':
+        return {'rows': 100000 if quick else 1000000}
+    if suite == 'batch':
+        return {'duration': 10 if quick else 60}
+    if suite == 'sip':
+        return {'devices': 1000, 'keepalive': 10, 'duration': 20} if quick else {'devices': 10000}
+    if suite == 'llhls':
+        return {'seconds': 25 if quick else 40}
+    if suite == 'lifecycle':
+        return {'trials': 2 if quick else 5}
+    if suite == 'startup':
+        return {'repeat': 3 if quick else 10}
+    return {}
+
+
+def environment():
+    """记录运行环境，便于判断结果是否可比"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=common.BACKEND_DIR).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__
+    }
+
+
+def run(suites, quick=False):
+    import bench_analysis
+    import bench_ingest
+    import bench_query
+    import bench_export
+    import bench_face_search
+    import bench_scheduler
+    import bench_ownership
+    import bench_decode
+    import bench_archive
+    import bench_batch_analysis
+    import bench_sip
+    import bench_llhls
+    import bench_lifecycle
+    import bench_startup
+
+    modules = {
+        'analysis': bench_analysis,
+        'ingest': bench_ingest,
+        'query': bench_query,
+        'export': bench_export,
+        'faces': bench_face_search,
+        'scheduler': bench_scheduler,
+        'ownership': bench_ownership,
+        'decode': bench_decode,
+        'archive': bench_archive,
+        'batch': bench_batch_analysis,
+        'sip': bench_sip,
+        'llhls': bench_llhls,
+        'lifecycle': bench_lifecycle,
+        'startup': bench_startup
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = common.create_app(os.path.join(tmp_dir, 'bench.db'))
+        for suite in suites:
+            print(f'== {suite}')
+            start = time.perf_counter()
+            results.update(modules[suite].run_suite(app, **suite_options(suite, quick)))
+            print(f'== {suite} 完成，用时 {time.perf_counter() - start:.1f}s')
+
+    return {'environment': environment(), 'quick': quick, 'results': results}
+
+
+def compare(current, baseline, threshold):
+    """与基线比较，返回回退项列表"""
+    regressions = []
+    rows = []
+    for name, entry in sorted(current['results'].items()):
+        base = baseline['results'].get(name)
+        if not base or not base.get('value'):
+            rows.append((name, None, entry['value'], None, 'new'))
+            continue
+
+        ratio = entry['value'] / base['value']
+        if entry['better'] == 'lower':
+            regressed = ratio > 1 + threshold
+            improved = ratio < 1 - threshold
+        else:
+            regressed = ratio < 1 - threshold
+            improved = ratio > 1 + threshold
+
+        status = 'REGRESSION' if regressed else 'improved' if improved else 'ok'
+        rows.append((name, base['value'], entry['value'], ratio, status))
+        if regressed:
+            regressions.append(name)
+
+    for name, old, new, ratio, status in rows:
+        old_text = f'{old:.6g}' if old is not None else '-'
+        ratio_text = f'{ratio:.3f}x' if ratio is not None else '-'
+        print(f'{name:<48} {old_text:>14} {new:>14.6g} {ratio_text:>9}  {status}')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分析与写入热路径基准测试')
+    parser.add_argument('--suites', default=','.join(DEFAULT_SUITES),
+                        help=f'逗号分隔，可选: {",".join(SUITES)}')
+    parser.add_argument('--quick', action='store_true', help='快速模式')
+    parser.add_argument('--out', help='结果输出JSON文件')
+    parser.add_argument('--baseline', help='基线结果JSON文件')
+    parser.add_argument('--compare', help='只比较该结果文件与基线，不运行测试')
+    parser.add_argument('--threshold', type=float, default=0.10, help='回退判定阈值（相对变化）')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare) as f:
+            current = json.load(f)
+    else:
+        suites = [s for s in args.suites.split(',') if s]
+        unknown = set(suites) - set(SUITES)
+        if unknown:
+            parser.error(f'未知套件: {",".join(sorted(unknown))}')
+        current = run(suites, args.quick)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(current, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('quick') != current.get('quick'):
+            print('警告: 结果与基线的运行模式（--quick）不同，比较结果仅供参考')
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} 项性能回退（阈值 {args.threshold:.0%}）')
+            return 1
+    elif args.compare:
+        parser.error('--compare 需要同时指定 --baseline')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,38 @@
 import os
 import sys
+import time
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+_started = time.perf_counter()
+
 from flask import Flask, send_from_directory
+from sqlalchemy import event
+import click
+from src.services.log import configure_logging
+
+# 在导入各模块之前配置日志
+configure_logging()
+
 from src.models.user import db
-from src.models.device import Device, AIEvent
+from src.models.device import Device, AIEvent, EventPartition
+from src.models.cluster import WorkerNode, DeviceLease
 from src.routes.user import user_bp
 from src.routes.device import device_bp
 from src.routes.stream import stream_bp
 from src.routes.ai_analysis import ai_bp
+from src.routes.face import face_bp
+from src.routes.metrics import metrics_bp
+from src.routes.admin import admin_bp
+from src.routes.gb28181 import gb28181_bp
+from src.routes.cluster import cluster_bp
+from src.services.metrics import instrument_sqlalchemy
+from src.services.profiling import PROFILING_ENABLED, init_profiling
+from src.services.gb28181 import start_server as start_gb28181_server
+from src.services.ownership import CLUSTER_ENABLED, get_cluster
+from src.services.event_archive import EVENT_ARCHIVE_ENABLED, get_archive
+from src.services.stream_lifecycle import get_lifecycle
+from src.services.roles import has_role, mark_ready
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -18,13 +41,71 @@ app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(device_bp, url_prefix='/api')
 app.register_blueprint(stream_bp, url_prefix='/api')
 app.register_blueprint(ai_bp, url_prefix='/api')
+app.register_blueprint(face_bp, url_prefix='/api')
+app.register_blueprint(gb28181_bp, url_prefix='/api')
+app.register_blueprint(cluster_bp, url_prefix='/api')
+app.register_blueprint(metrics_bp)
+if PROFILING_ENABLED:
+    app.register_blueprint(admin_bp, url_prefix='/api')
 
 # uncomment if you need to use database
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+os.makedirs(os.path.join(os.path.dirname(__file__), 'database'), exist_ok=True)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL', f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
 with app.app_context():
+    # SQLite默认的回滚日志模式下，读取期间的写入会等待到超时（如流式导出在整个响应期间保持读游标），
+    # WAL模式下读写互不阻塞
+    if db.engine.dialect.name == 'sqlite':
+        @event.listens_for(db.engine, 'connect')
+        def enable_sqlite_wal(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.close()
+
+# 多进程部署时设置 DB_CREATE_TABLES=0，部署时执行一次 flask --app src.main init-db
+if os.environ.get('DB_CREATE_TABLES', '1').lower() in ('1', 'true', 'yes'):
+    with app.app_context():
+        db.create_all()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """创建数据库表"""
     db.create_all()
+    click.echo('数据库表已创建')
+
+with app.app_context():
+    instrument_sqlalchemy(db.engine)
+    if PROFILING_ENABLED:
+        init_profiling(app, db.engine, db.Model)
+
+def start_services():
+    """启动后台子系统，在每个提供HTTP服务的进程中调用一次
+
+    调试模式的重载器父进程、离线分析进程池的工作进程和flask命令行也会导入本模块，
+    在导入时启动会重复运行FFmpeg等后台任务。以其他WSGI服务器运行时在每个工作进程中调用。
+    各子系统按进程角色（PROCESS_ROLE）启动；AI模型在第一次检测时加载（实时分析在分析线程中加载）。
+    """
+    # 多进程/多节点部署时加入集群，按一致性哈希确定设备归属
+    if CLUSTER_ENABLED:
+        get_cluster().start(app)
+
+    # 定期将热分区之前的月份归档为压缩分区文件
+    if EVENT_ARCHIVE_ENABLED and has_role('analysis'):
+        get_archive().start(app)
+
+    # 无人观看的视频流自动停止，预热设备的视频流保持运行
+    if has_role('stream'):
+        get_lifecycle().start(app)
+
+    # 在Web进程内运行GB28181信令服务（也可用 flask gb28181 serve 单独运行），设备注册在提供视频流的进程中
+    if os.environ.get('GB28181_ENABLED', '0').lower() in ('1', 'true', 'yes') and has_role('stream'):
+        start_gb28181_server(app)
+
+# 应用初始化耗时（/metrics 和 /api/cluster/status 中按角色报告）
+mark_ready(time.perf_counter() - _started)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -44,4 +125,7 @@ def serve(path):
 
 
 if __name__ == '__main__':
+    # 调试模式下重载器父进程只监视文件变化，后台子系统在实际提供服务的子进程中启动
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,44 @@
+from datetime import datetime
+from src.models.user import db
+
+class WorkerNode(db.Model):
+    """集群中的工作进程（心跳续约，过期视为离开）"""
+    __tablename__ = 'worker_nodes'
+
+    worker_id = db.Column(db.String(128), primary_key=True)
+    node_id = db.Column(db.String(64), nullable=False, index=True)
+    address = db.Column(db.String(256))  # 节点对外HTTP地址，用于转发请求
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            'worker_id': self.worker_id,
+            'node_id': self.node_id,
+            'address': self.address,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class DeviceLease(db.Model):
+    """设备资源（视频流、实时分析）的归属租约"""
+    __tablename__ = 'device_leases'
+
+    device_id = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(16), primary_key=True)  # stream, analysis
+    node_id = db.Column(db.String(64))
+    worker_id = db.Column(db.String(128), index=True)  # 为空表示等待新的归属节点接管
+    params = db.Column(db.JSON)  # 启动参数及运行信息（输出格式、输出路径、进程号等）
+    expires_at = db.Column(db.DateTime, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'device_id': self.device_id,
+            'kind': self.kind,
+            'node_id': self.node_id,
+            'worker_id': self.worker_id,
+            'params': self.params,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -29,6 +29,17 @@ class Device(db.Model):
     # RTSP流地址
     rtsp_url = db.Column(db.String(512))
     
+    # AI分析调度：帧率上下限与优先级（为空时使用调度器默认值）
+    analysis_min_fps = db.Column(db.Float)
+    analysis_max_fps = db.Column(db.Float)
+    analysis_priority = db.Column(db.Integer, default=1)
+    # 分析解码模式（full, noref, keyframe）与解码输出宽度（为空时不缩放）
+    decode_mode = db.Column(db.String(16), default='full')
+    decode_width = db.Column(db.Integer)
+    # 视频流预热：固定保持运行，或在预热时段内保持运行（'HH:MM-HH:MM[,HH:MM-HH:MM]'，本地时间）
+    stream_pinned = db.Column(db.Boolean, default=False)
+    stream_schedule = db.Column(db.String(256))
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -47,7 +58,14 @@ class Device(db.Model):
             'gb_channel_id': self.gb_channel_id,
             'gb_manufacturer': self.gb_manufacturer,
             'gb_model': self.gb_model,
-            'rtsp_url': self.rtsp_url
+            'rtsp_url': self.rtsp_url,
+            'analysis_min_fps': self.analysis_min_fps,
+            'analysis_max_fps': self.analysis_max_fps,
+            'analysis_priority': self.analysis_priority,
+            'decode_mode': self.decode_mode,
+            'decode_width': self.decode_width,
+            'stream_pinned': bool(self.stream_pinned),
+            'stream_schedule': self.stream_schedule
         }
 
 class AIEvent(db.Model):
@@ -63,7 +81,8 @@ class AIEvent(db.Model):
     bbox_width = db.Column(db.Integer)
     bbox_height = db.Column(db.Integer)
     image_path = db.Column(db.String(512))  # 事件截图路径
-    metadata = db.Column(db.JSON)  # 额外的事件元数据
+    # metadata为Declarative保留属性名，列名保持为metadata
+    event_metadata = db.Column('metadata', db.JSON)  # 额外的事件元数据
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # 关联设备
@@ -80,6 +99,36 @@ class AIEvent(db.Model):
             'bbox_width': self.bbox_width,
             'bbox_height': self.bbox_height,
             'image_path': self.image_path,
-            'metadata': self.metadata,
+            'metadata': self.event_metadata,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+class EventPartition(db.Model):
+    """已归档的ai_events月分区（压缩列式文件）"""
+    __tablename__ = 'event_partitions'
+    
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    status = db.Column(db.String(16), nullable=False, default='archiving')  # archiving, archived
+    path = db.Column(db.String(512), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)  # 分区时间范围 [start_time, end_time)
+    end_time = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, default=0)
+    min_id = db.Column(db.Integer)
+    max_id = db.Column(db.Integer)
+    event_counts = db.Column(db.JSON)  # 各设备各事件类型的行数 {device_id: {event_type: n}}
+    size_bytes = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'month': self.month,
+            'status': self.status,
+            'path': self.path,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'row_count': self.row_count,
+            'min_id': self.min_id,
+            'max_id': self.max_id,
+            'size_bytes': self.size_bytes,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,42 @@
+from flask import Blueprint, request, jsonify, Response
+from src.services.profiling import sample_stacks, to_collapsed, to_flamegraph
+import os
+
+admin_bp = Blueprint('admin', __name__)
+
+# 管理接口令牌，请求需携带 X-Admin-Token 头；未设置时管理接口不可用
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# 单次采样最长时间（秒）
+MAX_PROFILE_SECONDS = 60
+
+@admin_bp.before_request
+def check_admin_token():
+    if not ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': '未设置ADMIN_TOKEN，管理接口已禁用'}), 403
+    if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': '无权访问'}), 403
+
+@admin_bp.route('/admin/profile', methods=['GET', 'POST'])
+def capture_profile():
+    """对所有线程进行限时采样剖析，返回折叠栈或火焰图"""
+    try:
+        seconds = min(float(request.args.get('seconds', 5)), MAX_PROFILE_SECONDS)
+        interval = max(float(request.args.get('interval', 0.005)), 0.001)
+        output_format = request.args.get('format', 'collapsed')
+        
+        if output_format not in ('collapsed', 'svg'):
+            return jsonify({'success': False, 'message': '不支持的输出格式'}), 400
+        
+        try:
+            stacks = sample_stacks(seconds, interval)
+        except RuntimeError as e:
+            return jsonify({'success': False, 'message': str(e)}), 409
+        
+        if output_format == 'svg':
+            svg = to_flamegraph(stacks, title=f'{seconds:g}s, {sum(stacks.values())} samples')
+            return Response(svg, mimetype='image/svg+xml')
+        
+        return Response(to_collapsed(stacks), mimetype='text/plain')
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
@@ -1,5 +1,15 @@
 from flask import Blueprint, request, jsonify, current_app
 from src.models.device import Device, AIEvent, db
+from src.services.face_index import get_face_service
+from src.services.batch_analysis import BatchJob, batch_jobs, start_job, run_job
+from src.services.scheduler import get_scheduler, AI_DEFAULT_MAX_FPS, MOTION_PROBE_FPS
+from src.services.frame_source import open_frame_source
+from src.services.ownership import get_cluster, route_to_owner
+from src.services import metrics
+from src.services.roles import has_role, requires_role
+from src.routes.stream import StreamManager
+import click
+import logging
 import cv2
 import numpy as np
 import threading
@@ -10,31 +20,58 @@ from datetime import datetime
 import base64
 
 ai_bp = Blueprint('ai', __name__)
+logger = logging.getLogger(__name__)
+
+# 引擎使用的检测模型
+MODEL_NAMES = ('face_detector', 'person_detector')
 
 class AIAnalysisEngine:
     """AI视频分析引擎"""
     
     def __init__(self):
-        self.models = {}
+        self._models = None
+        self.models_lock = threading.Lock()
         self.analysis_threads = {}
-        self.load_models()
+    
+    @property
+    def models(self):
+        """AI模型（第一次使用时加载）"""
+        if self._models is None:
+            self.load_models()
+        return self._models
+    
+    @property
+    def models_loaded(self):
+        return self._models is not None
+    
+    def model_status(self):
+        """各模型的状态（not_loaded, loaded, failed），不触发加载"""
+        models = self._models
+        if models is None:
+            return {name: 'not_loaded' for name in MODEL_NAMES}
+        return {name: 'loaded' if models.get(name) is not None else 'failed' for name in MODEL_NAMES}
     
     def load_models(self):
-        """加载AI模型"""
-        try:
-            # 加载人脸检测器（使用OpenCV内置的Haar级联分类器）
-            face_cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-            if os.path.exists(face_cascade_path):
-                self.models['face_detector'] = cv2.CascadeClassifier(face_cascade_path)
-            
-            # 加载人体检测器（使用HOG描述符）
-            self.models['person_detector'] = cv2.HOGDescriptor()
-            self.models['person_detector'].setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-            
-            print("AI模型加载完成")
-            
-        except Exception as e:
-            print(f"AI模型加载失败: {e}")
+        """加载AI模型（多个线程同时调用时只加载一次）"""
+        with self.models_lock:
+            if self._models is not None:
+                return
+            models = {}
+            try:
+                # 加载人脸检测器（使用OpenCV内置的Haar级联分类器）
+                face_cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+                if os.path.exists(face_cascade_path):
+                    models['face_detector'] = cv2.CascadeClassifier(face_cascade_path)
+                
+                # 加载人体检测器（使用HOG描述符）
+                models['person_detector'] = cv2.HOGDescriptor()
+                models['person_detector'].setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+                
+                logger.info("AI模型加载完成", extra={'models': list(models)})
+                
+            except Exception:
+                logger.exception("AI模型加载失败")
+            self._models = models
     
     def detect_faces(self, frame):
         """人脸检测"""
@@ -42,10 +79,11 @@ class AIAnalysisEngine:
             if 'face_detector' not in self.models:
                 return []
             
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.models['face_detector'].detectMultiScale(
-                gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
-            )
+            with metrics.detector_latency.time(model='face_detector'):
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                faces = self.models['face_detector'].detectMultiScale(
+                    gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
+                )
             
             results = []
             for (x, y, w, h) in faces:
@@ -55,10 +93,12 @@ class AIAnalysisEngine:
                     'bbox': {'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)}
                 })
             
+            metrics.detections_per_frame.observe(len(results), model='face_detector')
             return results
             
-        except Exception as e:
-            print(f"人脸检测错误: {e}")
+        except Exception:
+            metrics.detector_errors.inc(model='face_detector')
+            logger.exception("人脸检测错误")
             return []
     
     def detect_persons(self, frame):
@@ -67,9 +107,10 @@ class AIAnalysisEngine:
             if 'person_detector' not in self.models:
                 return []
             
-            persons, weights = self.models['person_detector'].detectMultiScale(
-                frame, winStride=(8, 8), padding=(32, 32), scale=1.05
-            )
+            with metrics.detector_latency.time(model='person_detector'):
+                persons, weights = self.models['person_detector'].detectMultiScale(
+                    frame, winStride=(8, 8), padding=(32, 32), scale=1.05
+                )
             
             results = []
             for i, (x, y, w, h) in enumerate(persons):
@@ -80,24 +121,32 @@ class AIAnalysisEngine:
                         'bbox': {'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)}
                     })
             
+            metrics.detections_per_frame.observe(len(results), model='person_detector')
             return results
             
-        except Exception as e:
-            print(f"人员检测错误: {e}")
+        except Exception:
+            metrics.detector_errors.inc(model='person_detector')
+            logger.exception("人员检测错误")
             return []
     
-    def analyze_frame(self, frame, device_id, analysis_types=['face_detection', 'person_detection']):
-        """分析单帧图像"""
+    def detect(self, frame, analysis_types=['face_detection', 'person_detection']):
+        """对单帧图像执行检测（不保存结果）"""
         results = []
         
+        if 'face_detection' in analysis_types:
+            face_results = self.detect_faces(frame)
+            results.extend(face_results)
+        
+        if 'person_detection' in analysis_types:
+            person_results = self.detect_persons(frame)
+            results.extend(person_results)
+        
+        return results
+    
+    def analyze_frame(self, frame, device_id, analysis_types=['face_detection', 'person_detection']):
+        """分析单帧图像"""
         try:
-            if 'face_detection' in analysis_types:
-                face_results = self.detect_faces(frame)
-                results.extend(face_results)
-            
-            if 'person_detection' in analysis_types:
-                person_results = self.detect_persons(frame)
-                results.extend(person_results)
+            results = self.detect(frame, analysis_types)
             
             # 保存检测结果到数据库
             for result in results:
@@ -105,47 +154,206 @@ class AIAnalysisEngine:
             
             return results
             
-        except Exception as e:
-            print(f"帧分析错误: {e}")
+        except Exception:
+            logger.exception("帧分析错误", extra={'device_id': device_id})
             return []
     
+    def start_analysis(self, app, device, source, analysis_types):
+        """启动设备实时分析线程，分析帧率由全局调度器分配"""
+        self.stop_analysis(device.device_id)
+        get_scheduler().add_device(device.device_id, device.analysis_min_fps,
+                                   device.analysis_max_fps, device.analysis_priority)
+        
+        # 非完整解码或缩放时由ffmpeg限制输出帧率，不低于最高分析帧率和运动检测采样帧率
+        decode = {'mode': device.decode_mode or 'full', 'width': device.decode_width, 'fps': None}
+        if decode['mode'] != 'full' or decode['width']:
+            decode['fps'] = max(device.analysis_max_fps or AI_DEFAULT_MAX_FPS, MOTION_PROBE_FPS)
+        
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self.run_analysis,
+            args=(app, device.device_id, source, analysis_types, stop, decode),
+            name=f'analysis-{device.device_id}',
+            daemon=True
+        )
+        self.analysis_threads[device.device_id] = {
+            'thread': thread,
+            'stop': stop,
+            'source': source,
+            'analysis_types': analysis_types,
+            'decode': decode,
+            'start_time': time.time()
+        }
+        thread.start()
+    
+    def stop_analysis(self, device_id):
+        """停止设备实时分析"""
+        analysis = self.analysis_threads.pop(device_id, None)
+        if analysis is None:
+            return False
+        
+        analysis['stop'].set()
+        analysis['thread'].join(timeout=5)
+        get_scheduler().remove_device(device_id)
+        return True
+    
+    def run_analysis(self, app, device_id, source, analysis_types, stop, decode=None):
+        """持续解码视频流，只对调度器选中的帧做运动检测或分析"""
+        scheduler = get_scheduler()
+        analyze = lambda frame: self.analyze_frame(frame, device_id, analysis_types)
+        decode = decode or {}
+        capture = None
+        # 当前解码帧率按1秒窗口统计
+        window_start, window_frames = time.time(), 0
+        
+        with app.app_context():
+            while not stop.is_set():
+                if capture is None:
+                    capture = open_frame_source(source, decode.get('mode'), decode.get('width'), decode.get('fps'))
+                    if not capture.isOpened():
+                        capture = None
+                        metrics.decode_fps.set(0, device_id=device_id, source='live')
+                        stop.wait(5)
+                        window_start, window_frames = time.time(), 0
+                        continue
+                
+                if not capture.grab():
+                    # 断流后重连
+                    capture.release()
+                    capture = None
+                    metrics.decode_fps.set(0, device_id=device_id, source='live')
+                    stop.wait(1)
+                    window_start, window_frames = time.time(), 0
+                    continue
+                metrics.frames_decoded.inc(device_id=device_id, source='live')
+                window_frames += 1
+                now = time.time()
+                if now - window_start >= 1:
+                    metrics.decode_fps.set(window_frames / (now - window_start), device_id=device_id, source='live')
+                    window_start, window_frames = now, 0
+                
+                if scheduler.wants_frame(device_id) is None:
+                    continue
+                
+                ok, frame = capture.retrieve()
+                if ok:
+                    scheduler.submit(device_id, frame, analyze)
+        
+        if capture is not None:
+            capture.release()
+        metrics.decode_fps.remove(device_id=device_id, source='live')
+    
+    def save_detection_image(self, device_id, result, frame, name):
+        """保存检测区域截图，返回截图路径和截图"""
+        image_dir = f"/tmp/ai_detections/{device_id}"
+        os.makedirs(image_dir, exist_ok=True)
+        
+        bbox = result['bbox']
+        x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
+        roi = frame[y:y+h, x:x+w]
+        
+        image_path = f"{image_dir}/{name}.jpg"
+        cv2.imwrite(image_path, roi)
+        
+        return image_path, roi
+    
+    def build_event(self, device_id, result, image_path, metadata):
+        """根据检测结果构建事件"""
+        bbox = result['bbox']
+        return AIEvent(
+            device_id=device_id,
+            event_type=result['type'],
+            confidence=result['confidence'],
+            bbox_x=bbox['x'],
+            bbox_y=bbox['y'],
+            bbox_width=bbox['width'],
+            bbox_height=bbox['height'],
+            image_path=image_path,
+            event_metadata=metadata
+        )
+    
     def save_detection_result(self, device_id, result, frame):
         """保存检测结果到数据库"""
         try:
             timestamp = int(time.time())
-            image_dir = f"/tmp/ai_detections/{device_id}"
-            os.makedirs(image_dir, exist_ok=True)
-            
-            bbox = result['bbox']
-            x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
-            roi = frame[y:y+h, x:x+w]
-            
-            image_path = f"{image_dir}/{result['type']}_{timestamp}.jpg"
-            cv2.imwrite(image_path, roi)
-            
-            event = AIEvent(
-                device_id=device_id,
-                event_type=result['type'],
-                confidence=result['confidence'],
-                bbox_x=x,
-                bbox_y=y,
-                bbox_width=w,
-                bbox_height=h,
-                image_path=image_path,
-                metadata={'detection_time': timestamp}
+            image_path, roi = self.save_detection_image(
+                device_id, result, frame, f"{result['type']}_{timestamp}"
             )
             
-            db.session.add(event)
-            db.session.commit()
+            event = self.build_event(device_id, result, image_path, {'detection_time': timestamp})
+            
+            with metrics.event_write_latency.time(path='live'):
+                db.session.add(event)
+                db.session.commit()
+            metrics.event_write_batch_size.observe(1, path='live')
+            
+            if result['type'] == 'face_detection':
+                self.index_face(event.id, roi)
+            
+        except Exception:
+            metrics.event_write_errors.inc(path='live')
+            logger.exception("保存检测结果错误", extra={'device_id': device_id})
+            db.session.rollback()
+    
+    def save_detection_batch(self, device_id, results, metadata=None):
+        """批量保存检测结果（单次提交），results中需已包含image_path"""
+        try:
+            events = []
+            for result in results:
+                event_metadata = dict(metadata or {})
+                event_metadata.update(result.get('metadata', {}))
+                events.append(self.build_event(device_id, result, result.get('image_path'), event_metadata))
+            
+            with metrics.event_write_latency.time(path='batch'):
+                db.session.add_all(events)
+                db.session.commit()
+            metrics.event_write_batch_size.observe(len(events), path='batch')
+            
+            for event in events:
+                if event.event_type == 'face_detection' and event.image_path:
+                    face = cv2.imread(event.image_path)
+                    if face is not None:
+                        self.index_face(event.id, face)
             
-        except Exception as e:
-            print(f"保存检测结果错误: {e}")
+            return len(events)
+            
+        except Exception:
+            metrics.event_write_errors.inc(path='batch')
+            logger.exception("批量保存检测结果错误", extra={'device_id': device_id})
             db.session.rollback()
+            return 0
+    
+    def index_face(self, event_id, face):
+        """提取人脸特征并加入特征库"""
+        try:
+            face_service = get_face_service()
+            if face_service.available:
+                face_service.index_face(event_id, face)
+        except Exception:
+            logger.exception("人脸特征入库错误", extra={'event_id': event_id})
 
 # 全局AI分析引擎实例
 ai_engine = AIAnalysisEngine()
 
+def take_over_analysis(device_id, params):
+    """设备归属迁移到本节点时重新启动实时分析"""
+    device = Device.query.filter_by(device_id=device_id).first()
+    source = StreamManager.generate_rtsp_url(device) if device else None
+    if not source:
+        return None
+    
+    analysis_types = params.get('analysis_types', ['face_detection', 'person_detection'])
+    ai_engine.start_analysis(current_app._get_current_object(), device, source, analysis_types)
+    return {'analysis_types': analysis_types}
+
+# 只有承担分析角色的进程接管实时分析
+if has_role('analysis'):
+    get_cluster().register_handler('analysis', take_over_analysis, ai_engine.stop_analysis,
+                                   lambda: list(ai_engine.analysis_threads))
+
 @ai_bp.route('/ai/start/<device_id>', methods=['POST'])
+@route_to_owner
+@requires_role('analysis')
 def start_ai_analysis(device_id):
     """启动设备AI分析"""
     try:
@@ -159,6 +367,17 @@ def start_ai_analysis(device_id):
         data = request.get_json() or {}
         analysis_types = data.get('analysis_types', ['face_detection', 'person_detection'])
         
+        cluster = get_cluster()
+        if not cluster.claim(device_id, 'analysis', {'analysis_types': analysis_types}):
+            return jsonify({'success': False, 'message': '设备已在本节点其他进程中分析'}), 409
+        
+        source = StreamManager.generate_rtsp_url(device)
+        if not source:
+            cluster.release(device_id, 'analysis')
+            return jsonify({'success': False, 'message': '无法生成RTSP URL'}), 400
+        
+        ai_engine.start_analysis(current_app._get_current_object(), device, source, analysis_types)
+        
         return jsonify({
             'success': True,
             'message': 'AI分析已启动',
@@ -168,16 +387,56 @@ def start_ai_analysis(device_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@ai_bp.route('/ai/stop/<device_id>', methods=['POST'])
+@route_to_owner
+def stop_ai_analysis(device_id):
+    """停止设备AI分析"""
+    try:
+        cluster = get_cluster()
+        # 由同一节点其他进程运行的分析在其心跳发现租约撤销后停止
+        stopped = ai_engine.stop_analysis(device_id) or cluster.lease(device_id, 'analysis') is not None
+        if not stopped:
+            return jsonify({'success': False, 'message': '设备未在分析'}), 404
+        
+        cluster.release(device_id, 'analysis')
+        
+        return jsonify({'success': True, 'message': 'AI分析已停止'})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@ai_bp.route('/ai/status', methods=['GET'])
+def get_ai_status():
+    """获取实时分析状态及各设备的帧率分配"""
+    try:
+        allocation = get_scheduler().status()
+        analyses = ai_engine.analysis_threads
+        for entry in allocation['devices']:
+            analysis = analyses.get(entry['device_id'])
+            if analysis:
+                entry['analysis_types'] = analysis['analysis_types']
+                entry['decode'] = analysis['decode']
+                entry['running'] = analysis['thread'].is_alive()
+        
+        return jsonify({
+            'success': True,
+            'data': allocation
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @ai_bp.route('/ai/models', methods=['GET'])
 def get_available_models():
     """获取可用的AI模型"""
     try:
+        # 模型在第一次检测时加载，查询不触发加载（api进程不加载模型）
         models_info = {}
         
-        for model_name, model in ai_engine.models.items():
+        for model_name, status in ai_engine.model_status().items():
             models_info[model_name] = {
                 'name': model_name,
-                'status': 'loaded' if model is not None else 'failed',
+                'status': status,
                 'type': 'opencv_cascade' if 'detector' in model_name else 'unknown'
             }
         
@@ -185,9 +444,106 @@ def get_available_models():
             'success': True,
             'data': {
                 'models': models_info,
-                'total_models': len(models_info)
+                'total_models': len(models_info),
+                'models_loaded': ai_engine.models_loaded
             }
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
+
+@ai_bp.route('/ai/jobs', methods=['POST'])
+@requires_role('analysis')
+def create_analysis_job():
+    """创建录像离线分析任务"""
+    try:
+        data = request.get_json() or {}
+        video_path = data.get('video_path')
+        device_id = data.get('device_id')
+        
+        if not video_path or not os.path.isfile(video_path):
+            return jsonify({'success': False, 'message': '视频文件不存在'}), 400
+        
+        device = Device.query.filter_by(device_id=device_id).first()
+        if not device:
+            return jsonify({'success': False, 'message': '设备不存在'}), 404
+        
+        workers = data.get('workers')
+        max_workers = os.cpu_count() or 1
+        if workers is not None and (type(workers) is not int or not 1 <= workers <= max_workers):
+            return jsonify({'success': False, 'message': f'workers须为1到{max_workers}之间的整数'}), 400
+        
+        job = BatchJob(
+            video_path=video_path,
+            device_id=device_id,
+            analysis_types=data.get('analysis_types', ['face_detection', 'person_detection']),
+            chunk_seconds=float(data.get('chunk_seconds', 60)),
+            frame_step=int(data.get('frame_step', 5)),
+            workers=workers
+        )
+        start_job(current_app._get_current_object(), job)
+        
+        return jsonify({
+            'success': True,
+            'message': '离线分析任务已启动',
+            'data': job.to_dict()
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@ai_bp.route('/ai/jobs', methods=['GET'])
+def get_analysis_jobs():
+    """获取离线分析任务列表"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': [job.to_dict() for job in batch_jobs.values()]
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@ai_bp.route('/ai/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    """获取离线分析任务进度"""
+    job = batch_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    return jsonify({'success': True, 'data': job.to_dict()})
+
+@ai_bp.route('/ai/jobs/<job_id>', methods=['DELETE'])
+def cancel_analysis_job(job_id):
+    """取消离线分析任务"""
+    job = batch_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    job.cancelled.set()
+    return jsonify({'success': True, 'message': '任务取消中', 'data': job.to_dict()})
+
+@ai_bp.cli.command('analyze-video')
+@click.argument('video_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--device-id', required=True, help='事件归属的设备ID')
+@click.option('--chunk-seconds', default=60.0, show_default=True, help='每个分片的时长（秒）')
+@click.option('--frame-step', default=5, show_default=True, help='每隔多少帧分析一帧')
+@click.option('--workers', default=None, type=int, help='并行进程数，默认为CPU核数')
+@click.option('--types', 'analysis_types', default='face_detection,person_detection', show_default=True)
+def analyze_video_command(video_path, device_id, chunk_seconds, frame_step, workers, analysis_types):
+    """离线分析录像文件: flask --app src.main ai analyze-video <video_path> --device-id <id>"""
+    job = BatchJob(
+        video_path=os.path.abspath(video_path),
+        device_id=device_id,
+        analysis_types=analysis_types.split(','),
+        chunk_seconds=chunk_seconds,
+        frame_step=frame_step,
+        workers=workers
+    )
+    
+    def report(job):
+        click.echo(f"[{job.job_id}] {job.chunks_done}/{len(job.chunks)} 分片, "
+                   f"{job.frames_processed} 帧, {job.detections} 个检测结果")
+    
+    run_job(current_app._get_current_object(), job, on_progress=report)
+    click.echo(json.dumps(job.to_dict(), ensure_ascii=False, indent=2))
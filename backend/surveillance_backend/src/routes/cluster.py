@@ -0,0 +1,64 @@
+from flask import Blueprint, jsonify
+from src.models.cluster import WorkerNode, DeviceLease
+from src.services.ownership import get_cluster
+from src.services.roles import process_status
+from datetime import datetime
+
+cluster_bp = Blueprint('cluster', __name__)
+
+@cluster_bp.route('/cluster/status', methods=['GET'])
+def get_cluster_status():
+    """获取集群成员和各节点持有的设备资源"""
+    try:
+        cluster = get_cluster()
+        data = cluster.status()
+        data['process'] = process_status()
+        
+        if cluster.enabled:
+            now = datetime.utcnow()
+            data['workers'] = [w.to_dict() for w in WorkerNode.query.filter(WorkerNode.expires_at >= now).all()]
+            
+            leases = {}
+            pending = 0
+            for lease in DeviceLease.query.all():
+                if lease.worker_id is None or lease.expires_at < now:
+                    pending += 1
+                    continue
+                counts = leases.setdefault(lease.node_id, {})
+                counts[lease.kind] = counts.get(lease.kind, 0) + 1
+            data['leases'] = leases
+            data['pending_leases'] = pending
+        
+        return jsonify({
+            'success': True,
+            'data': data
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@cluster_bp.route('/cluster/owner/<device_id>', methods=['GET'])
+def get_device_owner(device_id):
+    """查询设备的归属节点（可用于前端或负载均衡直接路由）"""
+    try:
+        cluster = get_cluster()
+        owner = cluster.owner(device_id)
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'device_id': device_id,
+                'node_id': owner,
+                'address': cluster.addresses.get(owner),
+                'local': owner == cluster.node_id
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
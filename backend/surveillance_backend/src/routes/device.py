@@ -1,10 +1,34 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 from src.models.device import Device, AIEvent, db
+from src.services import metrics
+from src.services.scheduler import get_scheduler
+from src.services.frame_source import DECODE_MODES
+from src.services.stream_lifecycle import parse_schedule
+from src.services.event_archive import get_archive, event_dict
 from datetime import datetime, timedelta
+from sqlalchemy import select, type_coerce, Text
+import click
 import uuid
+import json
+import csv
+import io
+
+try:
+    import orjson
+    
+    def dumps_line(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    def dumps_line(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
 
 device_bp = Blueprint('device', __name__)
 
+# 导出时每批从游标读取的行数
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_COLUMNS = ['id', 'device_id', 'event_type', 'confidence', 'bbox_x', 'bbox_y',
+                  'bbox_width', 'bbox_height', 'image_path', 'created_at', 'metadata']
+
 @device_bp.route('/devices', methods=['GET'])
 def get_devices():
     """获取所有设备列表"""
@@ -25,6 +49,18 @@ def add_device():
     """添加新设备"""
     try:
         data = request.get_json()
+        if data.get('decode_mode', 'full') not in DECODE_MODES:
+            return jsonify({
+                'success': False,
+                'message': f"解码模式必须是: {', '.join(DECODE_MODES)}"
+            }), 400
+        try:
+            parse_schedule(data.get('stream_schedule'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
         
         # 生成设备ID
         device_id = data.get('device_id') or str(uuid.uuid4())
@@ -51,7 +87,14 @@ def add_device():
             gb_channel_id=data.get('gb_channel_id'),
             gb_manufacturer=data.get('gb_manufacturer'),
             gb_model=data.get('gb_model'),
-            rtsp_url=data.get('rtsp_url')
+            rtsp_url=data.get('rtsp_url'),
+            analysis_min_fps=data.get('analysis_min_fps'),
+            analysis_max_fps=data.get('analysis_max_fps'),
+            analysis_priority=data.get('analysis_priority', 1),
+            decode_mode=data.get('decode_mode', 'full'),
+            decode_width=data.get('decode_width'),
+            stream_pinned=bool(data.get('stream_pinned', False)),
+            stream_schedule=data.get('stream_schedule') or None
         )
         
         db.session.add(device)
@@ -80,6 +123,18 @@ def update_device(device_id):
             }), 404
         
         data = request.get_json()
+        if data.get('decode_mode', 'full') not in DECODE_MODES:
+            return jsonify({
+                'success': False,
+                'message': f"解码模式必须是: {', '.join(DECODE_MODES)}"
+            }), 400
+        try:
+            parse_schedule(data.get('stream_schedule'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
         
         # 更新设备信息
         for key, value in data.items():
@@ -89,6 +144,12 @@ def update_device(device_id):
         device.updated_at = datetime.utcnow()
         db.session.commit()
         
+        # 正在分析的设备立即应用新的调度参数
+        scheduler = get_scheduler()
+        if device_id in scheduler.devices:
+            scheduler.add_device(device_id, device.analysis_min_fps,
+                                 device.analysis_max_fps, device.analysis_priority)
+        
         return jsonify({
             'success': True,
             'data': device.to_dict()
@@ -160,48 +221,76 @@ def update_device_status(device_id):
             'message': str(e)
         }), 500
 
+def event_conditions(args):
+    """解析事件过滤参数（热分区和归档分区共用）"""
+    conditions = {
+        'device_id': args.get('device_id') or None,
+        'event_type': args.get('event_type') or None,
+        'start': None,
+        'end': None
+    }
+    
+    if args.get('start_time'):
+        conditions['start'] = datetime.fromisoformat(args['start_time'].replace('Z', '+00:00'))
+    
+    if args.get('end_time'):
+        conditions['end'] = datetime.fromisoformat(args['end_time'].replace('Z', '+00:00'))
+    
+    return conditions
+
+def event_filters(conditions):
+    """根据过滤参数构建热分区（ai_events表）的过滤条件"""
+    filters = []
+    
+    if conditions['device_id']:
+        filters.append(AIEvent.device_id == conditions['device_id'])
+    
+    if conditions['event_type']:
+        filters.append(AIEvent.event_type == conditions['event_type'])
+    
+    if conditions['start']:
+        filters.append(AIEvent.created_at >= conditions['start'])
+    
+    if conditions['end']:
+        filters.append(AIEvent.created_at <= conditions['end'])
+    
+    return filters
+
 @device_bp.route('/events', methods=['GET'])
 def get_events():
-    """获取AI事件列表"""
+    """获取AI事件列表（跨热分区和归档分区，归档分区均早于热分区）"""
     try:
         # 获取查询参数
-        device_id = request.args.get('device_id')
-        event_type = request.args.get('event_type')
-        start_time = request.args.get('start_time')
-        end_time = request.args.get('end_time')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = max(int(request.args.get('per_page', 20)), 1)
         
         # 构建查询
-        query = AIEvent.query
-        
-        if device_id:
-            query = query.filter(AIEvent.device_id == device_id)
+        archive = get_archive()
+        partitions = archive.partitions()
+        conditions = event_conditions(request.args)
+        query = AIEvent.query.filter(*event_filters(conditions), *archive.hot_filters(partitions))
+        archived = archive.search(**conditions, partitions=partitions)
         
-        if event_type:
-            query = query.filter(AIEvent.event_type == event_type)
-        
-        if start_time:
-            start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-            query = query.filter(AIEvent.created_at >= start_dt)
-        
-        if end_time:
-            end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-            query = query.filter(AIEvent.created_at <= end_dt)
-        
-        # 分页查询
-        events = query.order_by(AIEvent.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        # 分页查询：先取热分区，不足一页时从归档分区补齐
+        hot_total = query.count()
+        offset = (page - 1) * per_page
+        items = []
+        if offset < hot_total:
+            events = query.order_by(AIEvent.created_at.desc()).offset(offset).limit(per_page).all()
+            items = [event.to_dict() for event in events]
+        if len(items) < per_page and archived.parts:
+            rows = archived.iter_rows(max(0, offset - hot_total), per_page - len(items))
+            items.extend(event_dict(row) for row in rows)
         
+        total = hot_total + archived.total
         return jsonify({
             'success': True,
-            'data': [event.to_dict() for event in events.items],
+            'data': items,
             'pagination': {
                 'page': page,
                 'per_page': per_page,
-                'total': events.total,
-                'pages': events.pages
+                'total': total,
+                'pages': (total + per_page - 1) // per_page
             }
         })
     except Exception as e:
@@ -210,6 +299,98 @@ def get_events():
             'message': str(e)
         }), 500
 
+def export_statement(filters, limit=None):
+    """导出查询：只取列元组，metadata按原始JSON文本读取以免反序列化后再序列化"""
+    table = AIEvent.__table__
+    columns = [table.c[name] for name in EXPORT_COLUMNS[:-1]]
+    columns.append(type_coerce(table.c['metadata'], Text))
+    statement = select(*columns).where(*filters).order_by(table.c.created_at.desc())
+    if limit:
+        statement = statement.limit(limit)
+    return statement
+
+def iter_event_rows(engine, statement):
+    """服务端游标分批读取，内存占用与结果总量无关"""
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE).execute(statement)
+        for rows in result.partitions():
+            yield rows
+
+def iter_export_rows(engine, statement, archived, limit=None):
+    """先导出热分区，再按时间倒序导出归档分区"""
+    exported = 0
+    for rows in iter_event_rows(engine, statement):
+        exported += len(rows)
+        yield rows
+    if limit is not None:
+        limit -= exported
+        if limit <= 0:
+            return
+    yield from archived.batches(EXPORT_CHUNK_SIZE, limit)
+
+def generate_ndjson(rows_iter):
+    names = EXPORT_COLUMNS[:-1]
+    for rows in rows_iter:
+        lines = []
+        for row in rows:
+            record = dict(zip(names, row[:-1]))
+            created_at = record['created_at']
+            record['created_at'] = created_at.isoformat() if created_at else None
+            # 拼接原始metadata JSON文本
+            lines.append(f"{dumps_line(record)[:-1]},\"metadata\":{row[-1] or 'null'}}}\n")
+        yield ''.join(lines)
+
+def generate_csv(rows_iter):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in rows_iter:
+        for row in rows:
+            row = list(row)
+            row[9] = row[9].isoformat() if row[9] else None
+            writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@device_bp.route('/events/export', methods=['GET'])
+def export_events():
+    """流式导出AI事件（NDJSON/CSV），支持与事件列表相同的过滤参数"""
+    try:
+        output_format = request.args.get('format', 'ndjson')
+        if output_format not in ('ndjson', 'csv'):
+            return jsonify({
+                'success': False,
+                'message': '不支持的导出格式'
+            }), 400
+        
+        limit = request.args.get('limit', type=int)
+        archive = get_archive()
+        partitions = archive.partitions()
+        conditions = event_conditions(request.args)
+        statement = export_statement(event_filters(conditions) + archive.hot_filters(partitions), limit)
+        archived = archive.search(**conditions, partitions=partitions)
+        rows_iter = iter_export_rows(db.engine, statement, archived, limit)
+        
+        if output_format == 'csv':
+            body = generate_csv(rows_iter)
+            mimetype = 'text/csv'
+        else:
+            body = generate_ndjson(rows_iter)
+            mimetype = 'application/x-ndjson'
+        
+        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+        return Response(body, mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename=events_{timestamp}.{output_format}'
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
 @device_bp.route('/events', methods=['POST'])
 def create_event():
     """创建AI事件（通常由AI分析服务调用）"""
@@ -225,17 +406,20 @@ def create_event():
             bbox_width=data.get('bbox_width'),
             bbox_height=data.get('bbox_height'),
             image_path=data.get('image_path'),
-            metadata=data.get('metadata', {})
+            event_metadata=data.get('metadata', {})
         )
         
-        db.session.add(event)
-        db.session.commit()
+        with metrics.event_write_latency.time(path='api'):
+            db.session.add(event)
+            db.session.commit()
+        metrics.event_write_batch_size.observe(1, path='api')
         
         return jsonify({
             'success': True,
             'data': event.to_dict()
         })
     except Exception as e:
+        metrics.event_write_errors.inc(path='api')
         db.session.rollback()
         return jsonify({
             'success': False,
@@ -286,3 +470,27 @@ def get_statistics():
             'success': False,
             'message': str(e)
         }), 500
+
+@device_bp.route('/events/partitions', methods=['GET'])
+def get_event_partitions():
+    """获取事件分区（热分区范围和已归档的月分区）"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': get_archive().status()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@device_bp.cli.command('archive-events')
+def archive_events():
+    """归档热分区之前的月份并清理过期分区"""
+    archive = get_archive()
+    archived = archive.roll_over()
+    status = archive.status()
+    click.echo(f"归档 {len(archived)} 个月分区: {', '.join(archived) or '无'}；"
+               f"共 {len(status['partitions'])} 个分区, {status['archived_rows']} 行, "
+               f"{status['archived_bytes'] / 1e6:.1f} MB")
@@ -0,0 +1,107 @@
+from flask import Blueprint, request, jsonify
+from src.models.device import AIEvent
+from src.services.event_archive import get_archive
+from src.services.face_index import get_face_service
+import cv2
+import numpy as np
+import base64
+
+face_bp = Blueprint('face', __name__)
+
+
+def decode_image(data):
+    """解码base64图像（支持data URL前缀）"""
+    if ',' in data:
+        data = data.split(',', 1)[1]
+    buffer = np.frombuffer(base64.b64decode(data), dtype=np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+@face_bp.route('/faces/search', methods=['POST'])
+def search_faces():
+    """人脸相似度检索（top-k余弦相似度）"""
+    try:
+        face_service = get_face_service()
+        if not face_service.available:
+            return jsonify({
+                'success': False,
+                'message': '人脸特征模型未加载'
+            }), 503
+
+        data = request.get_json() or {}
+        top_k = int(data.get('top_k', 10))
+
+        # 支持上传人脸图像或使用已有事件的人脸截图检索
+        if data.get('image'):
+            face = decode_image(data['image'])
+        elif data.get('event_id') is not None:
+            event = AIEvent.query.get(data['event_id'])
+            image_path = event.image_path if event else None
+            if not event:
+                archived = get_archive().find([data['event_id']]).get(data['event_id'])
+                image_path = archived['image_path'] if archived else None
+            if not image_path:
+                return jsonify({
+                    'success': False,
+                    'message': '事件不存在或无截图'
+                }), 404
+            face = cv2.imread(image_path)
+        else:
+            return jsonify({
+                'success': False,
+                'message': '需要提供image或event_id'
+            }), 400
+
+        if face is None or face.size == 0:
+            return jsonify({
+                'success': False,
+                'message': '无法解码人脸图像'
+            }), 400
+
+        matches = face_service.search_image(face, top_k)
+
+        events = {}
+        if matches:
+            event_ids = [event_id for event_id, _ in matches]
+            events = {e.id: e.to_dict() for e in AIEvent.query.filter(AIEvent.id.in_(event_ids)).all()}
+            # 已归档的事件从归档分区读取
+            missing = [event_id for event_id in event_ids if event_id not in events]
+            if missing:
+                events.update(get_archive().find(missing))
+
+        return jsonify({
+            'success': True,
+            'data': [{
+                'event_id': event_id,
+                'score': score,
+                'event': events.get(event_id)
+            } for event_id, score in matches]
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@face_bp.route('/faces/status', methods=['GET'])
+def get_face_status():
+    """获取人脸特征库状态"""
+    try:
+        face_service = get_face_service()
+        index = face_service.index
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'model_path': face_service.embedder.model_path,
+                'model_loaded': face_service.available,
+                'index': index.stats() if index is not None else None
+            }
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
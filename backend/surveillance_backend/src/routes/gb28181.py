@@ -0,0 +1,132 @@
+from flask import Blueprint, request, jsonify, current_app
+from src.services.gb28181 import GB28181Server, get_server, GB28181_HOST, GB28181_PORT
+import asyncio
+import click
+
+gb28181_bp = Blueprint('gb28181', __name__)
+
+
+def require_server():
+    server = get_server()
+    if server is None:
+        raise LookupError('GB28181信令服务未启动')
+    return server
+
+@gb28181_bp.route('/gb28181/status', methods=['GET'])
+def get_gb28181_status():
+    """获取信令服务状态"""
+    server = get_server()
+    return jsonify({
+        'success': True,
+        'data': {
+            'running': server is not None,
+            'sip_id': server.sip_id if server else None,
+            'stats': server.status() if server else None
+        }
+    })
+
+@gb28181_bp.route('/gb28181/devices', methods=['GET'])
+def get_gb28181_devices():
+    """获取已注册设备列表"""
+    try:
+        server = require_server()
+        online_only = request.args.get('online', '').lower() in ('1', 'true')
+        devices = [state.to_dict() for state in list(server.devices.values())
+                   if state.online or not online_only]
+
+        return jsonify({
+            'success': True,
+            'data': devices
+        })
+
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@gb28181_bp.route('/gb28181/devices/<gb_device_id>/catalog', methods=['POST'])
+def query_catalog(gb_device_id):
+    """向设备发起目录查询，返回通道列表"""
+    try:
+        server = require_server()
+        timeout = float(request.args.get('timeout', 10))
+        channels = server.call(server.query_catalog(gb_device_id, timeout), timeout + 1)
+
+        return jsonify({
+            'success': True,
+            'data': channels
+        })
+
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except (asyncio.TimeoutError, TimeoutError):
+        return jsonify({'success': False, 'message': '设备应答超时'}), 504
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@gb28181_bp.route('/gb28181/devices/<gb_device_id>/invite', methods=['POST'])
+def invite(gb_device_id):
+    """实时点播，设备向媒体服务器推流"""
+    try:
+        server = require_server()
+        data = request.get_json() or {}
+        timeout = float(data.get('timeout', 10))
+        session = server.call(server.invite(gb_device_id, data.get('channel_id'), timeout=timeout), timeout + 1)
+
+        return jsonify({
+            'success': True,
+            'data': session
+        })
+
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except (asyncio.TimeoutError, TimeoutError):
+        return jsonify({'success': False, 'message': '设备应答超时'}), 504
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@gb28181_bp.route('/gb28181/sessions/<path:call_id>', methods=['DELETE'])
+def stop_session(call_id):
+    """结束点播会话（发送BYE）"""
+    try:
+        server = require_server()
+        if not server.call(server.bye(call_id)):
+            return jsonify({'success': False, 'message': '会话不存在'}), 404
+
+        return jsonify({
+            'success': True,
+            'message': '会话已结束'
+        })
+
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+@gb28181_bp.cli.command('serve')
+@click.option('--host', default=GB28181_HOST, show_default=True)
+@click.option('--port', default=GB28181_PORT, show_default=True)
+def serve(host, port):
+    """以独立进程运行GB28181信令服务"""
+    try:
+        server = GB28181Server(current_app._get_current_object(), host=host, port=port)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'GB28181信令服务 {server.sip_id} 监听 {host}:{port} (UDP/TCP)')
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from src.services.metrics import registry
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus指标"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
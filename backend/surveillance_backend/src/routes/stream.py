@@ -1,15 +1,32 @@
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, redirect, send_from_directory
 from src.models.device import Device
+from src.services import metrics
+from src.services.gb28181 import get_server
+from src.services.ownership import get_cluster, route_to_owner
+from src.services import llhls
+from src.services.stream_lifecycle import get_lifecycle, STREAM_ON_DEMAND, STREAM_ROOT, STREAM_START_TIMEOUT
+from src.services.roles import has_role, requires_role
+from collections import defaultdict
 import subprocess
+import signal
 import threading
+import logging
 import time
 import json
 import os
 
+logger = logging.getLogger(__name__)
+
 stream_bp = Blueprint('stream', __name__)
 
 # 存储活跃的流进程
 active_streams = {}
+# GB28181设备的点播会话 {device_id: 会话信息}，随视频流启动和停止
+gb28181_sessions = {}
+# 同一设备的启动串行执行（多个观看者同时按需启动时只启动一次）
+launch_locks = defaultdict(threading.Lock)
+
+metrics.register_queue('active_streams', lambda: len(active_streams))
 
 class StreamManager:
     """视频流管理器"""
@@ -28,7 +45,10 @@ class StreamManager:
                 return f"rtsp://{device.ip_address}:{device.port}/stream"
         
         elif device.protocol == 'GB28181':
-            # GB28181协议需要通过SIP信令获取流地址，这里简化处理
+            # 视频流运行时使用其点播会话由媒体服务器转出的RTSP地址（点播在启动视频流时发起）
+            session = gb28181_sessions.get(device.device_id)
+            if session:
+                return session['rtsp_url']
             return f"rtsp://{device.ip_address}:{device.port}/{device.gb_channel_id}"
         
         elif device.protocol == 'ONVIF':
@@ -41,11 +61,22 @@ class StreamManager:
         return None
     
     @staticmethod
-    def start_stream_process(device_id, rtsp_url, output_format='hls'):
-        """启动视频流处理进程"""
+    def open_source(device):
+        """视频流的输入地址：已在信令服务注册的GB28181设备发起INVITE点播，会话在停止视频流时结束"""
+        if device.protocol == 'GB28181':
+            server = get_server()
+            if server is not None and device.gb_device_id in server.devices:
+                session = server.call(server.invite(device.gb_device_id, device.gb_channel_id))
+                gb28181_sessions[device.device_id] = session
+                return session['rtsp_url']
+        return StreamManager.generate_rtsp_url(device)
+    
+    @staticmethod
+    def start_stream_process(device_id, rtsp_url, output_format='hls', origin='api'):
+        """启动视频流处理进程；origin为启动来源（api, viewer, prewarm, takeover）"""
         try:
             # 创建输出目录
-            output_dir = f"/tmp/streams/{device_id}"
+            output_dir = f"{STREAM_ROOT}/{device_id}"
             os.makedirs(output_dir, exist_ok=True)
             
             if output_format == 'hls':
@@ -57,6 +88,8 @@ class StreamManager:
                     '-c:v', 'libx264',
                     '-preset', 'ultrafast',
                     '-tune', 'zerolatency',
+                    # 关键帧与分片时长对齐，否则第一个分片要等到默认GOP（250帧）结束才能写出
+                    '-force_key_frames', 'expr:gte(t,n_forced*2)',
                     '-c:a', 'aac',
                     '-f', 'hls',
                     '-hls_time', '2',
@@ -64,6 +97,10 @@ class StreamManager:
                     '-hls_flags', 'delete_segments',
                     output_path
                 ]
+            elif output_format == 'llhls':
+                # 低延迟HLS：分片MP4经管道交给LL-HLS服务，播放时重定向到该服务的播放列表
+                output_path = f"/{device_id}/playlist.m3u8"
+                cmd = llhls.ffmpeg_command(rtsp_url)
             else:
                 # MJPEG流输出
                 output_path = f"{output_dir}/stream.mjpg"
@@ -77,11 +114,16 @@ class StreamManager:
                     output_path
                 ]
             
-            # 启动FFmpeg进程
+            # 删除上次运行留下的输出，首帧检测和按需启动的等待以新输出为准
+            if output_format != 'llhls' and os.path.exists(output_path):
+                os.remove(output_path)
+            
+            # 启动FFmpeg进程；输出不读取的管道写满后FFmpeg会阻塞（预热的流可能长期运行），
+            # 只有LL-HLS从标准输出读取分片
             process = subprocess.Popen(
                 cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                stdout=subprocess.PIPE if output_format == 'llhls' else subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
                 stdin=subprocess.PIPE
             )
             
@@ -91,6 +133,17 @@ class StreamManager:
                 'format': output_format,
                 'start_time': time.time()
             }
+            if output_format == 'llhls':
+                try:
+                    server = llhls.get_server()
+                    server.on_request = lambda stream_id, client: get_lifecycle().touch(stream_id, client or 'llhls')
+                    server.call(server.add_stream(device_id, process))
+                except Exception:
+                    StreamManager.stop_stream_process(device_id)
+                    raise
+                active_streams[device_id]['llhls_port'] = server.port
+            get_lifecycle().stream_started(device_id, output_format, origin,
+                                           StreamManager.ready_check(device_id, output_format, output_path))
             
             return True, output_path
             
@@ -111,10 +164,156 @@ class StreamManager:
                 pass
             
             del active_streams[device_id]
+            get_lifecycle().stream_stopped(device_id)
+            StreamManager.stop_gb28181_session(device_id)
             return True
         return False
+    
+    @staticmethod
+    def ready_check(device_id, output_format, output_path):
+        """返回判断流是否已有可播放输出的函数"""
+        if output_format == 'llhls':
+            def ready():
+                stream = llhls.get_server().streams.get(device_id)
+                return stream is not None and stream.current is not None
+        elif output_format == 'hls':
+            def ready():
+                return os.path.exists(output_path)
+        else:
+            def ready():
+                return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+        return ready
+    
+    @staticmethod
+    def launch(device, output_format='hls', origin='api'):
+        """启动设备视频流（已在运行时不重复启动），返回 (状态, 详情)
+
+        状态: started（详情为RTSP URL）、running、no_url、failed（详情为错误信息）
+        """
+        with launch_locks[device.device_id]:
+            return StreamManager._launch(device, output_format, origin)
+    
+    @staticmethod
+    def _launch(device, output_format, origin):
+        device_id = device.device_id
+        cluster = get_cluster()
+        
+        # 检查是否已有活跃流，进程已退出的流重新启动
+        if device_id in active_streams:
+            if active_streams[device_id]['process'].poll() is None:
+                return 'running', None
+            StreamManager.stop_stream_process(device_id)
+            metrics.ffmpeg_restarts.inc(device_id=device_id)
+        
+        # 同一节点的其他进程已在运行该设备的流
+        if not cluster.claim(device_id, 'stream', {'format': output_format}):
+            return 'running', None
+        
+        # 生成RTSP URL（GB28181设备发起点播，设备不在线时失败）
+        try:
+            rtsp_url = StreamManager.open_source(device)
+        except Exception as e:
+            cluster.release(device_id, 'stream')
+            return 'failed', str(e)
+        if not rtsp_url:
+            cluster.release(device_id, 'stream')
+            return 'no_url', None
+        
+        # 启动流处理
+        success, result = StreamManager.start_stream_process(device_id, rtsp_url, output_format, origin)
+        if not success:
+            StreamManager.stop_gb28181_session(device_id)
+            cluster.release(device_id, 'stream')
+            return 'failed', result
+        
+        cluster.claim(device_id, 'stream', StreamManager.stream_params(device_id))
+        return 'started', rtsp_url
+    
+    @staticmethod
+    def start_for_lifecycle(device_id, output_format, origin):
+        """预热启动，返回是否启动了新的流"""
+        device = Device.query.filter_by(device_id=device_id).first()
+        if not device:
+            return False
+        status, detail = StreamManager.launch(device, output_format, origin)
+        if status == 'failed':
+            logger.warning("预热视频流启动失败", extra={'device_id': device_id, 'error': detail})
+        return status == 'started'
+    
+    @staticmethod
+    def running_streams():
+        """本进程中FFmpeg仍在运行的设备ID；进程已退出的流在下一次启动时清理并重新启动"""
+        return [device_id for device_id, info in list(active_streams.items()) if info['process'].poll() is None]
+    
+    @staticmethod
+    def reap_stream(device_id):
+        """停止本进程运行的流并释放租约"""
+        StreamManager.stop_stream_process(device_id)
+        get_cluster().release(device_id, 'stream')
+    
+    @staticmethod
+    def stop_gb28181_session(device_id):
+        """结束GB28181点播会话"""
+        session = gb28181_sessions.pop(device_id, None)
+        server = get_server()
+        if session and server is not None:
+            try:
+                server.call(server.bye(session['call_id']))
+            except Exception:
+                pass
+    
+    @staticmethod
+    def stream_params(device_id):
+        """写入租约的运行信息，供同一节点的其他进程播放和停止"""
+        stream_info = active_streams[device_id]
+        return {
+            'format': stream_info['format'],
+            'output_path': stream_info['output_path'],
+            'pid': stream_info['process'].pid,
+            'llhls_port': stream_info.get('llhls_port'),
+            'start_time': stream_info['start_time']
+        }
+    
+    @staticmethod
+    def get_stream_info(device_id):
+        """本进程或同一节点其他进程中运行的流信息"""
+        if device_id in active_streams:
+            return active_streams[device_id]
+        
+        cluster = get_cluster()
+        lease = cluster.lease(device_id, 'stream')
+        if lease and lease['node_id'] == cluster.node_id and (lease['params'] or {}).get('output_path'):
+            return lease['params']
+        return None
+    
+    @staticmethod
+    def take_over_stream(device_id, params):
+        """设备归属迁移到本节点时重新启动视频流"""
+        device = Device.query.filter_by(device_id=device_id).first()
+        rtsp_url = StreamManager.open_source(device) if device else None
+        if not rtsp_url:
+            return None
+        
+        success, _ = StreamManager.start_stream_process(device_id, rtsp_url, params.get('format', 'hls'), 'takeover')
+        if not success:
+            StreamManager.stop_gb28181_session(device_id)
+            return None
+        return StreamManager.stream_params(device_id)
+
+# 只有承担视频流角色的进程接管、预热和回收视频流
+if has_role('stream'):
+    get_cluster().register_handler('stream', StreamManager.take_over_stream,
+                                   StreamManager.stop_stream_process, lambda: list(active_streams))
+    get_lifecycle().register_handlers(StreamManager.start_for_lifecycle, StreamManager.reap_stream,
+                                      StreamManager.running_streams)
+
+def viewer_id():
+    """观看者标识（经反向代理时取X-Forwarded-For中的客户端地址）"""
+    return request.access_route[0] if request.access_route else request.remote_addr
 
 @stream_bp.route('/stream/start/<device_id>', methods=['POST'])
+@route_to_owner
+@requires_role('stream')
 def start_stream(device_id):
     """启动设备视频流"""
     try:
@@ -125,40 +324,34 @@ def start_stream(device_id):
                 'message': '设备不存在'
             }), 404
         
-        # 检查是否已有活跃流
-        if device_id in active_streams:
+        # 获取输出格式
+        data = request.get_json() or {}
+        output_format = data.get('format', 'hls')
+        
+        status, detail = StreamManager.launch(device, output_format)
+        
+        if status == 'running':
             return jsonify({
                 'success': True,
                 'message': '流已经在运行',
                 'stream_url': f'/api/stream/play/{device_id}'
             })
-        
-        # 生成RTSP URL
-        rtsp_url = StreamManager.generate_rtsp_url(device)
-        if not rtsp_url:
+        elif status == 'no_url':
             return jsonify({
                 'success': False,
                 'message': '无法生成RTSP URL'
             }), 400
-        
-        # 获取输出格式
-        data = request.get_json() or {}
-        output_format = data.get('format', 'hls')
-        
-        # 启动流处理
-        success, result = StreamManager.start_stream_process(device_id, rtsp_url, output_format)
-        
-        if success:
+        elif status == 'started':
             return jsonify({
                 'success': True,
                 'message': '视频流启动成功',
                 'stream_url': f'/api/stream/play/{device_id}',
-                'rtsp_url': rtsp_url
+                'rtsp_url': detail
             })
         else:
             return jsonify({
                 'success': False,
-                'message': f'启动视频流失败: {result}'
+                'message': f'启动视频流失败: {detail}'
             }), 500
             
     except Exception as e:
@@ -168,12 +361,24 @@ def start_stream(device_id):
         }), 500
 
 @stream_bp.route('/stream/stop/<device_id>', methods=['POST'])
+@route_to_owner
 def stop_stream(device_id):
     """停止设备视频流"""
     try:
         success = StreamManager.stop_stream_process(device_id)
         
+        if not success:
+            # 由同一节点的其他进程运行：直接结束FFmpeg进程，该进程在心跳中发现租约撤销后清理
+            stream_info = StreamManager.get_stream_info(device_id)
+            if stream_info and stream_info.get('pid'):
+                try:
+                    os.kill(stream_info['pid'], signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                success = True
+        
         if success:
+            get_cluster().release(device_id, 'stream')
             return jsonify({
                 'success': True,
                 'message': '视频流停止成功'
@@ -191,24 +396,57 @@ def stop_stream(device_id):
         }), 500
 
 @stream_bp.route('/stream/play/<device_id>')
+@route_to_owner
 def play_stream(device_id):
-    """播放设备视频流"""
+    """播放设备视频流（未启动时按需启动，format参数指定输出格式）"""
     try:
-        if device_id not in active_streams:
+        lifecycle = get_lifecycle()
+        stream_info = StreamManager.get_stream_info(device_id)
+        on_demand = STREAM_ON_DEMAND and has_role('stream')
+        if stream_info is None and on_demand:
+            device = Device.query.filter_by(device_id=device_id).first()
+            if not device:
+                return jsonify({
+                    'success': False,
+                    'message': '设备不存在'
+                }), 404
+            status, detail = StreamManager.launch(device, request.args.get('format', 'hls'), 'viewer')
+            if status in ('no_url', 'failed'):
+                return jsonify({
+                    'success': False,
+                    'message': f'启动视频流失败: {detail or "无法生成RTSP URL"}'
+                }), 500
+            stream_info = StreamManager.get_stream_info(device_id)
+        if stream_info is None:
+            if on_demand:
+                # 同一节点的其他进程正在启动
+                return jsonify({
+                    'success': False,
+                    'message': '视频流正在启动'
+                }), 503, {'Retry-After': '1'}
             return jsonify({
                 'success': False,
                 'message': '视频流未启动'
             }), 404
         
-        stream_info = active_streams[device_id]
+        lifecycle.touch(device_id, viewer_id())
         output_path = stream_info['output_path']
+        # 本进程刚启动的流等待第一个可播放输出（LL-HLS由其服务阻塞等待）
+        if device_id in active_streams and stream_info['format'] != 'llhls':
+            lifecycle.wait_ready(device_id, STREAM_START_TIMEOUT)
         
-        if stream_info['format'] == 'hls':
-            # 返回HLS播放列表
+        if stream_info['format'] == 'llhls':
+            # 低延迟HLS由运行该流的进程中的LL-HLS服务提供（阻塞式刷新不占用Web线程）
+            return redirect(llhls.playlist_url(output_path, request.host, stream_info['llhls_port']), code=302)
+        elif stream_info['format'] == 'hls':
+            # 返回HLS播放列表，分片地址改写为经 /stream/play/<device_id>/<分片> 访问
             if os.path.exists(output_path):
                 with open(output_path, 'r') as f:
                     content = f.read()
-                return Response(content, mimetype='application/vnd.apple.mpegurl')
+                content = '\n'.join(line if not line or line.startswith('#') else f'{device_id}/{line}'
+                                    for line in content.splitlines()) + '\n'
+                return Response(content, mimetype='application/vnd.apple.mpegurl',
+                                headers={'Cache-Control': 'no-cache'})
             else:
                 return jsonify({
                     'success': False,
@@ -217,13 +455,16 @@ def play_stream(device_id):
         else:
             # 返回MJPEG流
             def generate_mjpeg():
-                while device_id in active_streams:
-                    if os.path.exists(output_path):
-                        with open(output_path, 'rb') as f:
-                            data = f.read()
-                            yield (b'--frame\r\n'
-                                   b'Content-Type: image/jpeg\r\n\r\n' + data + b'\r\n')
-                    time.sleep(0.1)
+                # 连接期间计为观看者；由其他进程运行的流以输出文件是否持续更新判断
+                with lifecycle.watching(device_id):
+                    while device_id in active_streams or is_fresh(output_path):
+                        if os.path.exists(output_path):
+                            with open(output_path, 'rb') as f:
+                                data = f.read()
+                                yield (b'--frame\r\n'
+                                       b'Content-Type: image/jpeg\r\n\r\n' + data + b'\r\n')
+                        lifecycle.touch(device_id)
+                        time.sleep(0.1)
             
             return Response(generate_mjpeg(),
                           mimetype='multipart/x-mixed-replace; boundary=frame')
@@ -234,23 +475,68 @@ def play_stream(device_id):
             'message': str(e)
         }), 500
 
+@stream_bp.route('/stream/play/<device_id>/<path:filename>')
+@route_to_owner
+def play_segment(device_id, filename):
+    """HLS分片"""
+    try:
+        stream_info = StreamManager.get_stream_info(device_id)
+        if stream_info is None or stream_info['format'] != 'hls':
+            return jsonify({
+                'success': False,
+                'message': '视频流未启动'
+            }), 404
+        
+        get_lifecycle().touch(device_id, viewer_id())
+        return send_from_directory(os.path.dirname(stream_info['output_path']), filename,
+                                   mimetype='video/mp2t', max_age=60)
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+def is_fresh(path, max_age=10):
+    try:
+        return time.time() - os.path.getmtime(path) < max_age
+    except OSError:
+        return False
+
 @stream_bp.route('/stream/status', methods=['GET'])
 def get_stream_status():
-    """获取所有活跃流状态"""
+    """获取所有活跃流状态（含观看者数、空闲时间、首帧时间和自动停止的流数）"""
     try:
+        lifecycle = get_lifecycle()
         status = {}
-        for device_id, stream_info in active_streams.items():
+        for device_id, stream_info in list(active_streams.items()):
             process = stream_info['process']
             status[device_id] = {
                 'running': process.poll() is None,
                 'format': stream_info['format'],
                 'start_time': stream_info['start_time'],
-                'duration': time.time() - stream_info['start_time']
+                'duration': time.time() - stream_info['start_time'],
+                **lifecycle.stream_status(device_id)
+            }
+        
+        # 集群中其他进程和节点运行的流
+        cluster = get_cluster()
+        for lease in cluster.leases('stream'):
+            params = lease['params'] or {}
+            if lease['device_id'] in status or 'start_time' not in params:
+                continue
+            status[lease['device_id']] = {
+                'running': True,
+                'format': params.get('format'),
+                'start_time': params['start_time'],
+                'duration': time.time() - params['start_time'],
+                'node_id': lease['node_id']
             }
         
         return jsonify({
             'success': True,
-            'data': status
+            'data': status,
+            'lifecycle': lifecycle.status()
         })
         
     except Exception as e:
@@ -260,6 +546,7 @@ def get_stream_status():
         }), 500
 
 @stream_bp.route('/stream/snapshot/<device_id>', methods=['POST'])
+@route_to_owner
 def capture_snapshot(device_id):
     """捕获设备快照"""
     try:
@@ -0,0 +1,225 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.services import metrics
+import multiprocessing
+import logging
+import cv2
+import threading
+import time
+import uuid
+import os
+
+# 存储离线分析任务
+batch_jobs = {}
+# 子进程中当前任务的取消标记（由进程池initializer设置）
+_cancelled = None
+
+logger = logging.getLogger(__name__)
+
+
+class BatchJob:
+    """录像离线分析任务"""
+
+    def __init__(self, video_path, device_id, analysis_types, chunk_seconds=60,
+                 frame_step=5, workers=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.video_path = video_path
+        self.device_id = device_id
+        self.analysis_types = analysis_types
+        self.chunk_seconds = chunk_seconds
+        self.frame_step = max(1, int(frame_step))
+        self.workers = workers or os.cpu_count() or 1
+        self.status = 'pending'  # pending, running, completed, failed, cancelled
+        self.error = None
+        self.chunks = []
+        self.chunks_done = 0
+        self.frames_total = 0
+        self.frames_decoded = 0
+        self.frames_processed = 0
+        self.detections = 0
+        self.events_saved = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # 进程间共享的取消标记，子进程在分析每一帧前检查，取消后正在分析的分片立即结束
+        self.cancelled = multiprocessing.get_context('spawn').Event()
+
+    @property
+    def progress(self):
+        if not self.chunks:
+            return 0.0
+        return self.chunks_done / len(self.chunks)
+
+    def to_dict(self):
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0
+        return {
+            'job_id': self.job_id,
+            'video_path': self.video_path,
+            'device_id': self.device_id,
+            'analysis_types': self.analysis_types,
+            'chunk_seconds': self.chunk_seconds,
+            'frame_step': self.frame_step,
+            'workers': self.workers,
+            'status': self.status,
+            'error': self.error,
+            'progress': round(self.progress, 4),
+            'chunks_total': len(self.chunks),
+            'chunks_done': self.chunks_done,
+            'frames_total': self.frames_total,
+            'frames_decoded': self.frames_decoded,
+            'frames_processed': self.frames_processed,
+            'detections': self.detections,
+            'events_saved': self.events_saved,
+            'elapsed': elapsed,
+            'frames_per_second': self.frames_processed / elapsed if elapsed > 0 else 0,
+            'created_at': self.created_at
+        }
+
+
+def split_chunks(video_path, chunk_seconds):
+    """按时长将录像切分为帧区间 [(start_frame, end_frame, fps), ...]"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError(f'无法打开视频文件: {video_path}')
+
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count <= 0:
+            raise ValueError(f'无法获取视频帧数: {video_path}')
+    finally:
+        cap.release()
+
+    chunk_frames = max(1, int(chunk_seconds * fps))
+    return [(start, min(start + chunk_frames, frame_count), fps)
+            for start in range(0, frame_count, chunk_frames)]
+
+
+def init_worker(cancelled):
+    global _cancelled
+    _cancelled = cancelled
+
+
+def analyze_chunk(job_id, video_path, device_id, start_frame, end_frame, fps,
+                  frame_step, analysis_types):
+    """在子进程中分析一个帧区间，返回检测结果（截图已写入磁盘）"""
+    from src.routes.ai_analysis import ai_engine
+
+    cv2.setNumThreads(1)
+    cap = cv2.VideoCapture(video_path)
+    results = []
+    frames_decoded = 0
+    frames_processed = 0
+
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        for frame_index in range(start_frame, end_frame):
+            # 跳过的帧只grab不retrieve，省去颜色转换和内存拷贝
+            if (frame_index - start_frame) % frame_step:
+                if not cap.grab():
+                    break
+                frames_decoded += 1
+                continue
+
+            if _cancelled is not None and _cancelled.is_set():
+                break
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames_decoded += 1
+            frames_processed += 1
+
+            for i, result in enumerate(ai_engine.detect(frame, analysis_types)):
+                image_path, _ = ai_engine.save_detection_image(
+                    device_id, result, frame, f"{result['type']}_{job_id}_{frame_index}_{i}"
+                )
+                result['image_path'] = image_path
+                result['metadata'] = {
+                    'frame_index': frame_index,
+                    'video_time': frame_index / fps
+                }
+                results.append(result)
+    finally:
+        cap.release()
+
+    return {'frames_decoded': frames_decoded, 'frames_processed': frames_processed, 'results': results}
+
+
+def run_job(app, job, on_progress=None):
+    """执行离线分析任务：进程池并行分析各区间，结果经常规事件路径入库"""
+    from src.routes.ai_analysis import ai_engine
+
+    job.status = 'running'
+    job.started_at = time.time()
+
+    try:
+        job.chunks = split_chunks(job.video_path, job.chunk_seconds)
+        job.frames_total = job.chunks[-1][1] if job.chunks else 0
+        metadata = {'job_id': job.job_id, 'source': 'batch', 'video_path': job.video_path}
+
+        # 任务在后台线程中运行，使用spawn避免在多线程进程中fork
+        with ProcessPoolExecutor(max_workers=min(job.workers, len(job.chunks) or 1),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(job.cancelled,)) as executor:
+            futures = [
+                executor.submit(analyze_chunk, job.job_id, job.video_path, job.device_id,
+                                start, end, fps, job.frame_step, job.analysis_types)
+                for start, end, fps in job.chunks
+            ]
+
+            for future in as_completed(futures):
+                if job.cancelled.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    job.status = 'cancelled'
+                    break
+
+                chunk = future.result()
+                job.frames_decoded += chunk['frames_decoded']
+                job.frames_processed += chunk['frames_processed']
+                job.detections += len(chunk['results'])
+
+                # 子进程中的指标无法汇总到主进程，这里按分片结果统计
+                metrics.frames_decoded.inc(chunk['frames_decoded'], device_id=job.device_id, source='batch')
+                metrics.decode_fps.set(job.frames_decoded / (time.time() - job.started_at),
+                                       device_id=job.device_id, source='batch')
+
+                if chunk['results']:
+                    with app.app_context():
+                        job.events_saved += ai_engine.save_detection_batch(
+                            job.device_id, chunk['results'], metadata
+                        )
+
+                job.chunks_done += 1
+                if on_progress:
+                    on_progress(job)
+
+        if job.status == 'running':
+            job.status = 'completed'
+
+    except Exception as e:
+        job.status = 'failed'
+        job.error = str(e)
+        logger.exception("离线分析任务失败", extra={'job_id': job.job_id})
+
+    finally:
+        job.finished_at = time.time()
+        metrics.decode_fps.remove(device_id=job.device_id, source='batch')
+
+    return job
+
+
+def start_job(app, job):
+    """在后台线程中启动离线分析任务"""
+    batch_jobs[job.job_id] = job
+    thread = threading.Thread(target=run_job, args=(app, job), daemon=True)
+    thread.start()
+    return job
+
+
+def pending_chunks():
+    """运行中任务尚未完成的分片数"""
+    return sum(len(job.chunks) - job.chunks_done
+               for job in list(batch_jobs.values()) if job.status == 'running')
+
+
+metrics.register_queue('batch_analysis_chunks', pending_chunks)
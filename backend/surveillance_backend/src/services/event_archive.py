@@ -0,0 +1,531 @@
+"""ai_events时间分区：近期事件保留在ai_events表（热分区），已结束的月份归档为压缩列式文件
+
+每个归档分区是一个月的事件（numpy .npz，按时间倒序排列的列数组，设备ID和事件类型字典编码，
+字符串列存为UTF-8字节串加偏移量），分区目录记录在event_partitions表中。归档按月份顺序进行：
+先写入文件并标记为已归档，再分批从ai_events删除该月的行；热分区查询只读取最新归档分区之后的行，
+因此删除未完成时也不会重复计数。保留期按分区整体删除文件，不在ai_events中产生大范围删除。
+
+查询时按时间范围裁剪分区，只加载与范围重叠的分区文件（最近加载的分区缓存在内存中）；整月命中的分区
+按分区目录中的设备/事件类型计数得到行数，分页时只加载当前页所在的分区。
+"""
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import threading
+import logging
+import json
+import os
+import numpy as np
+
+EVENT_ARCHIVE_ENABLED = os.environ.get('EVENT_ARCHIVE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+EVENT_ARCHIVE_DIR = os.environ.get(
+    'EVENT_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'event_archive')
+)
+# 热分区保留的月数（含当月），至少2个月，保证最近7天的统计不跨越归档分区
+EVENT_HOT_MONTHS = max(2, int(os.environ.get('EVENT_HOT_MONTHS', 3)))
+# 归档分区保留的月数（含当月），0表示永久保留
+EVENT_RETENTION_MONTHS = int(os.environ.get('EVENT_RETENTION_MONTHS', 0))
+# 自动归档检查间隔（秒）
+ROLLOVER_INTERVAL = 3600
+READ_BATCH_SIZE = 50000
+DELETE_BATCH_SIZE = 10000
+# 归档中状态超过该时间视为归档进程已退出，可以重新认领（秒）
+STALE_CLAIM_SECONDS = 3600
+# 内存中缓存的分区数（字符串列只在读取行时加载）
+CACHED_PARTITIONS = 12
+# 与导出列顺序一致，metadata为原始JSON文本
+COLUMNS = ['id', 'device_id', 'event_type', 'confidence', 'bbox_x', 'bbox_y',
+           'bbox_width', 'bbox_height', 'image_path', 'created_at', 'metadata']
+# 查询过滤和分页需要的列，打开分区时加载
+FILTER_ARRAYS = ['id', 'created_at', 'confidence', 'bbox', 'device_id_codes', 'device_id_values',
+                 'device_id_offsets', 'event_type_codes', 'event_type_values', 'event_type_offsets']
+NULL_INT = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1)
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def add_months(dt, months):
+    year, month = divmod(dt.year * 12 + dt.month - 1 + months, 12)
+    return datetime(year, month + 1, 1)
+
+
+def to_micros(dt):
+    """UTC微秒时间戳；带时区的时间先转换为UTC"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def pack_strings(values):
+    """字符串列编码为UTF-8字节串、偏移量和空值标记"""
+    encoded = [value.encode() if value is not None else b'' for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    nulls = np.array([value is None for value in values], dtype=bool)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets, nulls
+
+
+def unpack_string(blob, offsets, index):
+    return blob[offsets[index]:offsets[index + 1]].tobytes().decode()
+
+
+class PartitionBuilder:
+    """按批次累积一个月的列数组，不保留行元组（行须已按时间倒序、同一时刻按ID倒序排列）
+
+    每批转换为numpy列数组，设备ID和事件类型随到随编码，字符串列按批打包为字节串，
+    峰值内存约为压缩前的列数据大小。
+    """
+
+    def __init__(self):
+        self.chunks = {name: [] for name in ('id', 'created_at', 'confidence', 'bbox')}
+        self.categories = {'device_id': {}, 'event_type': {}}
+        self.codes = {'device_id': [], 'event_type': []}
+        self.strings = {'image_path': [], 'metadata': []}
+        self.count = 0
+
+    def add(self, rows):
+        n = len(rows)
+        if not n:
+            return
+        self.chunks['id'].append(np.fromiter((row[0] for row in rows), dtype=np.int64, count=n))
+        self.chunks['created_at'].append(np.fromiter((to_micros(row[9]) for row in rows), dtype=np.int64, count=n))
+        self.chunks['confidence'].append(np.fromiter((row[3] for row in rows), dtype=np.float64, count=n))
+        self.chunks['bbox'].append(np.array(
+            [[NULL_INT if value is None else value for value in row[4:8]] for row in rows], dtype=np.int64
+        ).reshape(n, 4))
+        for name, column in (('device_id', 1), ('event_type', 2)):
+            categories = self.categories[name]
+            self.codes[name].append(np.fromiter(
+                (categories.setdefault(row[column], len(categories)) for row in rows), dtype=np.int32, count=n))
+        for name, column in (('image_path', 8), ('metadata', 10)):
+            blob, offsets, nulls = pack_strings([row[column] for row in rows])
+            self.strings[name].append((blob, np.diff(offsets), nulls))
+        self.count += n
+
+    def arrays(self):
+        arrays = {name: np.concatenate(chunks) for name, chunks in self.chunks.items()}
+        for name, categories in self.categories.items():
+            arrays[f'{name}_codes'] = np.concatenate(self.codes[name])
+            arrays[f'{name}_values'], arrays[f'{name}_offsets'], _ = pack_strings(list(categories))
+        for name, chunks in self.strings.items():
+            arrays[name] = np.concatenate([blob for blob, _, _ in chunks])
+            offsets = np.zeros(self.count + 1, dtype=np.int64)
+            np.cumsum(np.concatenate([lengths for _, lengths, _ in chunks]), out=offsets[1:])
+            arrays[f'{name}_offsets'] = offsets
+            arrays[f'{name}_nulls'] = np.concatenate([nulls for _, _, nulls in chunks])
+        return arrays
+
+    def event_counts(self, arrays):
+        """各设备各事件类型的行数 {device_id: {event_type: n}}，记录在分区目录中"""
+        devices, types = list(self.categories['device_id']), list(self.categories['event_type'])
+        pairs = arrays['device_id_codes'].astype(np.int64) * len(types) + arrays['event_type_codes']
+        counts = {}
+        for pair, n in zip(*np.unique(pairs, return_counts=True)):
+            device, kind = divmod(int(pair), len(types))
+            counts.setdefault(devices[device], {})[types[kind]] = int(n)
+        return counts
+
+
+def write_partition(path, arrays):
+    """将一个月的列数组写入归档文件，返回文件大小"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return os.path.getsize(path)
+
+
+class PartitionFile:
+    """已加载的归档分区（字符串列在首次读取行时才解压）"""
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in FILTER_ARRAYS}
+        self.ids = arrays['id']
+        self.created_at = arrays['created_at']
+        self.negated_created_at = -self.created_at
+        self.confidence = arrays['confidence']
+        self.bbox = arrays['bbox']
+        self.categories = {}
+        self.codes = {}
+        self.strings = None
+        self.lock = threading.Lock()
+        for name in ('device_id', 'event_type'):
+            values, offsets = arrays[f'{name}_values'], arrays[f'{name}_offsets']
+            labels = [unpack_string(values, offsets, i) for i in range(len(offsets) - 1)]
+            self.categories[name] = labels
+            self.codes[name] = arrays[f'{name}_codes']
+
+    def __len__(self):
+        return len(self.ids)
+
+    def select(self, device_id=None, event_type=None, start=None, end=None):
+        """满足条件的行下标（按时间倒序）"""
+        # 倒序时间的相反数递增：时间<=end的行从lo开始，时间>=start的行到hi为止
+        lo = 0 if end is None else int(np.searchsorted(self.negated_created_at, -to_micros(end), side='left'))
+        hi = len(self) if start is None else int(np.searchsorted(self.negated_created_at, -to_micros(start),
+                                                                   side='right'))
+        indices = np.arange(lo, max(lo, hi))
+        for name, value in (('device_id', device_id), ('event_type', event_type)):
+            if value is None:
+                continue
+            if value not in self.categories[name]:
+                return indices[:0]
+            code = self.categories[name].index(value)
+            indices = indices[self.codes[name][indices] == code]
+        return indices
+
+    def find(self, ids):
+        return np.nonzero(np.isin(self.ids, np.asarray(list(ids), dtype=np.int64)))[0]
+
+    def load_strings(self):
+        with self.lock:
+            if self.strings is None:
+                with np.load(self.path) as data:
+                    self.strings = {name: (data[name], data[f'{name}_offsets'], data[f'{name}_nulls'])
+                                    for name in ('image_path', 'metadata')}
+        return self.strings
+
+    def string(self, name, index):
+        blob, offsets, nulls = (self.strings or self.load_strings())[name]
+        return None if nulls[index] else unpack_string(blob, offsets, index)
+
+    def row(self, index):
+        """按导出列顺序返回一行（metadata为原始JSON文本）"""
+        bbox = [None if value == NULL_INT else int(value) for value in self.bbox[index]]
+        return (
+            int(self.ids[index]),
+            self.categories['device_id'][self.codes['device_id'][index]],
+            self.categories['event_type'][self.codes['event_type'][index]],
+            float(self.confidence[index]),
+            *bbox,
+            self.string('image_path', index),
+            EPOCH + timedelta(microseconds=int(self.created_at[index])),
+            self.string('metadata', index)
+        )
+
+
+@lru_cache(maxsize=CACHED_PARTITIONS)
+def load_partition(path, mtime):
+    return PartitionFile(path)
+
+
+def open_partition(path):
+    return load_partition(path, os.path.getmtime(path))
+
+
+def event_dict(row):
+    """归档行转换为与AIEvent.to_dict相同的结构"""
+    record = dict(zip(COLUMNS, row))
+    record['created_at'] = record['created_at'].isoformat()
+    record['metadata'] = json.loads(record['metadata']) if record['metadata'] else None
+    return record
+
+
+class ArchiveResult:
+    """跨归档分区的查询结果，分区按时间倒序排列"""
+
+    def __init__(self, parts):
+        # (分区路径, 行数, 过滤条件)；整个分区命中时过滤条件为None。行数取自分区目录，
+        # 分区文件只在读取的行落在该分区时才加载
+        self.parts = parts
+
+    @property
+    def total(self):
+        return sum(count for _, count, _ in self.parts)
+
+    def iter_rows(self, offset=0, limit=None):
+        for path, count, conditions in self.parts:
+            if limit is not None and limit <= 0:
+                return
+            if offset >= count:
+                offset -= count
+                continue
+            partition = open_partition(path)
+            indices = np.arange(len(partition)) if conditions is None else partition.select(**conditions)
+            stop = len(indices) if limit is None else min(len(indices), offset + limit)
+            for index in indices[offset:stop]:
+                yield partition.row(index)
+            if limit is not None:
+                limit -= stop - offset
+            offset = 0
+
+    def batches(self, size, limit=None):
+        batch = []
+        for row in self.iter_rows(limit=limit):
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+class EventArchive:
+    """ai_events分区管理：月度归档、保留期清理和跨分区查询"""
+
+    def __init__(self, directory=EVENT_ARCHIVE_DIR, hot_months=EVENT_HOT_MONTHS,
+                 retention_months=EVENT_RETENTION_MONTHS, interval=ROLLOVER_INTERVAL):
+        self.directory = directory
+        self.hot_months = max(2, hot_months)
+        self.retention_months = retention_months
+        self.interval = interval
+        self.app = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # ---- 查询 ----
+
+    def partitions(self):
+        """已归档的分区（按时间倒序）"""
+        from src.models.device import EventPartition
+
+        return EventPartition.query.filter_by(status='archived').order_by(EventPartition.start_time.desc()).all()
+
+    def hot_filters(self, partitions=None):
+        """热分区查询条件：只读取最新归档分区之后的行"""
+        from src.models.device import AIEvent
+
+        partitions = self.partitions() if partitions is None else partitions
+        if not partitions:
+            return []
+        return [AIEvent.created_at >= partitions[0].end_time]
+
+    def search(self, device_id=None, event_type=None, start=None, end=None, partitions=None):
+        """查询归档分区，按时间范围裁剪不重叠的分区"""
+        partitions = self.partitions() if partitions is None else partitions
+        start_micros = to_micros(start) if start is not None else None
+        end_micros = to_micros(end) if end is not None else None
+
+        parts = []
+        for partition in partitions:
+            partition_start, partition_end = to_micros(partition.start_time), to_micros(partition.end_time)
+            if start_micros is not None and partition_end <= start_micros:
+                continue
+            if end_micros is not None and partition_start > end_micros:
+                continue
+            covered = ((start_micros is None or start_micros <= partition_start) and
+                       (end_micros is None or end_micros >= partition_end))
+            if covered and device_id is None and event_type is None:
+                parts.append((partition.path, partition.row_count, None))
+                continue
+            conditions = {'device_id': device_id, 'event_type': event_type, 'start': start, 'end': end}
+            if covered and partition.event_counts is not None:
+                # 整月命中时按分区目录中的设备/事件类型计数得到行数，不加载分区文件
+                count = sum(n for device, types in partition.event_counts.items()
+                            if device_id is None or device == device_id
+                            for kind, n in types.items() if event_type is None or kind == event_type)
+            else:
+                count = len(open_partition(partition.path).select(**conditions))
+            if count:
+                parts.append((partition.path, count, conditions))
+        return ArchiveResult(parts)
+
+    def find(self, event_ids):
+        """按ID查找已归档的事件，返回 {id: 事件字典}"""
+        event_ids = set(event_ids)
+        events = {}
+        for partition in self.partitions():
+            if not event_ids:
+                break
+            if partition.min_id is None or not any(partition.min_id <= i <= partition.max_id for i in event_ids):
+                continue
+            data = open_partition(partition.path)
+            for index in data.find(event_ids):
+                record = event_dict(data.row(index))
+                events[record['id']] = record
+                event_ids.discard(record['id'])
+        return events
+
+    # ---- 归档 ----
+
+    def hot_boundary(self, now=None):
+        """热分区起点：早于该时间的整月归档"""
+        return add_months(month_start(now or datetime.utcnow()), -(self.hot_months - 1))
+
+    def roll_over(self, now=None):
+        """按月份顺序归档热分区之前的月份并清理过期分区，返回本次归档的月份"""
+        from src.models.device import AIEvent, db
+
+        now = now or datetime.utcnow()
+        boundary = self.hot_boundary(now)
+        archived = []
+
+        oldest = db.session.query(db.func.min(AIEvent.created_at)).filter(AIEvent.created_at < boundary).scalar()
+        month = month_start(oldest) if oldest is not None else boundary
+        while month < boundary:
+            # 按顺序归档，某个月失败（或由其他进程处理中）时停止，避免热分区查询条件跳过未归档的月份
+            if not self.archive_month(month):
+                break
+            archived.append(month.strftime('%Y-%m'))
+            month = add_months(month, 1)
+
+        self.drop_expired(now)
+        return archived
+
+    def claim(self, month, start, end, path):
+        """认领月份的归档任务（多进程时只有一个进程执行）"""
+        from src.models.device import EventPartition, db
+        from sqlalchemy.exc import IntegrityError
+
+        try:
+            db.session.add(EventPartition(month=month, status='archiving', path=path, start_time=start, end_time=end))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+
+        now = datetime.utcnow()
+        claimed = EventPartition.query.filter(
+            EventPartition.month == month,
+            EventPartition.status == 'archiving',
+            EventPartition.updated_at < now - timedelta(seconds=STALE_CLAIM_SECONDS)
+        ).update({'updated_at': now}, synchronize_session=False)
+        db.session.commit()
+        return bool(claimed)
+
+    def archive_month(self, start):
+        """归档一个月的事件；已归档或没有事件时直接返回True"""
+        from src.models.device import AIEvent, EventPartition, db
+        from sqlalchemy import select, type_coerce, Text
+
+        end = add_months(start, 1)
+        month = start.strftime('%Y-%m')
+        partition = db.session.get(EventPartition, month)
+        if partition is not None and partition.status == 'archived':
+            self.purge_hot(end)
+            return True
+
+        path = os.path.join(self.directory, f'ai_events_{start:%Y%m}.npz')
+        if not self.claim(month, start, end, path):
+            return False
+
+        table = AIEvent.__table__
+        columns = [table.c[name] for name in COLUMNS[:-1]] + [type_coerce(table.c['metadata'], Text)]
+        # 由数据库按时间倒序（同一时刻按ID倒序）排列，与事件列表的排序一致，读取时逐批转为列数组
+        statement = select(*columns).where(table.c.created_at >= start, table.c.created_at < end).order_by(
+            table.c.created_at.desc(), table.c.id.desc())
+        try:
+            builder = PartitionBuilder()
+            with db.engine.connect() as conn:
+                result = conn.execution_options(stream_results=True, yield_per=READ_BATCH_SIZE).execute(statement)
+                for batch in result.partitions():
+                    builder.add(batch)
+
+            if not builder.count:
+                EventPartition.query.filter_by(month=month).delete(synchronize_session=False)
+                db.session.commit()
+                return True
+
+            arrays = builder.arrays()
+            counts = builder.event_counts(arrays)
+            builder = None
+            size = write_partition(path, arrays)
+            rows = len(arrays['id'])
+            EventPartition.query.filter_by(month=month).update({
+                'status': 'archived', 'row_count': rows, 'min_id': int(arrays['id'].min()),
+                'max_id': int(arrays['id'].max()), 'event_counts': counts, 'size_bytes': size,
+                'updated_at': datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            EventPartition.query.filter_by(month=month).delete(synchronize_session=False)
+            db.session.commit()
+            logger.exception("事件分区归档失败", extra={'month': month})
+            return False
+
+        logger.info("事件分区已归档", extra={'month': month, 'rows': rows, 'size_bytes': size})
+        self.purge_hot(end)
+        return True
+
+    def purge_hot(self, before):
+        """分批删除热分区中已归档的行（早于before），避免长时间锁表"""
+        from src.models.device import AIEvent, db
+        from sqlalchemy import select
+
+        table = AIEvent.__table__
+        while True:
+            ids = db.session.execute(
+                select(table.c.id).where(table.c.created_at < before).limit(DELETE_BATCH_SIZE)
+            ).scalars().all()
+            if ids:
+                db.session.execute(table.delete().where(table.c.id.in_(ids)))
+            db.session.commit()
+            if len(ids) < DELETE_BATCH_SIZE:
+                break
+
+    def drop_expired(self, now=None):
+        """删除超出保留期的归档分区"""
+        if not self.retention_months:
+            return []
+
+        from src.models.device import EventPartition, db
+
+        cutoff = add_months(month_start(now or datetime.utcnow()), -(self.retention_months - 1))
+        expired = EventPartition.query.filter(EventPartition.status == 'archived',
+                                              EventPartition.end_time <= cutoff).all()
+        for partition in expired:
+            db.session.delete(partition)
+            db.session.commit()
+            try:
+                os.remove(partition.path)
+            except FileNotFoundError:
+                pass
+            logger.info("过期事件分区已删除", extra={'month': partition.month})
+        return [partition.month for partition in expired]
+
+    def status(self):
+        partitions = self.partitions()
+        return {
+            'enabled': self.thread is not None,
+            'directory': self.directory,
+            'hot_months': self.hot_months,
+            'retention_months': self.retention_months,
+            'hot_start': self.hot_boundary().isoformat(),
+            'archived_rows': sum(p.row_count or 0 for p in partitions),
+            'archived_bytes': sum(p.size_bytes or 0 for p in partitions),
+            'partitions': [p.to_dict() for p in partitions]
+        }
+
+    # ---- 自动归档 ----
+
+    def start(self, app):
+        if self.thread is not None:
+            return
+        self.app = app
+        self.thread = threading.Thread(target=self.run, name='event-archive', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.roll_over()
+            except Exception:
+                logger.exception("事件归档失败")
+            if self.stopped.wait(self.interval):
+                break
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = EventArchive()
+        return _archive
@@ -0,0 +1,388 @@
+import cv2
+import numpy as np
+import threading
+import atexit
+import logging
+import json
+import os
+
+# 人脸特征模型（OpenCV DNN可加载的本地文件，默认使用OpenFace nn4.small2.v1）
+FACE_EMBEDDING_MODEL = os.environ.get(
+    'FACE_EMBEDDING_MODEL',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ai_models', 'nn4.small2.v1.t7')
+)
+# 特征库存储目录
+FACE_INDEX_DIR = os.environ.get('FACE_INDEX_DIR', '/tmp/face_index')
+# 超过该规模后启用IVF分区索引
+FACE_IVF_THRESHOLD = int(os.environ.get('FACE_IVF_THRESHOLD', 1000000))
+
+logger = logging.getLogger(__name__)
+
+
+class FaceEmbedder:
+    """人脸特征提取器（OpenCV DNN，CPU推理）"""
+
+    def __init__(self, model_path=FACE_EMBEDDING_MODEL, input_size=(96, 96),
+                 scale=1.0 / 255, mean=(0, 0, 0), swap_rb=True):
+        self.model_path = model_path
+        self.input_size = input_size
+        self.scale = scale
+        self.mean = mean
+        self.swap_rb = swap_rb
+        self.net = None
+        self.load_model()
+
+    def load_model(self):
+        """加载特征提取模型"""
+        try:
+            if not os.path.exists(self.model_path):
+                logger.warning("人脸特征模型不存在", extra={'model_path': self.model_path})
+                return
+
+            self.net = cv2.dnn.readNet(self.model_path)
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+        except Exception:
+            self.net = None
+            logger.exception("人脸特征模型加载失败", extra={'model_path': self.model_path})
+
+    @property
+    def available(self):
+        return self.net is not None
+
+    def embed(self, face):
+        """提取单张人脸特征（L2归一化的float32向量）"""
+        return self.embed_batch([face])[0]
+
+    def embed_batch(self, faces):
+        """批量提取人脸特征，返回 (n, dim) float32 矩阵"""
+        if not self.available:
+            raise RuntimeError('人脸特征模型未加载')
+
+        blob = cv2.dnn.blobFromImages(
+            faces, self.scale, self.input_size, self.mean, swapRB=self.swap_rb, crop=False
+        )
+        self.net.setInput(blob)
+        vectors = self.net.forward().reshape(len(faces), -1).astype(np.float32)
+        return normalize(vectors)
+
+
+def normalize(vectors):
+    """按行L2归一化，归一化后内积即余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """返回分数最高的k个下标（降序）"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class FaceIndex:
+    """人脸特征索引
+
+    特征以float32矩阵形式存放在内存映射文件中，与事件ID一一对应。
+    小规模库使用向量化暴力检索；超过 ivf_threshold 后构建IVF分区索引，
+    只在最相近的 nprobe 个分区内计算相似度。
+    """
+
+    def __init__(self, data_dir=FACE_INDEX_DIR, dim=128, initial_capacity=1024,
+                 ivf_threshold=FACE_IVF_THRESHOLD, nlist=None, nprobe=16):
+        self.data_dir = data_dir
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.lock = threading.Lock()
+        self.count = 0
+        self.capacity = 0
+        self.vectors = None
+        self.ids = None
+        self.ivf = None
+        self.ivf_building = False
+
+        os.makedirs(data_dir, exist_ok=True)
+        self._open(initial_capacity)
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.data_dir, 'vectors.f32')
+
+    @property
+    def ids_path(self):
+        return os.path.join(self.data_dir, 'ids.i64')
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.data_dir, 'meta.json')
+
+    @property
+    def ivf_path(self):
+        return os.path.join(self.data_dir, 'ivf.npz')
+
+    def _open(self, initial_capacity):
+        """打开（或创建）内存映射文件"""
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get('dim', self.dim) != self.dim:
+                raise ValueError(f"特征维度不匹配: {meta['dim']} != {self.dim}")
+
+        capacity = meta.get('capacity', initial_capacity)
+        self._map(capacity)
+
+        # meta.json只在flush时写入，这里向后扫描恢复最近追加的记录
+        count = min(meta.get('count', 0), capacity)
+        unused = np.flatnonzero(self.ids[count:] < 0)
+        self.count = count + (int(unused[0]) if unused.size else capacity - count)
+
+        if os.path.exists(self.ivf_path):
+            data = np.load(self.ivf_path)
+            self.ivf = {key: data[key] for key in data.files}
+
+    def _map(self, capacity):
+        """按容量映射特征矩阵和ID数组，新增部分ID填充为-1"""
+        created = not os.path.exists(self.ids_path)
+        for path, size in ((self.vectors_path, capacity * self.dim * 4),
+                           (self.ids_path, capacity * 8)):
+            with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+                if os.fstat(f.fileno()).st_size < size:
+                    f.truncate(size)
+
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                            shape=(capacity, self.dim))
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode='r+', shape=(capacity,))
+        if created:
+            ids[:] = -1
+        elif capacity > self.capacity > 0:
+            ids[self.capacity:] = -1
+
+        # 先建好新映射再替换引用，并发检索始终看到完整的矩阵
+        self.vectors = vectors
+        self.ids = ids
+        self.capacity = capacity
+
+    def add(self, event_id, vector):
+        """添加一条人脸特征"""
+        self.add_batch([event_id], np.asarray(vector, dtype=np.float32).reshape(1, -1))
+
+    def add_batch(self, event_ids, vectors):
+        """批量添加人脸特征"""
+        vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        n = vectors.shape[0]
+
+        with self.lock:
+            if self.count + n > self.capacity:
+                capacity = max(self.capacity * 2, self.count + n)
+                self._flush()
+                self._map(capacity)
+                self._write_meta()
+
+            start = self.count
+            self.vectors[start:start + n] = vectors
+            self.ids[start:start + n] = np.asarray(event_ids, dtype=np.int64)
+            self.count += n
+            # 批量写入后落盘；逐条写入（实时分析）在扩容、构建IVF和进程退出时落盘
+            if n > 1:
+                self._flush()
+            # 检查和置位构建标记在同一把锁内完成，并发写入只启动一个构建线程
+            build = self._needs_ivf_build()
+            if build:
+                self.ivf_building = True
+
+        if build:
+            self._start_ivf_thread()
+
+    def flush(self):
+        """将内存映射数据和元信息写回磁盘"""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.vectors.flush()
+        self.ids.flush()
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'count': self.count, 'capacity': self.capacity}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _needs_ivf_build(self):
+        """达到阈值且未建索引，或索引外的新增数据超过10%时需要（重新）构建"""
+        if self.count < self.ivf_threshold or self.ivf_building:
+            return False
+        if self.ivf is None:
+            return True
+        indexed = int(self.ivf['indexed_count'])
+        return self.count - indexed > indexed * 0.1
+
+    def build_ivf_async(self):
+        """后台构建IVF索引，构建期间检索继续使用旧索引或暴力检索；已在构建时返回None"""
+        with self.lock:
+            if self.ivf_building:
+                return None
+            self.ivf_building = True
+        return self._start_ivf_thread()
+
+    def _start_ivf_thread(self):
+        thread = threading.Thread(target=self._build_ivf, daemon=True)
+        thread.start()
+        return thread
+
+    def build_ivf(self, chunk_size=262144):
+        """构建IVF分区索引，已有构建在进行时返回False"""
+        with self.lock:
+            if self.ivf_building:
+                return False
+            self.ivf_building = True
+        self._build_ivf(chunk_size)
+        return True
+
+    def _build_ivf(self, chunk_size=262144):
+        """构建IVF分区索引（k-means粗聚类 + 按分区排序的倒排表），调用前须已置位构建标记"""
+        try:
+            count = self.count
+            vectors = self.vectors[:count]
+            nlist = self.nlist or max(1, int(np.sqrt(count)))
+
+            # 在采样数据上训练聚类中心（每个分区约40个样本）
+            rng = np.random.default_rng(0)
+            sample_idx = np.sort(rng.choice(count, size=min(nlist * 40, count), replace=False))
+            sample = np.ascontiguousarray(vectors[sample_idx])
+            nlist = min(nlist, sample.shape[0])
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1e-4)
+            _, _, centroids = cv2.kmeans(sample, nlist, None, criteria, 1, cv2.KMEANS_RANDOM_CENTERS)
+            centroids = normalize(centroids)
+
+            # 分块分配到最近的聚类中心
+            assign = np.empty(count, dtype=np.int32)
+            for start in range(0, count, chunk_size):
+                chunk = vectors[start:start + chunk_size]
+                assign[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+
+            order = np.argsort(assign, kind='stable').astype(np.int64)
+            offsets = np.zeros(nlist + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+
+            ivf = {
+                'centroids': centroids,
+                'order': order,
+                'offsets': offsets,
+                'indexed_count': np.int64(count)
+            }
+            tmp_path = self.ivf_path + '.tmp.npz'
+            np.savez(tmp_path, **ivf)
+            os.replace(tmp_path, self.ivf_path)
+            self.ivf = ivf
+            self.flush()
+
+        except Exception:
+            logger.exception("IVF索引构建失败", extra={'data_dir': self.data_dir})
+        finally:
+            self.ivf_building = False
+
+    def search(self, query, k=10, nprobe=None):
+        """余弦相似度top-k检索，返回 [(event_id, score), ...]"""
+        query = normalize(np.asarray(query, dtype=np.float32).reshape(-1))
+        vectors, ids, count = self.vectors, self.ids, self.count
+        if count == 0:
+            return []
+
+        ivf = self.ivf
+        if ivf is None or count < self.ivf_threshold:
+            rows = None
+            scores = vectors[:count] @ query
+        else:
+            rows, scores = self._search_ivf(vectors, ivf, query, count, nprobe or self.nprobe)
+
+        best = top_k(scores, k)
+        if rows is not None:
+            best_rows = rows[best]
+        else:
+            best_rows = best
+        return [(int(ids[row]), float(scores[i])) for i, row in zip(best, best_rows)]
+
+    def _search_ivf(self, vectors, ivf, query, count, nprobe):
+        """在最相近的nprobe个分区及未入索引的新增数据中检索"""
+        centroids = ivf['centroids']
+        order = ivf['order']
+        offsets = ivf['offsets']
+        indexed = int(ivf['indexed_count'])
+
+        probes = top_k(centroids @ query, nprobe)
+        parts = [order[offsets[c]:offsets[c + 1]] for c in probes]
+        if count > indexed:
+            parts.append(np.arange(indexed, count, dtype=np.int64))
+        rows = np.sort(np.concatenate(parts))
+
+        return rows, vectors[rows] @ query
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'capacity': self.capacity,
+            'dim': self.dim,
+            'index_type': 'ivf' if self.ivf is not None and self.count >= self.ivf_threshold else 'flat',
+            'ivf_lists': int(self.ivf['centroids'].shape[0]) if self.ivf is not None else 0,
+            'ivf_building': self.ivf_building
+        }
+
+
+class FaceService:
+    """人脸子系统：特征提取 + 特征索引"""
+
+    def __init__(self, embedder=None, index=None):
+        self.embedder = embedder or FaceEmbedder()
+        self.index = index
+        self.lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.embedder.available
+
+    def get_index(self, dim):
+        """按模型输出维度打开特征索引"""
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    self.index = FaceIndex(dim=dim)
+                    atexit.register(self.index.flush)
+        return self.index
+
+    def index_face(self, event_id, face):
+        """提取并入库一张人脸截图"""
+        vector = self.embedder.embed(face)
+        self.get_index(vector.shape[0]).add(event_id, vector)
+        return vector
+
+    def search_image(self, face, k=10):
+        """以人脸图像检索"""
+        vector = self.embedder.embed(face)
+        return self.get_index(vector.shape[0]).search(vector, k)
+
+
+# 全局人脸服务实例（首次使用时创建）
+_face_service = None
+_face_service_lock = threading.Lock()
+
+
+def get_face_service():
+    global _face_service
+    if _face_service is None:
+        with _face_service_lock:
+            if _face_service is None:
+                _face_service = FaceService()
+    return _face_service
@@ -0,0 +1,152 @@
+"""分析帧源：按设备配置的解码模式从视频流读取BGR帧
+
+解码模式:
+    full      完整解码（默认，使用OpenCV VideoCapture）
+    noref     解码器跳过非参考帧（ffmpeg -skip_frame noref，主要省去B帧解码）
+    keyframe  只解码关键帧（ffmpeg -skip_frame nokey，帧率等于关键帧间隔）
+
+使用ffmpeg时可以在解码进程内缩放（scale滤镜）并限制输出帧率（fps滤镜），
+全分辨率帧和多余的帧不会经过管道进入Python。帧源接口与cv2.VideoCapture一致（grab/retrieve/read/release）。
+"""
+import numpy as np
+import subprocess
+import threading
+import logging
+import shutil
+import cv2
+import re
+
+DECODE_MODES = ('full', 'noref', 'keyframe')
+# 等待ffmpeg输出流信息的最长时间（秒）
+OPEN_TIMEOUT = 15
+
+logger = logging.getLogger(__name__)
+
+
+def ffmpeg_command(source, mode='full', width=None, fps=None):
+    """构建输出原始BGR帧到标准输出的ffmpeg命令"""
+    if mode not in DECODE_MODES:
+        raise ValueError(f'不支持的解码模式: {mode}')
+
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'info']
+    if source.startswith('rtsp://'):
+        cmd += ['-rtsp_transport', 'tcp']
+    if mode == 'keyframe':
+        cmd += ['-skip_frame', 'nokey']
+    elif mode == 'noref':
+        cmd += ['-skip_frame', 'noref']
+    cmd += ['-i', source, '-an']
+
+    filters = []
+    # 关键帧模式的帧率已经很低，fps滤镜会重复帧补足帧率，不使用
+    if fps and mode != 'keyframe':
+        filters.append(f'fps={fps:g}')
+    if width:
+        filters.append(f'scale={int(width)}:-2')
+    if filters:
+        cmd += ['-vf', ','.join(filters)]
+    if mode == 'keyframe':
+        cmd += ['-vsync', 'passthrough']
+
+    cmd += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+    return cmd
+
+
+class FFmpegFrameSource:
+    """ffmpeg子进程解码，经管道读取原始BGR帧"""
+
+    def __init__(self, source, mode='full', width=None, fps=None):
+        self.source = source
+        self.mode = mode
+        self.width = None
+        self.height = None
+        self.frame = None
+        self.stderr_tail = []
+        self.process = subprocess.Popen(ffmpeg_command(source, mode, width, fps),
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, bufsize=0)
+        self.stdout = self.process.stdout
+        self.read_output_size()
+
+    def read_output_size(self):
+        """从ffmpeg的流信息中解析输出帧尺寸，之后在后台线程中继续读取stderr"""
+        found = threading.Event()
+
+        def drain():
+            in_output = False
+            for raw in iter(self.process.stderr.readline, b''):
+                line = raw.decode(errors='replace').rstrip()
+                self.stderr_tail = (self.stderr_tail + [line])[-20:]
+                if line.startswith('Output #0'):
+                    in_output = True
+                elif in_output and not found.is_set():
+                    match = re.search(r'Video: rawvideo.*?, (\d+)x(\d+)', line)
+                    if match:
+                        self.width, self.height = int(match.group(1)), int(match.group(2))
+                        found.set()
+            found.set()
+
+        threading.Thread(target=drain, name='ffmpeg-stderr', daemon=True).start()
+        found.wait(OPEN_TIMEOUT)
+        if self.width is None:
+            logger.warning("ffmpeg解码启动失败", extra={'source': self.source, 'mode': self.mode,
+                                                    'stderr': self.stderr_tail[-5:]})
+            self.release()
+
+    @property
+    def frame_bytes(self):
+        return self.width * self.height * 3
+
+    def isOpened(self):
+        return self.width is not None and self.process.poll() is None
+
+    def grab(self):
+        if self.width is None:
+            return False
+        buffer = bytearray(self.frame_bytes)
+        if pipe_readinto(self.stdout, buffer) != len(buffer):
+            self.frame = None
+            return False
+        self.frame = buffer
+        return True
+
+    def retrieve(self):
+        if self.frame is None:
+            return False, None
+        return True, np.frombuffer(self.frame, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.stdout.close()
+
+
+def pipe_readinto(stream, buffer):
+    """管道可能分多次返回数据，读满或EOF为止"""
+    view = memoryview(buffer)
+    total = 0
+    while total < len(buffer):
+        count = stream.readinto(view[total:])
+        if not count:
+            break
+        total += count
+    return total
+
+
+def open_frame_source(source, mode='full', width=None, fps=None):
+    """按解码模式打开帧源；完整解码且不缩放时使用OpenCV，ffmpeg不可用时退化为OpenCV完整解码"""
+    mode = mode or 'full'
+    if mode == 'full' and not width and not fps:
+        return cv2.VideoCapture(source)
+
+    if not shutil.which('ffmpeg'):
+        logger.warning("未找到ffmpeg，使用完整解码", extra={'source': source, 'mode': mode})
+        return cv2.VideoCapture(source)
+
+    return FFmpegFrameSource(source, mode, width, fps)
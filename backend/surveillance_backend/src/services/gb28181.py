@@ -0,0 +1,737 @@
+"""GB28181 SIP信令服务
+
+基于asyncio的UDP/TCP SIP服务，处理设备注册（摘要认证）、心跳保活、目录查询和实时点播（INVITE）。
+设备状态保存在内存中，在线/离线变化按批次写回 Device.status。
+"""
+from datetime import datetime
+import xml.etree.ElementTree as ET
+import threading
+import asyncio
+import hashlib
+import logging
+import socket
+import random
+import time
+import hmac
+import re
+import os
+
+GB28181_SIP_ID = os.environ.get('GB28181_SIP_ID', '34020000002000000001')
+GB28181_DOMAIN = os.environ.get('GB28181_DOMAIN', GB28181_SIP_ID[:10])
+GB28181_HOST = os.environ.get('GB28181_HOST', '0.0.0.0')
+GB28181_PORT = int(os.environ.get('GB28181_PORT', 5060))
+# 设备未单独设置密码时使用的注册密码，必须配置
+GB28181_PASSWORD = os.environ.get('GB28181_PASSWORD')
+# 超过该时间（秒）未收到心跳视为离线（默认3个60秒心跳周期）
+GB28181_KEEPALIVE_TIMEOUT = float(os.environ.get('GB28181_KEEPALIVE_TIMEOUT', 180))
+# 设备状态批量写库的间隔（秒）
+GB28181_FLUSH_INTERVAL = float(os.environ.get('GB28181_FLUSH_INTERVAL', 2))
+# 接收设备RTP推流的媒体服务器
+GB28181_MEDIA_IP = os.environ.get('GB28181_MEDIA_IP', '127.0.0.1')
+GB28181_MEDIA_PORT = int(os.environ.get('GB28181_MEDIA_PORT', 10000))
+# 媒体服务器对外提供的RTSP地址模板（默认ZLMediaKit的GB28181收流地址）
+GB28181_MEDIA_RTSP_URL = os.environ.get('GB28181_MEDIA_RTSP_URL', 'rtsp://{media_ip}:554/rtp/{stream_id}')
+
+NONCE_TTL = 300
+USER_AGENT = 'AI-Video-Surveillance-Platform'
+
+# SIP紧凑头域名
+COMPACT_HEADERS = {'v': 'via', 'f': 'from', 't': 'to', 'i': 'call-id', 'm': 'contact',
+                   'l': 'content-length', 'c': 'content-type'}
+
+logger = logging.getLogger(__name__)
+
+
+class SipMessage:
+    """SIP消息"""
+
+    def __init__(self, start_line, headers=None, body=b''):
+        self.start_line = start_line
+        self.headers = headers or []
+        self.body = body
+
+        parts = start_line.split(' ', 2)
+        self.is_request = not start_line.startswith('SIP/2.0')
+        if self.is_request:
+            self.method, self.uri = parts[0], parts[1]
+            self.status_code = None
+        else:
+            self.method, self.uri = None, None
+            self.status_code = int(parts[1])
+
+    @classmethod
+    def parse(cls, data):
+        head, _, body = data.partition(b'\r\n\r\n')
+        lines = head.decode('utf-8', errors='replace').split('\r\n')
+        headers = []
+        for line in lines[1:]:
+            if line[:1] in (' ', '\t') and headers:
+                # 折行
+                name, value = headers[-1]
+                headers[-1] = (name, value + ' ' + line.strip())
+                continue
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            headers.append((COMPACT_HEADERS.get(name, name), value.strip()))
+
+        message = cls(lines[0], headers)
+        length = message.header('content-length')
+        message.body = body[:int(length)] if length else body
+        return message
+
+    def header(self, name, default=None):
+        name = name.lower()
+        for key, value in self.headers:
+            if key == name:
+                return value
+        return default
+
+    def header_all(self, name):
+        name = name.lower()
+        return [value for key, value in self.headers if key == name]
+
+    @property
+    def call_id(self):
+        return self.header('call-id')
+
+    @property
+    def cseq(self):
+        number, _, method = (self.header('cseq') or '0 ').partition(' ')
+        return int(number), method.strip()
+
+    def to_bytes(self):
+        lines = [self.start_line]
+        lines.extend(f'{header_name(name)}: {value}' for name, value in self.headers
+                     if name != 'content-length')
+        lines.append(f'Content-Length: {len(self.body)}')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode() + self.body
+
+
+SPECIAL_HEADER_NAMES = {'call-id': 'Call-ID', 'cseq': 'CSeq', 'www-authenticate': 'WWW-Authenticate'}
+
+
+def header_name(name):
+    """头域名恢复为规范写法"""
+    return SPECIAL_HEADER_NAMES.get(name) or '-'.join(part.capitalize() for part in name.split('-'))
+
+
+def sip_user(value):
+    """从 <sip:34020000001320000001@3402000000> 中取出用户部分"""
+    match = re.search(r'sip:([^@;>]+)@', value or '')
+    return match.group(1) if match else None
+
+
+def header_tag(value):
+    match = re.search(r';\s*tag=([^;>\s]+)', value or '')
+    return match.group(1) if match else None
+
+
+def random_token(length=16):
+    return ''.join(random.choices('0123456789abcdef', k=length))
+
+
+def parse_digest(value):
+    """解析 Authorization: Digest ... 头"""
+    if not value or not value.lower().startswith('digest'):
+        return {}
+    params = {}
+    for match in re.finditer(r'(\w+)=(?:"([^"]*)"|([^,\s]+))', value[6:]):
+        params[match.group(1).lower()] = match.group(2) if match.group(2) is not None else match.group(3)
+    return params
+
+
+def md5_hex(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def digest_response(params, method, password):
+    """按RFC 2617计算摘要响应"""
+    ha1 = md5_hex(f"{params.get('username')}:{params.get('realm')}:{password}")
+    ha2 = md5_hex(f"{method}:{params.get('uri')}")
+    if params.get('qop'):
+        return md5_hex(f"{ha1}:{params.get('nonce')}:{params.get('nc')}:{params.get('cnonce')}:{params.get('qop')}:{ha2}")
+    return md5_hex(f"{ha1}:{params.get('nonce')}:{ha2}")
+
+
+def parse_xml(body):
+    """解析MANSCDP XML（通常为GB2312编码，expat不支持多字节编码，先自行解码）"""
+    match = re.search(rb'encoding="([^"]+)"', body[:100])
+    encoding = match.group(1).decode() if match else 'gb2312'
+    try:
+        text = body.decode(encoding, errors='replace')
+    except LookupError:
+        text = body.decode('gb2312', errors='replace')
+    text = re.sub(r'^\s*<\?xml[^>]*\?>', '', text)
+    return ET.fromstring(text)
+
+
+def xml_field(body, name):
+    """不做完整XML解析，快速取出单个字段（用于心跳等高频消息）"""
+    match = re.search(rb'<' + name.encode() + rb'>\s*([^<]*?)\s*</', body)
+    return match.group(1).decode(errors='replace') if match else None
+
+
+class DeviceState:
+    """已注册设备的内存状态"""
+
+    def __init__(self, device_id, transport, addr, writer=None):
+        self.device_id = device_id
+        self.transport = transport  # udp, tcp
+        self.addr = addr
+        self.writer = writer
+        self.registered_at = time.time()
+        self.expires = 3600
+        self.last_keepalive = time.time()
+        self.online = True
+        self.channels = {}
+        self.manufacturer = None
+        self.model = None
+
+    def same_source(self, transport, addr, writer=None):
+        """消息是否来自设备注册时的地址"""
+        if transport != self.transport:
+            return False
+        if transport == 'tcp':
+            return writer is self.writer
+        return tuple(addr) == tuple(self.addr)
+
+    def to_dict(self):
+        return {
+            'device_id': self.device_id,
+            'transport': self.transport,
+            'address': f'{self.addr[0]}:{self.addr[1]}',
+            'online': self.online,
+            'registered_at': self.registered_at,
+            'expires': self.expires,
+            'last_keepalive': self.last_keepalive,
+            'channels': list(self.channels.values())
+        }
+
+
+class SipUdpProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.udp_transport = transport
+
+    def datagram_received(self, data, addr):
+        if not data.strip():
+            return
+        try:
+            message = SipMessage.parse(data)
+        except Exception:
+            logger.warning("无法解析的SIP消息", extra={'remote': f'{addr[0]}:{addr[1]}'})
+            return
+        self.server.handle_message(message, 'udp', addr)
+
+
+class GB28181Server:
+    """GB28181信令服务"""
+
+    def __init__(self, app=None, host=GB28181_HOST, port=GB28181_PORT, sip_id=GB28181_SIP_ID,
+                 domain=GB28181_DOMAIN, password=GB28181_PASSWORD,
+                 keepalive_timeout=GB28181_KEEPALIVE_TIMEOUT, flush_interval=GB28181_FLUSH_INTERVAL):
+        if not password:
+            raise ValueError('未设置GB28181_PASSWORD（设备注册的默认密码）')
+        self.app = app
+        self.host = host
+        self.port = port
+        self.sip_id = sip_id
+        self.domain = domain
+        self.password = password
+        self.keepalive_timeout = keepalive_timeout
+        self.flush_interval = flush_interval
+        self.sip_ip = os.environ.get('GB28181_SIP_IP') or local_ip()
+        self.secret = os.urandom(16)
+
+        self.devices = {}
+        self.passwords = {}
+        self.pending_status = {}
+        self.pending = {}
+        self.sessions = {}
+        self.stats = {'requests': 0, 'registers': 0, 'keepalives': 0, 'auth_failures': 0, 'status_flushes': 0}
+
+        self.loop = None
+        self.thread = None
+        self.udp_transport = None
+        self.tcp_server = None
+        self.tasks = []
+        self.cseq = random.randint(1, 10000)
+        self.sn = random.randint(1, 10000)
+        self.ssrc_seq = 0
+
+    # ---- 生命周期 ----
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.loop.create_datagram_endpoint(lambda: SipUdpProtocol(self),
+                                                 local_addr=(self.host, self.port))
+        self.tcp_server = await asyncio.start_server(self.handle_tcp, self.host, self.port)
+        self.tasks = [
+            asyncio.create_task(self.flush_status_loop()),
+            asyncio.create_task(self.expire_loop()),
+            asyncio.create_task(self.refresh_passwords_loop())
+        ]
+        logger.info("GB28181信令服务已启动", extra={'sip_id': self.sip_id, 'port': self.port})
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.udp_transport:
+            self.udp_transport.close()
+        if self.tcp_server:
+            self.tcp_server.close()
+        await self.flush_status()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    def start_in_thread(self):
+        """在后台线程中运行事件循环"""
+        ready = threading.Event()
+        error = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.loop.run_until_complete(self.start())
+            except BaseException as e:
+                # 启动失败（如端口被占用）由调用线程抛出
+                error.append(e)
+                ready.set()
+                self.loop.close()
+                return
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name='gb28181', daemon=True)
+        self.thread.start()
+        if not ready.wait(10):
+            raise TimeoutError('GB28181信令服务启动超时')
+        if error:
+            raise error[0]
+        return self
+
+    def call(self, coro, timeout=10):
+        """从其他线程调用事件循环中的协程"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    # ---- 收包 ----
+
+    async def handle_tcp(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                match = re.search(rb'\r\n(?:content-length|l)\s*:\s*(\d+)', head, re.IGNORECASE)
+                length = int(match.group(1)) if match else 0
+                body = await reader.readexactly(length) if length else b''
+                self.handle_message(SipMessage.parse(head + body), 'tcp', addr, writer)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def handle_message(self, message, transport, addr, writer=None):
+        self.stats['requests'] += 1
+        try:
+            if not message.is_request:
+                self.handle_response(message)
+            elif message.method == 'REGISTER':
+                self.handle_register(message, transport, addr, writer)
+            elif message.method == 'MESSAGE':
+                self.handle_manscdp(message, transport, addr, writer)
+            elif message.method in ('BYE', 'CANCEL', 'NOTIFY', 'OPTIONS'):
+                self.reply(message, 200, 'OK', transport, addr, writer)
+                if message.method == 'BYE':
+                    self.sessions.pop(message.call_id, None)
+            elif message.method != 'ACK':
+                self.reply(message, 405, 'Method Not Allowed', transport, addr, writer)
+        except Exception:
+            logger.exception("SIP消息处理错误", extra={'method': message.method})
+
+    def handle_register(self, message, transport, addr, writer):
+        device_id = sip_user(message.header('from')) or sip_user(message.header('to'))
+        params = parse_digest(message.header('authorization'))
+
+        if not params or not self.check_nonce(params.get('nonce')):
+            self.reply(message, 401, 'Unauthorized', transport, addr, writer, [
+                ('www-authenticate', f'Digest realm="{self.domain}", nonce="{self.new_nonce()}", algorithm=MD5')
+            ])
+            return
+
+        # 摘要用户名必须是注册的设备ID、域必须是本平台，否则任一设备的凭据都能冒充其他设备注册
+        username = params.get('username')
+        password = self.passwords.get(username, self.password)
+        if username != device_id or params.get('realm') != self.domain or \
+                not hmac.compare_digest(digest_response(params, 'REGISTER', password), params.get('response', '')):
+            self.stats['auth_failures'] += 1
+            self.reply(message, 403, 'Forbidden', transport, addr, writer)
+            return
+
+        expires = int(message.header('expires', 3600))
+        self.stats['registers'] += 1
+        if expires == 0:
+            self.set_offline(device_id)
+        else:
+            state = self.devices.get(device_id)
+            if state is None:
+                state = self.devices[device_id] = DeviceState(device_id, transport, addr, writer)
+            state.transport, state.addr, state.writer = transport, addr, writer
+            state.registered_at = state.last_keepalive = time.time()
+            state.expires = expires
+            self.set_online(state)
+
+        self.reply(message, 200, 'OK', transport, addr, writer, [
+            ('date', datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]),
+            ('expires', str(expires))
+        ])
+
+    def handle_manscdp(self, message, transport, addr, writer):
+        body = message.body
+        cmd_type = xml_field(body, 'CmdType')
+        device_id = sip_user(message.header('from'))
+        state = self.devices.get(device_id)
+
+        # MESSAGE不做摘要认证：只接受来自注册地址（TCP为注册时的连接）的消息，设备地址只由认证通过的
+        # REGISTER更新，否则伪造一条消息即可把之后的点播重定向到其他主机。地址变化的设备需要重新注册
+        if state is None or not state.same_source(transport, addr, writer):
+            self.reply(message, 403, 'Forbidden', transport, addr, writer)
+            return
+
+        self.reply(message, 200, 'OK', transport, addr, writer)
+        state.last_keepalive = time.time()
+        if not state.online:
+            self.set_online(state)
+
+        if cmd_type == 'Keepalive':
+            self.stats['keepalives'] += 1
+        elif cmd_type == 'Catalog':
+            self.handle_catalog(state, body)
+        elif cmd_type == 'DeviceInfo':
+            root = parse_xml(body)
+            state.manufacturer = root.findtext('Manufacturer')
+            state.model = root.findtext('Model')
+
+    def handle_catalog(self, state, body):
+        """保存目录应答中的通道；目录可能分多条消息返回"""
+        root = parse_xml(body)
+        sn = root.findtext('SN')
+        for item in root.iter('Item'):
+            channel_id = item.findtext('DeviceID')
+            state.channels[channel_id] = {
+                'channel_id': channel_id,
+                'name': item.findtext('Name'),
+                'manufacturer': item.findtext('Manufacturer'),
+                'model': item.findtext('Model'),
+                'status': item.findtext('Status')
+            }
+
+        waiter = self.pending.get(('catalog', state.device_id, sn))
+        if waiter and not waiter['future'].done():
+            waiter['received'] += len(root.findall('.//Item'))
+            total = int(root.findtext('SumNum') or 0)
+            if waiter['received'] >= total:
+                waiter['future'].set_result(list(state.channels.values()))
+
+    def handle_response(self, message):
+        """处理设备对本服务请求的应答"""
+        number, method = message.cseq
+        waiter = self.pending.get(('transaction', message.call_id))
+        if waiter is None:
+            return
+        waiter['answered'] = True
+        if message.status_code < 200:
+            return
+
+        self.pending.pop(('transaction', message.call_id), None)
+        if method == 'INVITE' and message.status_code < 300:
+            # 2xx需要回ACK
+            self.send_raw(waiter['state'], self.build_request(
+                'ACK', waiter['state'], call_id=message.call_id, cseq=number,
+                from_tag=waiter['from_tag'], to=message.header('to')).to_bytes())
+        if not waiter['future'].done():
+            waiter['future'].set_result(message)
+
+    # ---- 发包 ----
+
+    def reply(self, request, code, reason, transport, addr, writer=None, extra_headers=()):
+        headers = [(name, value) for name, value in request.headers
+                   if name in ('via', 'from', 'call-id', 'cseq')]
+        to = request.header('to', '')
+        if code > 100 and not header_tag(to):
+            to = f'{to};tag={random_token(8)}'
+        headers.insert(2, ('to', to))
+        headers.append(('user-agent', USER_AGENT))
+        headers.extend(extra_headers)
+        data = SipMessage(f'SIP/2.0 {code} {reason}', headers).to_bytes()
+        self._send(transport, addr, writer, data)
+
+    def _send(self, transport, addr, writer, data):
+        if transport == 'tcp' and writer is not None:
+            writer.write(data)
+        elif self.udp_transport is not None:
+            self.udp_transport.sendto(data, addr)
+
+    def send_raw(self, state, data):
+        self._send(state.transport, state.addr, state.writer, data)
+
+    def build_request(self, method, state, call_id=None, cseq=None, from_tag=None, to=None,
+                      headers=(), body=b''):
+        self.cseq += 1
+        transport = 'TCP' if state.transport == 'tcp' else 'UDP'
+        request_headers = [
+            ('via', f'SIP/2.0/{transport} {self.sip_ip}:{self.port};rport;branch=z9hG4bK{random_token(12)}'),
+            ('from', f'<sip:{self.sip_id}@{self.domain}>;tag={from_tag or random_token(8)}'),
+            ('to', to or f'<sip:{state.device_id}@{self.domain}>'),
+            ('call-id', call_id or f'{random_token(20)}@{self.sip_ip}'),
+            ('cseq', f'{cseq or self.cseq} {method}'),
+            ('max-forwards', '70'),
+            ('user-agent', USER_AGENT)
+        ]
+        request_headers.extend(headers)
+        uri = f'sip:{state.device_id}@{state.addr[0]}:{state.addr[1]}'
+        return SipMessage(f'{method} {uri} SIP/2.0', request_headers, body)
+
+    async def transact(self, state, request, timeout=10):
+        """发送请求并等待最终应答；UDP下按RFC 3261 T1定时重传"""
+        future = self.loop.create_future()
+        from_tag = header_tag(request.header('from'))
+        waiter = {'future': future, 'state': state, 'from_tag': from_tag, 'answered': False}
+        self.pending[('transaction', request.call_id)] = waiter
+        data = request.to_bytes()
+        self.send_raw(state, data)
+
+        try:
+            if state.transport == 'udp':
+                interval = 0.5
+                deadline = self.loop.time() + timeout
+                while not future.done() and self.loop.time() < deadline:
+                    await asyncio.wait({future}, timeout=min(interval, deadline - self.loop.time()))
+                    if not future.done() and not waiter['answered']:
+                        self.send_raw(state, data)
+                    interval = min(interval * 2, 4)
+            return await asyncio.wait_for(future, max(0.01, timeout))
+        finally:
+            self.pending.pop(('transaction', request.call_id), None)
+
+    def next_sn(self):
+        self.sn += 1
+        return str(self.sn)
+
+    async def query_catalog(self, device_id, timeout=10):
+        """目录查询：发送Catalog查询，等待设备分条返回的目录应答"""
+        state = self.online_device(device_id)
+        sn = self.next_sn()
+        body = (f'<?xml version="1.0" encoding="GB2312"?>\r\n<Query>\r\n<CmdType>Catalog</CmdType>\r\n'
+                f'<SN>{sn}</SN>\r\n<DeviceID>{device_id}</DeviceID>\r\n</Query>\r\n').encode('gb2312')
+        request = self.build_request('MESSAGE', state, headers=[('content-type', 'Application/MANSCDP+xml')],
+                                     body=body)
+
+        future = self.loop.create_future()
+        self.pending[('catalog', device_id, sn)] = {'future': future, 'received': 0}
+        try:
+            self.send_raw(state, request.to_bytes())
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(('catalog', device_id, sn), None)
+
+    def next_ssrc(self):
+        """实时流SSRC：0 + 域编码第4-8位 + 4位序号"""
+        self.ssrc_seq = (self.ssrc_seq + 1) % 10000
+        return f'0{self.domain[3:8]}{self.ssrc_seq:04d}'
+
+    async def invite(self, device_id, channel_id=None, media_ip=GB28181_MEDIA_IP,
+                     media_port=GB28181_MEDIA_PORT, timeout=10):
+        """实时点播：请求设备向媒体服务器推送RTP(PS)流"""
+        state = self.online_device(device_id)
+        channel_id = channel_id or device_id
+        ssrc = self.next_ssrc()
+        sdp = '\r\n'.join([
+            'v=0',
+            f'o={self.sip_id} 0 0 IN IP4 {media_ip}',
+            's=Play',
+            f'c=IN IP4 {media_ip}',
+            't=0 0',
+            f'm=video {media_port} RTP/AVP 96 97 98',
+            'a=recvonly',
+            'a=rtpmap:96 PS/90000',
+            'a=rtpmap:97 MPEG4/90000',
+            'a=rtpmap:98 H264/90000',
+            f'y={ssrc}',
+            ''
+        ]).encode()
+        request = self.build_request('INVITE', state, to=f'<sip:{channel_id}@{self.domain}>', headers=[
+            ('contact', f'<sip:{self.sip_id}@{self.sip_ip}:{self.port}>'),
+            ('subject', f'{channel_id}:{ssrc},{self.sip_id}:0'),
+            ('content-type', 'APPLICATION/SDP')
+        ], body=sdp)
+
+        response = await self.transact(state, request, timeout)
+        if response.status_code >= 300:
+            raise RuntimeError(f'设备拒绝点播: {response.status_code}')
+
+        stream_id = f'{int(ssrc):08X}'
+        session = {
+            'call_id': request.call_id,
+            'device_id': device_id,
+            'channel_id': channel_id,
+            'ssrc': ssrc,
+            'stream_id': stream_id,
+            'from_tag': header_tag(request.header('from')),
+            'to': response.header('to'),
+            'cseq': request.cseq[0],
+            'rtsp_url': GB28181_MEDIA_RTSP_URL.format(media_ip=media_ip, stream_id=stream_id),
+            'device_sdp': response.body.decode(errors='replace'),
+            'started_at': time.time()
+        }
+        self.sessions[request.call_id] = session
+        return session
+
+    async def bye(self, call_id):
+        """结束点播会话"""
+        session = self.sessions.pop(call_id, None)
+        if session is None:
+            return False
+        state = self.devices.get(session['device_id'])
+        if state is not None:
+            request = self.build_request('BYE', state, call_id=call_id, cseq=session['cseq'] + 1,
+                                         from_tag=session['from_tag'], to=session['to'])
+            self.send_raw(state, request.to_bytes())
+        return True
+
+    def online_device(self, device_id):
+        state = self.devices.get(device_id)
+        if state is None or not state.online:
+            raise LookupError(f'设备未注册或不在线: {device_id}')
+        return state
+
+    # ---- 认证 ----
+
+    def new_nonce(self):
+        """无状态nonce：时间戳 + HMAC，服务端无需为每个设备保存nonce"""
+        timestamp = f'{int(time.time()):x}'
+        return timestamp + hmac.new(self.secret, timestamp.encode(), hashlib.sha256).hexdigest()[:16]
+
+    def check_nonce(self, nonce):
+        if not nonce or len(nonce) <= 16:
+            return False
+        timestamp, signature = nonce[:-16], nonce[-16:]
+        expected = hmac.new(self.secret, timestamp.encode(), hashlib.sha256).hexdigest()[:16]
+        try:
+            fresh = time.time() - int(timestamp, 16) < NONCE_TTL
+        except ValueError:
+            return False
+        return fresh and hmac.compare_digest(signature, expected)
+
+    # ---- 状态维护 ----
+
+    def set_online(self, state):
+        state.online = True
+        self.pending_status[state.device_id] = 'online'
+
+    def set_offline(self, device_id):
+        state = self.devices.get(device_id)
+        if state is not None:
+            state.online = False
+        self.pending_status[device_id] = 'offline'
+
+    async def expire_loop(self):
+        """心跳超时或注册过期的设备置为离线"""
+        while True:
+            await asyncio.sleep(min(10, self.keepalive_timeout / 3))
+            now = time.time()
+            for state in list(self.devices.values()):
+                if state.online and (now - state.last_keepalive > self.keepalive_timeout
+                                     or now - state.registered_at > state.expires):
+                    self.set_offline(state.device_id)
+
+    async def flush_status_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_status()
+
+    async def flush_status(self):
+        """将累积的状态变化合并为按状态分组的批量UPDATE"""
+        if not self.pending_status or self.app is None:
+            return
+        updates, self.pending_status = self.pending_status, {}
+        try:
+            await self.loop.run_in_executor(None, self.write_status, updates)
+            self.stats['status_flushes'] += 1
+        except Exception:
+            logger.exception("设备状态写入失败", extra={'count': len(updates)})
+            for device_id, status in updates.items():
+                self.pending_status.setdefault(device_id, status)
+
+    def write_status(self, updates, chunk_size=500):
+        from src.models.device import Device, db
+
+        by_status = {}
+        for device_id, status in updates.items():
+            by_status.setdefault(status, []).append(device_id)
+
+        with self.app.app_context():
+            now = datetime.utcnow()
+            for status, device_ids in by_status.items():
+                for start in range(0, len(device_ids), chunk_size):
+                    Device.query.filter(Device.gb_device_id.in_(device_ids[start:start + chunk_size])).update(
+                        {'status': status, 'updated_at': now}, synchronize_session=False)
+            db.session.commit()
+
+    async def refresh_passwords_loop(self, interval=60):
+        """定期加载设备级密码（未设置的设备使用全局密码）"""
+        while True:
+            if self.app is not None:
+                try:
+                    self.passwords = await self.loop.run_in_executor(None, self.load_passwords)
+                except Exception:
+                    logger.exception("设备密码加载失败")
+            await asyncio.sleep(interval)
+
+    def load_passwords(self):
+        from src.models.device import Device, db
+
+        with self.app.app_context():
+            rows = db.session.query(Device.gb_device_id, Device.password).filter(
+                Device.protocol == 'GB28181', Device.gb_device_id.isnot(None), Device.password.isnot(None)
+            ).all()
+            return {gb_device_id: password for gb_device_id, password in rows if password}
+
+    def status(self):
+        online = sum(1 for state in self.devices.values() if state.online)
+        return dict(self.stats, devices=len(self.devices), online=online,
+                    sessions=len(self.sessions), pending_status=len(self.pending_status))
+
+
+def local_ip():
+    """本机对外IP（UDP connect不会真正发包）"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(('8.8.8.8', 80))
+            return s.getsockname()[0]
+    except OSError:
+        return '127.0.0.1'
+
+
+# 当前进程中运行的信令服务
+_server = None
+
+
+def get_server():
+    return _server
+
+
+def start_server(app, **kwargs):
+    """在后台线程中启动信令服务"""
+    global _server
+    if _server is None:
+        _server = GB28181Server(app, **kwargs).start_in_thread()
+    return _server
@@ -0,0 +1,506 @@
+"""低延迟HLS（LL-HLS）直播服务
+
+FFmpeg将视频流编码为分片MP4（CMAF）写入管道，每个moof+mdat片段即一个部分分片（part，默认0.2秒），
+关键帧间隔1秒，从关键帧开始的部分分片标记为INDEPENDENT，累计达到目标时长后在下一个关键帧处切分完整分片。
+分片只保存在内存中，由基于asyncio的HTTP服务提供：
+
+    /<device_id>/playlist.m3u8[?_HLS_msn=N&_HLS_part=M]   播放列表（支持阻塞式刷新）
+    /<device_id>/init.mp4                                初始化分片（EXT-X-MAP）
+    /<device_id>/seg<N>.m4s                              完整分片
+    /<device_id>/part<N>.<M>.m4s                         部分分片（预加载提示的下一个分片阻塞到生成为止）
+
+阻塞请求只是事件循环中等待的协程，不占用线程。服务在第一次启动LL-HLS流时在后台线程中运行。
+"""
+from urllib.parse import urlsplit, parse_qs
+from collections import deque
+import threading
+import asyncio
+import logging
+import struct
+import time
+import math
+import os
+
+LLHLS_HOST = os.environ.get('LLHLS_HOST', '0.0.0.0')
+# 每个Web进程需要独立的端口；端口被占用时使用系统分配的端口（写入流租约，播放时重定向到该端口）
+LLHLS_PORT = int(os.environ.get('LLHLS_PORT', 8081))
+# 播放器访问LL-HLS服务的地址（如经反向代理），为空时使用API请求的主机名加服务端口
+LLHLS_PUBLIC_URL = os.environ.get('LLHLS_PUBLIC_URL', '').rstrip('/')
+# 部分分片时长（秒）
+PART_TARGET = float(os.environ.get('LLHLS_PART_TARGET', 0.2))
+# 完整分片目标时长（秒）
+SEGMENT_TARGET = float(os.environ.get('LLHLS_SEGMENT_TARGET', 2))
+KEYFRAME_INTERVAL = 1
+# EXT-X-TARGETDURATION不能在直播中改变：分片在达到目标时长后的第一个关键帧处切分，关键帧位于整秒，
+# 分片时长不超过目标时长向上取整
+TARGET_DURATION = max(1, math.ceil(SEGMENT_TARGET))
+# 播放列表保留的完整分片数，其中最近PART_SEGMENTS个分片列出部分分片
+PLAYLIST_SEGMENTS = 6
+PART_SEGMENTS = 3
+MAX_REQUEST_HEAD = 16384
+
+logger = logging.getLogger(__name__)
+
+
+def ffmpeg_command(source, input_options=()):
+    """编码为分片MP4输出到标准输出（只保留视频）"""
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error']
+    if source.startswith('rtsp://'):
+        cmd += ['-rtsp_transport', 'tcp']
+    cmd += [*input_options, '-i', source, '-an',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+            '-force_key_frames', f'expr:gte(t,n_forced*{KEYFRAME_INTERVAL})',
+            '-f', 'mp4', '-movflags', 'empty_moov+default_base_moof+frag_keyframe+cmaf',
+            '-frag_duration', str(int(PART_TARGET * 1e6)), '-flush_packets', '1',
+            'pipe:1']
+    return cmd
+
+
+def playlist_url(path, host, port):
+    """播放器访问的播放列表地址；host为API请求的Host头"""
+    if LLHLS_PUBLIC_URL:
+        return f'{LLHLS_PUBLIC_URL}{path}'
+    hostname = urlsplit(f'//{host}').hostname or '127.0.0.1'
+    if ':' in hostname:
+        hostname = f'[{hostname}]'
+    return f'http://{hostname}:{port}{path}'
+
+
+# ---- MP4 ----
+
+def iter_boxes(data, offset=0, end=None):
+    """遍历MP4 box，返回 (类型, 内容起始, 内容结束)"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            break
+        yield box_type.decode('latin-1'), offset + header, offset + size
+        offset += size
+
+
+def find_box(data, path, offset=0, end=None):
+    """按路径查找子box（如 'trak/mdia/mdhd'），返回 (内容起始, 内容结束) 或None"""
+    name, _, rest = path.partition('/')
+    for box_type, start, stop in iter_boxes(data, offset, end):
+        if box_type == name:
+            return find_box(data, rest, start, stop) if rest else (start, stop)
+    return None
+
+
+def parse_init(moov):
+    """从moov读取时间刻度和trex中的默认采样时长/标志"""
+    info = {'timescale': 90000, 'default_duration': 0, 'default_flags': 0}
+    mdhd = find_box(moov, 'trak/mdia/mdhd')
+    if mdhd:
+        version = moov[mdhd[0]]
+        info['timescale'] = struct.unpack_from('>I', moov, mdhd[0] + (20 if version == 1 else 12))[0]
+    trex = find_box(moov, 'mvex/trex')
+    if trex:
+        info['default_duration'], _, info['default_flags'] = struct.unpack_from('>III', moov, trex[0] + 12)
+    return info
+
+
+def parse_fragment(moof, init):
+    """从moof读取片段时长（秒）以及首个采样是否为关键帧"""
+    traf = find_box(moof, 'traf')
+    default_duration, default_flags = init['default_duration'], init['default_flags']
+    duration = 0
+    first_flags = None
+    for box_type, start, _ in iter_boxes(moof, *traf):
+        flags = struct.unpack_from('>I', moof, start)[0] & 0xFFFFFF
+        if box_type == 'tfhd':
+            position = start + 8
+            if flags & 0x01:
+                position += 8
+            if flags & 0x02:
+                position += 4
+            if flags & 0x08:
+                default_duration = struct.unpack_from('>I', moof, position)[0]
+                position += 4
+            if flags & 0x10:
+                position += 4
+            if flags & 0x20:
+                default_flags = struct.unpack_from('>I', moof, position)[0]
+        elif box_type == 'trun':
+            count = struct.unpack_from('>I', moof, start + 4)[0]
+            position = start + 8
+            if flags & 0x01:
+                position += 4
+            if flags & 0x04:
+                first_flags = struct.unpack_from('>I', moof, position)[0]
+                position += 4
+            fields = [bit for bit in (0x100, 0x200, 0x400, 0x800) if flags & bit]
+            for i in range(count):
+                values = dict(zip(fields, struct.unpack_from(f'>{len(fields)}I', moof, position)))
+                position += 4 * len(fields)
+                duration += values.get(0x100, default_duration)
+                if i == 0 and first_flags is None:
+                    first_flags = values.get(0x400, default_flags)
+    # sample_is_non_sync_sample 位为0表示关键帧
+    independent = first_flags is not None and not first_flags & 0x10000
+    return duration / init['timescale'], independent
+
+
+# ---- 分片 ----
+
+class Part:
+    __slots__ = ('data', 'duration', 'independent')
+
+    def __init__(self, data, duration, independent):
+        self.data = data
+        self.duration = duration
+        self.independent = independent
+
+
+class Segment:
+    def __init__(self, msn):
+        self.msn = msn
+        self.parts = []
+        self.complete = False
+
+    @property
+    def duration(self):
+        return sum(part.duration for part in self.parts)
+
+    @property
+    def data(self):
+        return b''.join(part.data for part in self.parts)
+
+
+class LLHLSStream:
+    """单路LL-HLS流：从FFmpeg管道读取分片MP4并维护播放列表"""
+
+    def __init__(self, device_id, process):
+        self.device_id = device_id
+        self.process = process
+        self.init = None
+        self.init_info = None
+        self.segments = deque()
+        self.part_target = PART_TARGET
+        self.target_duration = TARGET_DURATION
+        self.ended = False
+        self.task = None
+        self.updated = asyncio.Event()
+
+    @property
+    def current(self):
+        return self.segments[-1] if self.segments else None
+
+    def notify(self):
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    async def wait_update(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or self.ended:
+            return False
+        try:
+            await asyncio.wait_for(self.updated.wait(), remaining)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self):
+        """读取FFmpeg输出直到进程退出"""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=2 ** 20)
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                    self.process.stdout)
+        moof = None
+        try:
+            while True:
+                header = await reader.readexactly(8)
+                size, box_type = struct.unpack('>I4s', header)
+                if size == 1:
+                    extended = await reader.readexactly(8)
+                    header += extended
+                    size = struct.unpack('>Q', extended)[0]
+                box = header + await reader.readexactly(size - len(header))
+
+                if box_type == b'ftyp':
+                    self.init = box
+                elif box_type == b'moov':
+                    self.init += box
+                    self.init_info = parse_init(box[8:])
+                elif box_type == b'moof':
+                    moof = box
+                elif box_type == b'mdat' and moof is not None:
+                    self.add_part(moof, box)
+                    moof = None
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception:
+            logger.exception("LL-HLS分片读取失败", extra={'device_id': self.device_id})
+        finally:
+            transport.close()
+            self.ended = True
+            self.notify()
+
+    def add_part(self, moof, mdat):
+        duration, independent = parse_fragment(moof[8:], self.init_info)
+        current = self.current
+        if current is None or (independent and current.duration >= SEGMENT_TARGET - self.part_target / 2):
+            if current is not None:
+                current.complete = True
+            current = Segment(current.msn + 1 if current else 0)
+            self.segments.append(current)
+            while len(self.segments) > PLAYLIST_SEGMENTS + 1:
+                self.segments.popleft()
+        current.parts.append(Part(moof + mdat, duration, independent))
+        # 部分分片（每个分片的最后一个除外）不能超过PART-TARGET，出现更长的片段时调整
+        self.part_target = max(self.part_target, math.ceil(duration * 1000) / 1000)
+        self.notify()
+
+    def segment(self, msn):
+        for segment in self.segments:
+            if segment.msn == msn:
+                return segment
+        return None
+
+    def has_part(self, msn, part):
+        """播放列表是否已包含该分片（part为None时要求完整分片）"""
+        segment = self.segment(msn)
+        if segment is None:
+            return bool(self.segments) and msn < self.segments[0].msn
+        if part is None:
+            return segment.complete
+        return segment.complete or part < len(segment.parts)
+
+    def next_part(self):
+        current = self.current
+        if current is None:
+            return 0, 0
+        return current.msn, len(current.parts)
+
+    def playlist(self):
+        complete = [segment for segment in self.segments if segment.complete]
+        current = self.current if self.current and not self.current.complete else None
+        first = complete[0].msn if complete else (current.msn if current else 0)
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:9',
+            f'#EXT-X-TARGETDURATION:{self.target_duration}',
+            f'#EXT-X-PART-INF:PART-TARGET={self.part_target:.3f}',
+            f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={self.part_target * 3:.3f}',
+            f'#EXT-X-MEDIA-SEQUENCE:{first}',
+            '#EXT-X-MAP:URI="init.mp4"'
+        ]
+        with_parts = complete[-PART_SEGMENTS:]
+        for segment in complete:
+            if segment in with_parts:
+                lines.extend(self.part_lines(segment))
+            lines.append(f'#EXTINF:{segment.duration:.3f},')
+            lines.append(f'seg{segment.msn}.m4s')
+        if current is not None:
+            lines.extend(self.part_lines(current))
+        if self.ended:
+            lines.append('#EXT-X-ENDLIST')
+        else:
+            msn, part = self.next_part()
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part{msn}.{part}.m4s"')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def part_lines(segment):
+        return [f'#EXT-X-PART:DURATION={part.duration:.3f},URI="part{segment.msn}.{i}.m4s"'
+                + (',INDEPENDENT=YES' if part.independent else '')
+                for i, part in enumerate(segment.parts)]
+
+
+# ---- HTTP服务 ----
+
+class LLHLSServer:
+    """LL-HLS HTTP服务（asyncio，阻塞式刷新请求不占用线程）"""
+
+    def __init__(self, host=LLHLS_HOST, port=LLHLS_PORT):
+        self.host = host
+        self.port = port
+        self.streams = {}
+        self.loop = None
+        self.thread = None
+        self.server = None
+        # 播放请求回调 on_request(device_id, 客户端地址)，用于观看者计数
+        self.on_request = None
+
+    async def start(self):
+        try:
+            self.server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                     limit=MAX_REQUEST_HEAD)
+        except OSError:
+            logger.warning("LL-HLS端口被占用，使用系统分配的端口", extra={'port': self.port})
+            self.server = await asyncio.start_server(self.handle_connection, self.host, 0,
+                                                     limit=MAX_REQUEST_HEAD)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("LL-HLS服务已启动", extra={'host': self.host, 'port': self.port})
+
+    def start_in_thread(self):
+        """在后台线程中运行事件循环"""
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name='llhls', daemon=True)
+        self.thread.start()
+        ready.wait(10)
+        return self
+
+    def call(self, coro, timeout=10):
+        """从其他线程调用事件循环中的协程"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    # ---- 流 ----
+
+    async def add_stream(self, device_id, process):
+        """开始读取FFmpeg进程输出（进程由调用方启动和停止）"""
+        stream = LLHLSStream(device_id, process)
+        self.streams[device_id] = stream
+        # 事件循环只弱引用任务，由流对象持有
+        stream.task = task = asyncio.ensure_future(stream.run())
+        task.add_done_callback(lambda _: self.streams.pop(device_id, None)
+                               if self.streams.get(device_id) is stream else None)
+        return stream
+
+    def status(self):
+        return {
+            'port': self.port,
+            'streams': {device_id: {
+                'segments': len(stream.segments),
+                'last_msn': stream.current.msn if stream.current else None,
+                'part_target': stream.part_target,
+                'ended': stream.ended
+            } for device_id, stream in list(self.streams.items())}
+        }
+
+    # ---- 请求处理 ----
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        client = peer[0] if peer else None
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, _ = (lines[0].split(' ') + ['', ''])[:3]
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                forwarded = headers.get('x-forwarded-for', '').split(',')[0].strip()
+                status, content_type, body, cache = await self.handle_request(method, target, forwarded or client)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                response = [
+                    f'HTTP/1.1 {status}',
+                    f'Content-Type: {content_type}',
+                    f'Content-Length: {len(body)}',
+                    f'Cache-Control: {cache}',
+                    'Access-Control-Allow-Origin: *',
+                    'Access-Control-Allow-Methods: GET, HEAD, OPTIONS',
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                    '', ''
+                ]
+                writer.write('\r\n'.join(response).encode() + (b'' if method == 'HEAD' else body))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, method, target, client=None):
+        """返回 (状态, 内容类型, 内容, 缓存策略)"""
+        if method == 'OPTIONS':
+            return '204 No Content', 'text/plain', b'', 'no-cache'
+        if method not in ('GET', 'HEAD'):
+            return '405 Method Not Allowed', 'text/plain', b'', 'no-cache'
+
+        url = urlsplit(target)
+        device_id, _, name = url.path.strip('/').partition('/')
+        stream = self.streams.get(device_id)
+        if stream is None:
+            return '404 Not Found', 'text/plain', b'stream not found', 'no-cache'
+        if self.on_request is not None:
+            self.on_request(device_id, client)
+
+        timeout = time.monotonic() + stream.target_duration * 3
+        if name == 'playlist.m3u8':
+            query = parse_qs(url.query)
+            try:
+                msn = int(query['_HLS_msn'][0]) if '_HLS_msn' in query else None
+                part = int(query['_HLS_part'][0]) if '_HLS_part' in query else None
+            except ValueError:
+                return '400 Bad Request', 'text/plain', b'invalid _HLS_msn/_HLS_part', 'no-cache'
+            if part is not None and msn is None:
+                return '400 Bad Request', 'text/plain', b'_HLS_part requires _HLS_msn', 'no-cache'
+            if msn is not None:
+                # 阻塞到播放列表包含请求的分片
+                current = stream.current
+                if current is not None and msn > current.msn + 2:
+                    return '400 Bad Request', 'text/plain', b'_HLS_msn too far ahead', 'no-cache'
+                while not stream.has_part(msn, part):
+                    if not await stream.wait_update(timeout):
+                        if not stream.has_part(msn, part):
+                            return '503 Service Unavailable', 'text/plain', b'', 'no-cache'
+            else:
+                # 刚启动的流等待第一个部分分片，避免首次播放拿到空的播放列表
+                while stream.current is None and await stream.wait_update(timeout):
+                    pass
+            return ('200 OK', 'application/vnd.apple.mpegurl', stream.playlist().encode(),
+                    'no-cache')
+
+        if name == 'init.mp4':
+            while stream.init_info is None:
+                if not await stream.wait_update(timeout):
+                    return '404 Not Found', 'text/plain', b'', 'no-cache'
+            return '200 OK', 'video/mp4', stream.init, 'max-age=3600'
+
+        if name.startswith('seg') and name.endswith('.m4s'):
+            segment = stream.segment(int(name[3:-4])) if name[3:-4].isdigit() else None
+            if segment is None or not segment.complete:
+                return '404 Not Found', 'text/plain', b'', 'no-cache'
+            return '200 OK', 'video/iso.segment', segment.data, 'max-age=60'
+
+        if name.startswith('part') and name.endswith('.m4s'):
+            msn, _, index = name[4:-4].partition('.')
+            if not (msn.isdigit() and index.isdigit()):
+                return '404 Not Found', 'text/plain', b'', 'no-cache'
+            msn, index = int(msn), int(index)
+            # 预加载提示的分片阻塞到生成为止
+            while (msn, index) == stream.next_part() and not stream.ended:
+                if not await stream.wait_update(timeout):
+                    break
+            segment = stream.segment(msn)
+            if segment is None or index >= len(segment.parts):
+                return '404 Not Found', 'text/plain', b'', 'no-cache'
+            return '200 OK', 'video/iso.segment', segment.parts[index].data, 'max-age=60'
+
+        return '404 Not Found', 'text/plain', b'', 'no-cache'
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_server():
+    """LL-HLS服务（第一次调用时在后台线程中启动）"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = LLHLSServer().start_in_thread()
+        return _server
@@ -0,0 +1,349 @@
+"""Prometheus文本格式指标
+
+热路径上不加锁：计数器和直方图按线程分片，每个线程只写自己的分片，
+采集时再汇总所有分片。分片只在线程首次写入时注册（此时加锁一次）。
+"""
+from bisect import bisect_left
+import threading
+import time
+import math
+
+# 默认延迟分桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 默认计数分桶
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Metric:
+    """指标基类"""
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+    @property
+    def family(self):
+        """HELP/TYPE行使用的指标族名"""
+        return self.name
+
+    def samples(self):
+        """返回 [(后缀, 标签字符串, 值), ...]"""
+        return []
+
+    def render(self):
+        lines = [
+            f'# HELP {self.family} {self.documentation}',
+            f'# TYPE {self.family} {self.type}'
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.family}{suffix}{labels} {format_value(value)}')
+        return '\n'.join(lines)
+
+
+class ShardedMetric(Metric):
+    """按线程分片存储的指标"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+            return shard
+
+    def _merge(self, totals, items):
+        raise NotImplementedError
+
+    def collect(self):
+        """汇总所有分片；已退出线程的分片并入retired后释放"""
+        totals = {}
+        with self._shards_lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, list(shard.items()))
+            self._shards = live
+            self._merge(totals, list(self._retired.items()))
+
+        # dict.items()转list在持有GIL时一次完成，不会与写线程冲突
+        for _, shard in live:
+            self._merge(totals, list(shard.items()))
+        return totals
+
+
+class Counter(ShardedMetric):
+    """单调递增计数器"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    @property
+    def family(self):
+        # 0.0.4文本格式中元数据须与样本同名，计数器样本带_total后缀
+        return f'{self.name}_total'
+
+    def _merge(self, totals, items):
+        for key, value in items:
+            totals[key] = totals.get(key, 0) + value
+
+    def samples(self):
+        return [('', self._format_labels(key), value)
+                for key, value in sorted(self.collect().items())]
+
+
+class Histogram(ShardedMetric):
+    """直方图（分片内存储各桶非累计计数，输出时累加）"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # [各桶计数..., +Inf桶计数, 总和]
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, **labels):
+        """计时上下文管理器"""
+        return Timer(self, labels)
+
+    def _merge(self, totals, items):
+        for key, state in items:
+            total = totals.get(key)
+            if total is None:
+                totals[key] = list(state)
+            else:
+                for i, value in enumerate(state):
+                    total[i] += value
+
+    def samples(self):
+        samples = []
+        for key, state in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state[:-1]):
+                cumulative += count
+                samples.append(('_bucket', self._format_labels(key, ('le', format_value(bound))), cumulative))
+            samples.append(('_sum', self._format_labels(key), state[-1]))
+            samples.append(('_count', self._format_labels(key), cumulative))
+        return samples
+
+
+class Gauge(Metric):
+    """瞬时值；可以设置回调函数在采集时计算"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, **labels):
+        # 单次字典赋值在GIL下是原子的
+        self._values[self._key(labels)] = value
+
+    def remove(self, **labels):
+        self._values.pop(self._key(labels), None)
+
+    def set_function(self, function):
+        """采集时调用 function()，返回数值，或 {标签值元组: 数值}"""
+        self._function = function
+
+    def collect(self):
+        if self._function is None:
+            return dict(self._values)
+        value = self._function()
+        if isinstance(value, dict):
+            return value
+        return {(): value}
+
+    def samples(self):
+        try:
+            values = self.collect()
+        except Exception:
+            values = {}
+        return [('', self._format_labels(key), value) for key, value in sorted(values.items())]
+
+
+class Timer:
+    """直方图计时器"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'指标重复注册: {metric.name}')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """输出Prometheus文本格式"""
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = Registry()
+
+# 视频解码
+frames_decoded = registry.counter(
+    'surveillance_frames_decoded', '解码的视频帧数', ['device_id', 'source'])
+decode_fps = registry.gauge(
+    'surveillance_decode_fps', '设备当前解码帧率', ['device_id', 'source'])
+ffmpeg_restarts = registry.counter(
+    'surveillance_ffmpeg_restarts', 'FFmpeg进程重启次数', ['device_id'])
+
+# 视频流生命周期
+stream_first_frame = registry.histogram(
+    'surveillance_stream_first_frame_seconds', '视频流从启动到第一个可播放输出的时间', ['format'],
+    buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 15.0, 30.0))
+streams_reaped = registry.counter(
+    'surveillance_streams_reaped', '无人观看超时自动停止的视频流数')
+
+# AI分析
+detector_latency = registry.histogram(
+    'surveillance_detector_latency_seconds', '检测模型单帧推理耗时', ['model'])
+detections_per_frame = registry.histogram(
+    'surveillance_detections_per_frame', '单帧检测结果数', ['model'], buckets=COUNT_BUCKETS)
+detector_errors = registry.counter(
+    'surveillance_detector_errors', '检测模型推理错误次数', ['model'])
+
+# 事件写入
+event_write_batch_size = registry.histogram(
+    'surveillance_event_write_batch_size', '单次提交写入的事件数', ['path'], buckets=COUNT_BUCKETS)
+event_write_latency = registry.histogram(
+    'surveillance_event_write_latency_seconds', '事件写入（含提交）耗时', ['path'])
+event_write_errors = registry.counter(
+    'surveillance_event_write_errors', '事件写入失败次数', ['path'])
+
+# 数据库
+db_query_latency = registry.histogram(
+    'surveillance_db_query_latency_seconds', '数据库语句执行耗时', ['route'])
+
+# 进程
+process_startup = registry.gauge(
+    'surveillance_process_startup_seconds', '应用初始化耗时', ['role'])
+process_rss = registry.gauge(
+    'surveillance_process_resident_memory_bytes', '进程常驻内存', ['role'])
+
+# 队列深度
+queue_depth = registry.gauge(
+    'surveillance_queue_depth', '各处理队列当前深度', ['queue'])
+
+_queue_depth_functions = {}
+
+
+def register_queue(name, function):
+    """注册队列深度回调，采集时调用"""
+    _queue_depth_functions[name] = function
+
+
+def _collect_queue_depths():
+    depths = {}
+    for name, function in list(_queue_depth_functions.items()):
+        try:
+            depths[(name,)] = function()
+        except Exception:
+            continue
+    return depths
+
+
+queue_depth.set_function(_collect_queue_depths)
+
+
+def instrument_sqlalchemy(engine):
+    """统计每条SQL语句的执行耗时，按Flask路由分类"""
+    from sqlalchemy import event
+    from flask import has_request_context, request
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+        route = request.endpoint if has_request_context() else 'background'
+        db_query_latency.observe(elapsed, route=route or 'unknown')
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # 执行失败的语句不会触发after_cursor_execute，弹出开始时间避免在连接上累积
+        if context.connection is not None and context.execution_context is not None:
+            starts = context.connection.info.get('query_start_time')
+            if starts:
+                starts.pop()
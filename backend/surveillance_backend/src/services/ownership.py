@@ -0,0 +1,373 @@
+"""设备归属：多进程/多节点部署时，视频流和实时分析只在设备的归属节点上运行
+
+设备按一致性哈希分配给存活节点（虚拟节点平滑负载，节点加入或离开时只有约1/N的设备迁移）。
+各工作进程在共享数据库中心跳续约，视频流和分析以租约记录归属，同一节点内的多个进程通过
+条件更新竞争租约，保证不会重复启动。非归属节点收到的请求转发到归属节点。
+归属变化时原节点停止本地资源并释放租约，新归属节点在心跳中接管并重新启动。
+
+默认关闭（CLUSTER_ENABLED=1开启），关闭时所有设备归属本进程，行为与单进程部署一致。
+"""
+from datetime import datetime, timedelta
+from functools import wraps
+from bisect import bisect
+from flask import request, jsonify, Response
+import urllib.request
+import urllib.error
+import threading
+import hashlib
+import logging
+import socket
+import os
+
+CLUSTER_ENABLED = os.environ.get('CLUSTER_ENABLED', '0').lower() in ('1', 'true', 'yes')
+NODE_ID = os.environ.get('NODE_ID') or socket.gethostname()
+# 本节点对外HTTP地址，其他节点向该地址转发请求
+NODE_ADDRESS = os.environ.get('NODE_ADDRESS', f'http://{NODE_ID}:5000')
+# 心跳租约有效期（秒），续约间隔为其1/3
+LEASE_TTL = float(os.environ.get('CLUSTER_LEASE_TTL', 15))
+VIRTUAL_NODES = 128
+PROXY_TIMEOUT = 30
+FORWARDED_HEADER = 'X-Owner-Node'
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+                      'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length'}
+
+logger = logging.getLogger(__name__)
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """带虚拟节点的一致性哈希环"""
+
+    def __init__(self, nodes=(), replicas=VIRTUAL_NODES):
+        self.replicas = replicas
+        self.nodes = set()
+        self.keys = []
+        self.owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        self._rebuild()
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._rebuild()
+
+    def _rebuild(self):
+        points = sorted((ring_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(self.replicas))
+        self.keys = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, key):
+        if not self.keys:
+            return None
+        index = bisect(self.keys, ring_hash(key)) % len(self.keys)
+        return self.owners[index]
+
+
+class Cluster:
+    """本进程在集群中的成员身份、设备归属和租约"""
+
+    def __init__(self, enabled=CLUSTER_ENABLED, node_id=NODE_ID, address=NODE_ADDRESS, ttl=LEASE_TTL):
+        self.enabled = enabled
+        self.node_id = node_id
+        self.address = address
+        self.ttl = ttl
+        self.worker_id = f'{node_id}:{os.getpid()}'
+        self.ring = HashRing([node_id])
+        self.addresses = {node_id: address}
+        self.handlers = {}
+        self.app = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def register_handler(self, kind, start, stop, running):
+        """注册资源回调：start(device_id, params) 接管并返回运行信息（失败返回None），
+        stop(device_id) 停止本地资源，running() 返回本进程正在运行的设备ID"""
+        self.handlers[kind] = (start, stop, running)
+
+    # ---- 归属 ----
+
+    def owner(self, device_id):
+        if not self.enabled:
+            return self.node_id
+        return self.ring.owner(device_id) or self.node_id
+
+    def owner_address(self, device_id):
+        return self.addresses.get(self.owner(device_id))
+
+    def is_owner(self, device_id):
+        return self.owner(device_id) == self.node_id
+
+    # ---- 租约 ----
+
+    def claim(self, device_id, kind, params=None):
+        """获取或续约设备资源租约；租约由本节点其他存活进程持有时返回False"""
+        if not self.enabled:
+            return True
+
+        from src.models.cluster import DeviceLease, db
+        from sqlalchemy import or_
+        from sqlalchemy.exc import IntegrityError
+
+        now = datetime.utcnow()
+        values = {'node_id': self.node_id, 'worker_id': self.worker_id,
+                  'expires_at': now + timedelta(seconds=self.ttl), 'updated_at': now}
+        if params is not None:
+            values['params'] = params
+
+        claimed = DeviceLease.query.filter(
+            DeviceLease.device_id == device_id,
+            DeviceLease.kind == kind,
+            or_(DeviceLease.worker_id.is_(None), DeviceLease.worker_id == self.worker_id,
+                DeviceLease.expires_at < now)
+        ).update(values, synchronize_session=False)
+        if claimed:
+            db.session.commit()
+            return True
+
+        if db.session.get(DeviceLease, (device_id, kind)) is not None:
+            db.session.rollback()
+            return False
+
+        try:
+            db.session.add(DeviceLease(device_id=device_id, kind=kind, **values))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    def release(self, device_id, kind):
+        if not self.enabled:
+            return
+
+        from src.models.cluster import DeviceLease, db
+
+        DeviceLease.query.filter_by(device_id=device_id, kind=kind).delete(synchronize_session=False)
+        db.session.commit()
+
+    def lease(self, device_id, kind):
+        """当前有效的租约（其他进程持有的资源通过租约中的运行信息访问）"""
+        if not self.enabled:
+            return None
+
+        from src.models.cluster import DeviceLease
+
+        lease = DeviceLease.query.filter(
+            DeviceLease.device_id == device_id,
+            DeviceLease.kind == kind,
+            DeviceLease.worker_id.isnot(None),
+            DeviceLease.expires_at >= datetime.utcnow()
+        ).first()
+        return lease.to_dict() if lease else None
+
+    def leases(self, kind):
+        """集群中某类资源的全部有效租约"""
+        if not self.enabled:
+            return []
+
+        from src.models.cluster import DeviceLease
+
+        return [lease.to_dict() for lease in DeviceLease.query.filter(
+            DeviceLease.kind == kind,
+            DeviceLease.worker_id.isnot(None),
+            DeviceLease.expires_at >= datetime.utcnow()
+        ).all()]
+
+    # ---- 心跳 ----
+
+    def start(self, app):
+        """注册本进程并启动心跳线程"""
+        if not self.enabled or self.thread is not None:
+            return
+        self.app = app
+        self.heartbeat()
+        self.thread = threading.Thread(target=self.run, name='cluster-heartbeat', daemon=True)
+        self.thread.start()
+        logger.info("集群成员已注册", extra={'node_id': self.node_id, 'worker_id': self.worker_id,
+                                         'nodes': sorted(self.ring.nodes)})
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                self.heartbeat()
+            except Exception:
+                logger.exception("集群心跳失败")
+
+    def heartbeat(self):
+        from src.models.cluster import WorkerNode, DeviceLease, db
+        from sqlalchemy import or_
+
+        # 先记录本地运行的资源再读取租约：之后才启动的资源不会被误判为租约已撤销
+        running = {kind: set(handler[2]()) for kind, handler in self.handlers.items()}
+
+        with self.app.app_context():
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=self.ttl)
+
+            worker = db.session.get(WorkerNode, self.worker_id)
+            if worker is None:
+                db.session.add(WorkerNode(worker_id=self.worker_id, node_id=self.node_id,
+                                          address=self.address, expires_at=expires_at))
+            else:
+                worker.expires_at = expires_at
+            # 清理早已离开的进程
+            WorkerNode.query.filter(WorkerNode.expires_at < now - timedelta(seconds=self.ttl * 10)).delete(
+                synchronize_session=False)
+            DeviceLease.query.filter_by(worker_id=self.worker_id).update(
+                {'expires_at': expires_at}, synchronize_session=False)
+            db.session.commit()
+
+            self.update_ring(WorkerNode.query.filter(WorkerNode.expires_at >= now).all())
+
+            # 不再归属本节点的资源：停止并移交
+            held = DeviceLease.query.filter_by(worker_id=self.worker_id).all()
+            for lease in held:
+                if not self.is_owner(lease.device_id):
+                    self.hand_off(lease)
+
+            # 租约已被删除（由本节点其他进程停止）的本地资源：停止
+            held_keys = {(lease.kind, lease.device_id) for lease in held}
+            for kind, device_ids in running.items():
+                for device_id in device_ids:
+                    if (kind, device_id) not in held_keys:
+                        self.handlers[kind][1](device_id)
+                        logger.info("租约已撤销，停止本地资源", extra={'device_id': device_id, 'kind': kind})
+
+            # 归属本节点且无人持有的资源：接管
+            orphans = DeviceLease.query.filter(
+                or_(DeviceLease.worker_id.is_(None), DeviceLease.expires_at < now)
+            ).all()
+            for lease in orphans:
+                if self.is_owner(lease.device_id) and lease.kind in self.handlers:
+                    self.take_over(lease.device_id, lease.kind, lease.params)
+
+    def update_ring(self, workers):
+        nodes = {}
+        for worker in workers:
+            nodes.setdefault(worker.node_id, worker.address)
+        nodes.setdefault(self.node_id, self.address)
+
+        if set(nodes) != self.ring.nodes:
+            logger.info("集群节点变化", extra={'joined': sorted(set(nodes) - self.ring.nodes),
+                                         'left': sorted(self.ring.nodes - set(nodes))})
+            self.ring = HashRing(nodes)
+        self.addresses = nodes
+
+    def hand_off(self, lease):
+        from src.models.cluster import DeviceLease, db
+
+        handler = self.handlers.get(lease.kind)
+        if handler:
+            try:
+                handler[1](lease.device_id)
+            except Exception:
+                logger.exception("移交时停止资源失败", extra={'device_id': lease.device_id, 'kind': lease.kind})
+        DeviceLease.query.filter_by(device_id=lease.device_id, kind=lease.kind, worker_id=self.worker_id).update(
+            {'worker_id': None, 'node_id': None}, synchronize_session=False)
+        db.session.commit()
+        logger.info("设备资源已移交", extra={'device_id': lease.device_id, 'kind': lease.kind,
+                                       'owner': self.owner(lease.device_id)})
+
+    def take_over(self, device_id, kind, params):
+        if not self.claim(device_id, kind):
+            return
+        try:
+            result = self.handlers[kind][0](device_id, params or {})
+        except Exception:
+            logger.exception("接管资源失败", extra={'device_id': device_id, 'kind': kind})
+            result = None
+
+        if result is None:
+            self.release(device_id, kind)
+        else:
+            self.claim(device_id, kind, result)
+            logger.info("设备资源已接管", extra={'device_id': device_id, 'kind': kind})
+
+    def status(self):
+        return {
+            'enabled': self.enabled,
+            'node_id': self.node_id,
+            'worker_id': self.worker_id,
+            'address': self.address,
+            'nodes': {node: self.addresses.get(node) for node in sorted(self.ring.nodes)}
+        }
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """转发时不跟随重定向，3xx响应及其Location原样返回给客户端（如LL-HLS播放重定向）"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+proxy_opener = urllib.request.build_opener(NoRedirectHandler)
+
+
+def proxy_request(address, node_id):
+    """将当前请求转发到归属节点，流式返回响应"""
+    url = address.rstrip('/') + request.full_path.rstrip('?')
+    headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+    headers[FORWARDED_HEADER] = node_id
+    upstream_request = urllib.request.Request(url, data=request.get_data() or None, headers=headers,
+                                              method=request.method)
+    try:
+        upstream = proxy_opener.open(upstream_request, timeout=PROXY_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        upstream = e
+    except (urllib.error.URLError, OSError) as e:
+        logger.warning("转发到归属节点失败", extra={'node_id': node_id, 'url': url, 'error': str(e)})
+        return jsonify({'success': False, 'message': f'归属节点 {node_id} 不可达'}), 502
+
+    def generate():
+        try:
+            while True:
+                chunk = upstream.read1(65536) if hasattr(upstream, 'read1') else upstream.read(65536)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            upstream.close()
+
+    response_headers = [(name, value) for name, value in upstream.headers.items()
+                        if name.lower() not in HOP_BY_HOP_HEADERS]
+    response_headers.append((FORWARDED_HEADER, node_id))
+    return Response(generate(), status=upstream.code, headers=response_headers)
+
+
+def route_to_owner(view):
+    """设备相关路由：非归属节点收到的请求转发给归属节点"""
+    @wraps(view)
+    def wrapper(device_id, *args, **kwargs):
+        cluster = get_cluster()
+        # 已转发过的请求在本地处理，避免节点视图不一致时循环转发
+        if cluster.enabled and not request.headers.get(FORWARDED_HEADER):
+            owner = cluster.owner(device_id)
+            if owner != cluster.node_id:
+                return proxy_request(cluster.addresses[owner], owner)
+        return view(device_id, *args, **kwargs)
+    return wrapper
+
+
+_cluster = None
+_cluster_lock = threading.Lock()
+
+
+def get_cluster():
+    global _cluster
+    with _cluster_lock:
+        if _cluster is None:
+            _cluster = Cluster()
+        return _cluster
@@ -0,0 +1,233 @@
+"""可选的性能剖析：请求分段计时（Server-Timing）、慢请求日志、全线程采样剖析
+
+默认关闭（PROFILING_ENABLED=1开启）。关闭时不注册任何钩子，对请求没有额外开销。
+"""
+from collections import Counter
+from flask import g, request, has_request_context
+from flask.json.provider import DefaultJSONProvider
+import functools
+import threading
+import logging
+import time
+import sys
+import os
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0').lower() in ('1', 'true', 'yes')
+# 超过该耗时（毫秒）的请求记录慢请求日志
+SLOW_REQUEST_MS = float(os.environ.get('PROFILING_SLOW_REQUEST_MS', 500))
+# 慢请求日志中最多记录的SQL语句数
+SLOW_REQUEST_MAX_QUERIES = 50
+
+logger = logging.getLogger(__name__)
+
+
+def current_profile():
+    if has_request_context():
+        return g.get('request_profile')
+    return None
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """统计JSON序列化耗时的JSON provider"""
+
+    def dumps(self, obj, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return super().dumps(obj, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            profile['serialize'] += time.perf_counter() - start
+
+
+def timed_to_dict(to_dict):
+    """模型to_dict的耗时计入serialize（嵌套调用只计一次，其中执行的SQL仍计入db）"""
+
+    @functools.wraps(to_dict)
+    def wrapper(self, *args, **kwargs):
+        profile = current_profile()
+        if profile is None or profile['converting']:
+            return to_dict(self, *args, **kwargs)
+
+        profile['converting'] = True
+        start, db_start = time.perf_counter(), profile['db']
+        try:
+            return to_dict(self, *args, **kwargs)
+        finally:
+            profile['converting'] = False
+            profile['serialize'] += time.perf_counter() - start - (profile['db'] - db_start)
+
+    return wrapper
+
+
+def instrument_models(model):
+    """为所有定义了to_dict的模型统计转换耗时"""
+    for mapper in model.registry.mappers:
+        cls = mapper.class_
+        if 'to_dict' in vars(cls):
+            cls.to_dict = timed_to_dict(cls.to_dict)
+
+
+def before_request():
+    g.request_profile = {'start': time.perf_counter(), 'db': 0.0, 'serialize': 0.0, 'converting': False,
+                         'queries': []}
+
+
+def after_request(response):
+    profile = current_profile()
+    if profile is None:
+        return response
+
+    total = time.perf_counter() - profile['start']
+    handler = max(0.0, total - profile['db'] - profile['serialize'])
+    response.headers['Server-Timing'] = ', '.join([
+        f"db;dur={profile['db'] * 1000:.2f}",
+        f"serialize;dur={profile['serialize'] * 1000:.2f}",
+        f"handler;dur={handler * 1000:.2f}",
+        f"total;dur={total * 1000:.2f}"
+    ])
+
+    if total * 1000 >= SLOW_REQUEST_MS:
+        logger.warning("慢请求", extra={
+            'method': request.method,
+            'path': request.full_path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(profile['db'] * 1000, 2),
+            'serialize_ms': round(profile['serialize'] * 1000, 2),
+            'handler_ms': round(handler * 1000, 2),
+            'query_count': len(profile['queries']),
+            'queries': profile['queries'][:SLOW_REQUEST_MAX_QUERIES]
+        })
+
+    return response
+
+
+def instrument_engine(engine):
+    """累计每个请求的SQL耗时并记录语句"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profile_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profile_start_time'].pop()
+        profile = current_profile()
+        if profile is not None:
+            profile['db'] += elapsed
+            profile['queries'].append({'statement': statement, 'duration_ms': round(elapsed * 1000, 3)})
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        if context.connection is not None and context.execution_context is not None:
+            starts = context.connection.info.get('profile_start_time')
+            if starts:
+                starts.pop()
+
+
+def init_profiling(app, engine, model):
+    """注册请求计时钩子（仅在开启剖析时调用）
+
+    serialize为模型转换为字典（to_dict）与JSON序列化的耗时之和。
+    """
+    app.json = TimedJSONProvider(app)
+    app.before_request(before_request)
+    app.after_request(after_request)
+    instrument_engine(engine)
+    instrument_models(model)
+    logger.info("性能剖析已开启", extra={'slow_request_ms': SLOW_REQUEST_MS})
+
+
+# 同一时间只允许一个采样任务
+_sampling_lock = threading.Lock()
+
+
+def sample_stacks(duration, interval=0.005):
+    """对所有线程做定时栈采样，返回 {折叠栈: 次数}
+
+    折叠栈格式为 线程名;最外层函数;...;最内层函数，与flamegraph.pl的输入一致。
+    """
+    if not _sampling_lock.acquire(blocking=False):
+        raise RuntimeError('已有采样任务在运行')
+
+    try:
+        stacks = Counter()
+        me = threading.get_ident()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                parts.append(names.get(ident, f'thread-{ident}'))
+                stacks[';'.join(reversed(parts))] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _sampling_lock.release()
+
+
+def to_collapsed(stacks):
+    """折叠栈文本，每行为 栈 次数"""
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+def to_flamegraph(stacks, width=1200, frame_height=16, title='CPU Flame Graph'):
+    """将折叠栈渲染为SVG火焰图"""
+    from xml.sax.saxutils import escape
+    import zlib
+
+    # 构建调用树: {名称: [次数, 子节点]}
+    root = [0, {}]
+    for stack, count in stacks.items():
+        root[0] += count
+        node = root
+        for name in stack.split(';'):
+            child = node[1].setdefault(name, [0, {}])
+            child[0] += count
+            node = child
+
+    total = root[0] or 1
+    rects = []
+    max_depth = 0
+
+    def walk(children, x, depth):
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+        for name, (count, grandchildren) in sorted(children.items()):
+            w = count / total * width
+            if w >= 0.5:
+                rects.append((x, depth, w, name, count))
+                walk(grandchildren, x, depth + 1)
+            x += w
+
+    walk(root[1], 0.0, 0)
+
+    height = (max_depth + 1) * frame_height + 40
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="14">{escape(title)}</text>'
+    ]
+    for x, depth, w, name, count in rects:
+        y = height - (depth + 1) * frame_height
+        hue = zlib.crc32(name.split(' ')[0].encode()) % 60
+        label = escape(name if len(name) * 7 < w else name[:max(0, int(w / 7) - 2)] + '..' if w > 21 else '')
+        parts.append(
+            f'<g><title>{escape(name)} ({count} samples, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{frame_height - 1}" '
+            f'fill="hsl({hue},80%,60%)"/>'
+            f'<text x="{x + 3:.1f}" y="{y + frame_height - 4}">{label}</text></g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
@@ -0,0 +1,83 @@
+"""进程角色：按角色初始化子系统
+
+    api       HTTP接口（设备、事件、检索、状态查询），不运行后台任务
+    analysis  实时分析和离线分析、事件归档
+    stream    视频流（FFmpeg进程、按观看者启停、LL-HLS服务）和GB28181信令
+    all       全部（默认）
+
+多个角色用逗号分隔（如 api,stream）。每个进程都注册全部HTTP接口，需要本进程未承担的角色的请求
+（如在api进程中启动实时分析）返回503，部署时按路径把这些请求转发到对应角色的进程。
+同一节点的多个进程之间通过集群租约访问其他进程运行的流和分析（需要设置 CLUSTER_ENABLED）。
+"""
+from functools import wraps
+from flask import jsonify
+import resource
+import os
+
+from src.services import metrics
+
+ROLES = ('api', 'analysis', 'stream')
+ROLE_NAMES = {'api': 'HTTP接口', 'analysis': '实时分析和离线分析', 'stream': '视频流'}
+
+
+def parse_roles(text):
+    roles = {role.strip().lower() for role in (text or '').split(',') if role.strip()}
+    if not roles or 'all' in roles:
+        return frozenset(ROLES)
+    unknown = roles - set(ROLES)
+    if unknown:
+        raise ValueError(f"未知的进程角色: {', '.join(sorted(unknown))}（可选 {', '.join(ROLES)}, all）")
+    return frozenset(roles)
+
+
+PROCESS_ROLES = parse_roles(os.environ.get('PROCESS_ROLE', 'all'))
+ROLE_LABEL = 'all' if PROCESS_ROLES == frozenset(ROLES) else ','.join(sorted(PROCESS_ROLES))
+
+# 应用初始化耗时（秒），由main.py在初始化完成后记录
+startup_seconds = None
+
+
+def has_role(role):
+    return role in PROCESS_ROLES
+
+
+def requires_role(role):
+    """路由装饰器：本进程未承担该角色时返回503"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not has_role(role):
+                return jsonify({
+                    'success': False,
+                    'message': f'本进程（角色: {ROLE_LABEL}）不运行{ROLE_NAMES[role]}'
+                }), 503
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def rss_bytes():
+    """当前常驻内存（不支持/proc时返回峰值）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def mark_ready(seconds):
+    global startup_seconds
+    startup_seconds = seconds
+    metrics.process_startup.set(seconds, role=ROLE_LABEL)
+
+
+def process_status():
+    return {
+        'pid': os.getpid(),
+        'roles': sorted(PROCESS_ROLES),
+        'startup_seconds': startup_seconds,
+        'rss_bytes': rss_bytes()
+    }
+
+
+metrics.process_rss.set_function(lambda: {(ROLE_LABEL,): rss_bytes()})
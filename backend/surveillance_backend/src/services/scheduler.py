@@ -0,0 +1,281 @@
+"""实时分析调度：按全局CPU预算为各设备动态分配分析帧率
+
+预算以“每秒检测耗时（毫秒）”表示。每台设备先获得最低帧率，剩余预算优先分给正在运动的设备
+（按优先级提升到最高帧率），再按近期活跃度（运动与检测结果，指数衰减）加权分配，空闲设备只保留最低帧率。
+运动开始时设备立即提升到最高帧率，不必等待下一次重新分配。
+"""
+import threading
+import random
+import time
+import os
+import cv2
+import numpy as np
+
+# 每秒可用于检测的耗时（毫秒），默认每个CPU核80%
+AI_ANALYSIS_BUDGET_MS = float(os.environ.get('AI_ANALYSIS_BUDGET_MS', 800 * (os.cpu_count() or 1)))
+AI_DEFAULT_MIN_FPS = float(os.environ.get('AI_DEFAULT_MIN_FPS', 0.2))
+AI_DEFAULT_MAX_FPS = float(os.environ.get('AI_DEFAULT_MAX_FPS', 5))
+# 缩略图平均像素差超过该值视为运动
+AI_MOTION_THRESHOLD = float(os.environ.get('AI_MOTION_THRESHOLD', 6))
+# 未分析时做运动检测的采样帧率
+MOTION_PROBE_FPS = 5
+# 最后一次运动后保持提升状态的时间（秒）
+MOTION_HOLD_SECONDS = 3
+# 活跃度半衰期（秒）
+ACTIVITY_HALF_LIFE = 10
+# 重新分配间隔（秒）
+REALLOCATE_INTERVAL = 1
+# 首帧之前假定的单帧检测耗时（毫秒）
+DEFAULT_COST_MS = 50
+THUMBNAIL_SIZE = (64, 36)
+
+
+def thumbnail(frame):
+    """运动检测用的小尺寸灰度图"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class DeviceSchedule:
+    """单台设备的调度状态"""
+
+    def __init__(self, device_id, min_fps=None, max_fps=None, priority=None, now=0.0):
+        self.device_id = device_id
+        self.configure(min_fps, max_fps, priority)
+        self.fps = self.min_fps
+        self.cost_ms = DEFAULT_COST_MS
+        self.activity = 0.0
+        self.activity_at = now
+        self.last_motion = None
+        self.motion_score = 0.0
+        self.previous = None
+        self.last_analysis = None
+        # 首次分析时间随机错开，避免同时启动的设备集中在同一时刻分析
+        self.next_analysis = now + random.uniform(0, 1 / self.fps) if self.fps > 0 else now
+        self.next_probe = now
+        self.analyzed = 0
+        self.detections = 0
+
+    def configure(self, min_fps=None, max_fps=None, priority=None):
+        self.min_fps = float(min_fps if min_fps is not None else AI_DEFAULT_MIN_FPS)
+        self.max_fps = max(self.min_fps, float(max_fps if max_fps is not None else AI_DEFAULT_MAX_FPS))
+        self.priority = max(1, int(priority or 1))
+
+    def current_activity(self, now):
+        return self.activity * 0.5 ** ((now - self.activity_at) / ACTIVITY_HALF_LIFE)
+
+    def add_activity(self, amount, now):
+        self.activity = self.current_activity(now) + amount
+        self.activity_at = now
+
+    def in_motion(self, now):
+        return self.last_motion is not None and now - self.last_motion < MOTION_HOLD_SECONDS
+
+    def set_fps(self, fps, now):
+        self.fps = fps
+        if fps <= 0:
+            self.next_analysis = float('inf')
+        elif self.last_analysis is not None:
+            self.next_analysis = self.last_analysis + 1 / fps
+        else:
+            self.next_analysis = now
+
+    def to_dict(self, now):
+        return {
+            'device_id': self.device_id,
+            'fps': round(self.fps, 3),
+            'min_fps': self.min_fps,
+            'max_fps': self.max_fps,
+            'priority': self.priority,
+            'cost_ms': round(self.cost_ms, 2),
+            'budget_ms': round(self.fps * self.cost_ms, 2),
+            'activity': round(self.current_activity(now), 3),
+            'motion': self.in_motion(now),
+            'motion_score': round(self.motion_score, 2),
+            'analyzed': self.analyzed,
+            'detections': self.detections
+        }
+
+
+class AnalysisScheduler:
+    """全局分析调度器"""
+
+    def __init__(self, budget_ms=AI_ANALYSIS_BUDGET_MS, clock=time.monotonic):
+        self.budget_ms = budget_ms
+        self.clock = clock
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.allocated_at = None
+        self.overloaded = False
+        self.used_ms = 0.0
+        self.window_ms = 0.0
+        self.window_start = clock()
+
+    def add_device(self, device_id, min_fps=None, max_fps=None, priority=None):
+        with self.lock:
+            now = self.clock()
+            schedule = self.devices.get(device_id)
+            if schedule is None:
+                schedule = self.devices[device_id] = DeviceSchedule(device_id, min_fps, max_fps, priority, now)
+            else:
+                schedule.configure(min_fps, max_fps, priority)
+            self.allocate(now)
+            return schedule
+
+    def remove_device(self, device_id):
+        with self.lock:
+            removed = self.devices.pop(device_id, None) is not None
+            self.allocate(self.clock())
+            return removed
+
+    def wants_frame(self, device_id, now=None):
+        """返回本帧的处理方式：'analyze'、'probe'（只做运动检测）或None（丢弃）"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            if self.allocated_at is None or now - self.allocated_at >= REALLOCATE_INTERVAL:
+                self.allocate(now)
+            schedule = self.devices.get(device_id)
+            if schedule is None:
+                return None
+            if now >= schedule.next_analysis:
+                return 'analyze'
+            if now >= schedule.next_probe:
+                return 'probe'
+            return None
+
+    def observe_motion(self, device_id, frame=None, score=None, now=None):
+        """更新运动状态（传入帧计算缩略图差分，或直接传入运动分数），返回是否运动"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            schedule = self.devices.get(device_id)
+            if schedule is None:
+                return False
+            if score is None:
+                current = thumbnail(frame)
+                score = float(np.abs(current - schedule.previous).mean()) if schedule.previous is not None else 0.0
+                schedule.previous = current
+            schedule.motion_score = score
+            schedule.next_probe = now + 1 / MOTION_PROBE_FPS
+
+            if score < AI_MOTION_THRESHOLD:
+                return False
+
+            if not schedule.in_motion(now):
+                # 运动开始：立即提升到最高帧率
+                schedule.set_fps(schedule.max_fps, now)
+                schedule.next_analysis = now
+            schedule.last_motion = now
+            schedule.add_activity(1, now)
+            return True
+
+    def record(self, device_id, elapsed_ms, detections=0, now=None):
+        """记录一次分析的耗时和检测数"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            self.window_ms += elapsed_ms
+            schedule = self.devices.get(device_id)
+            if schedule is None:
+                return
+            schedule.cost_ms = 0.8 * schedule.cost_ms + 0.2 * elapsed_ms if schedule.analyzed else elapsed_ms
+            schedule.analyzed += 1
+            schedule.detections += detections
+            if detections:
+                schedule.add_activity(min(detections, 5) * 0.5, now)
+            schedule.last_analysis = now
+            schedule.next_analysis = now + 1 / schedule.fps if schedule.fps > 0 else float('inf')
+
+    def submit(self, device_id, frame, analyze):
+        """处理一帧：按调度决定是否分析，analyze(frame)返回检测结果列表"""
+        decision = self.wants_frame(device_id)
+        if decision is None:
+            return None
+
+        self.observe_motion(device_id, frame)
+        if decision != 'analyze' and self.wants_frame(device_id) != 'analyze':
+            return None
+
+        start = time.perf_counter()
+        results = analyze(frame)
+        self.record(device_id, (time.perf_counter() - start) * 1000, len(results))
+        return results
+
+    def allocate(self, now):
+        """重新分配各设备帧率（调用方需持有锁）"""
+        if now - self.window_start >= REALLOCATE_INTERVAL:
+            # 上一个窗口内实际消耗的每秒检测耗时
+            self.used_ms = self.window_ms / (now - self.window_start)
+            self.window_ms = 0.0
+            self.window_start = now
+        self.allocated_at = now
+
+        schedules = list(self.devices.values())
+        if not schedules:
+            self.overloaded = False
+            return
+
+        fps = {s.device_id: s.min_fps for s in schedules}
+        floor_ms = sum(s.min_fps * s.cost_ms for s in schedules)
+        self.overloaded = floor_ms > self.budget_ms
+
+        if self.overloaded:
+            # 预算不足以满足所有最低帧率时按比例压缩
+            scale = self.budget_ms / floor_ms
+            fps = {s.device_id: s.min_fps * scale for s in schedules}
+        else:
+            remaining = self.budget_ms - floor_ms
+
+            # 运动中的设备按优先级依次提升到最高帧率
+            moving = sorted((s for s in schedules if s.in_motion(now)), key=lambda s: -s.priority)
+            for s in moving:
+                extra = min(remaining, (s.max_fps - fps[s.device_id]) * s.cost_ms)
+                fps[s.device_id] += extra / s.cost_ms
+                remaining -= extra
+
+            # 其余预算按 优先级 x 活跃度 加权分配（注水法，达到上限的设备退出）
+            candidates = [s for s in schedules if not s.in_motion(now) and s.current_activity(now) > 0.01]
+            while remaining > 1e-6 and candidates:
+                weights = {s.device_id: s.priority * s.current_activity(now) for s in candidates}
+                total = sum(weights.values())
+                capped = []
+                spent = 0.0
+                for s in candidates:
+                    share = remaining * weights[s.device_id] / total
+                    room = (s.max_fps - fps[s.device_id]) * s.cost_ms
+                    grant = min(share, room)
+                    fps[s.device_id] += grant / s.cost_ms
+                    spent += grant
+                    if grant >= room - 1e-9:
+                        capped.append(s)
+                remaining -= spent
+                if not capped:
+                    break
+                candidates = [s for s in candidates if s not in capped]
+
+        for s in schedules:
+            if abs(fps[s.device_id] - s.fps) > 1e-9:
+                s.set_fps(fps[s.device_id], now)
+
+    def status(self):
+        now = self.clock()
+        with self.lock:
+            devices = [s.to_dict(now) for s in self.devices.values()]
+            return {
+                'budget_ms': self.budget_ms,
+                'allocated_ms': round(sum(d['budget_ms'] for d in devices), 2),
+                'used_ms': round(self.used_ms, 2),
+                'overloaded': self.overloaded,
+                'device_count': len(devices),
+                'devices': sorted(devices, key=lambda d: -d['fps'])
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = AnalysisScheduler()
+        return _scheduler
@@ -0,0 +1,360 @@
+"""视频流生命周期：按观看者启停视频流
+
+观看者由播放请求跟踪：HLS播放列表/分片和LL-HLS请求按客户端地址记录最近请求时间，STREAM_VIEWER_TIMEOUT
+内有请求的客户端计为观看者；MJPEG按连接计数。最近观看时间同时写入流输出目录下的标记文件，
+同一节点的其他进程播放本进程运行的流时也能更新。后台线程负责：
+
+    * 没有观看者超过 STREAM_IDLE_TIMEOUT 的流自动停止（固定预热或处于预热时段的设备除外）
+    * 设备设置 stream_pinned 或当前处于 stream_schedule 时段内时预先启动视频流
+    * 记录每路流从启动到第一个可播放输出的时间（首帧时间）
+
+播放未启动的流时按需启动由 STREAM_ON_DEMAND 控制。启动和停止由视频流路由注册的回调执行。
+"""
+from contextlib import contextmanager
+from collections import deque
+from datetime import datetime
+import statistics
+import threading
+import logging
+import time
+import os
+
+from src.services import metrics
+
+STREAM_ROOT = '/tmp/streams'
+# 播放未启动的流时自动启动
+STREAM_ON_DEMAND = os.environ.get('STREAM_ON_DEMAND', '1').lower() in ('1', 'true', 'yes')
+# 没有观看者多久后自动停止（秒），0表示不自动停止
+STREAM_IDLE_TIMEOUT = float(os.environ.get('STREAM_IDLE_TIMEOUT', 300))
+# HLS客户端最近一次请求后仍计为观看者的时间（秒），应大于播放器刷新播放列表的间隔
+STREAM_VIEWER_TIMEOUT = float(os.environ.get('STREAM_VIEWER_TIMEOUT', 15))
+# 按需启动时等待第一个可播放输出的时间（秒）
+STREAM_START_TIMEOUT = float(os.environ.get('STREAM_START_TIMEOUT', 15))
+# 预热启动使用的输出格式
+STREAM_PREWARM_FORMAT = os.environ.get('STREAM_PREWARM_FORMAT', 'hls')
+# 首帧检测、空闲检查和预热检查间隔（秒）
+READY_INTERVAL = 0.5
+REAP_INTERVAL = 5
+PREWARM_INTERVAL = 30
+# 同一设备标记文件的最短更新间隔（秒）
+MARK_INTERVAL = 1
+MARKER_NAME = '.last_viewed'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_schedule(text):
+    """解析预热时段 'HH:MM-HH:MM[,HH:MM-HH:MM]'（本地时间，结束早于开始时跨午夜），返回分钟区间列表"""
+    windows = []
+    for item in (text or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        start, separator, end = item.partition('-')
+        if not separator:
+            raise ValueError(f'无效的预热时段: {item}')
+        windows.append((parse_minute(start), parse_minute(end)))
+    return windows
+
+
+def parse_minute(value):
+    hour, separator, minute = value.strip().partition(':')
+    if not (separator and hour.isdigit() and minute.isdigit()) or int(minute) > 59 \
+            or int(hour) * 60 + int(minute) > 24 * 60:
+        raise ValueError(f'无效的时间: {value.strip()}')
+    return int(hour) * 60 + int(minute)
+
+
+def in_schedule(windows, now=None):
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for start, end in windows:
+        if start <= end:
+            if start <= minute < end:
+                return True
+        elif minute >= start or minute < end:
+            return True
+    return False
+
+
+def marker_path(device_id):
+    return os.path.join(STREAM_ROOT, device_id, MARKER_NAME)
+
+
+class StreamLifecycle:
+    """观看者计数、空闲回收、预热和首帧时间统计"""
+
+    def __init__(self, idle_timeout=STREAM_IDLE_TIMEOUT, viewer_timeout=STREAM_VIEWER_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.viewer_timeout = viewer_timeout
+        self.lock = threading.Lock()
+        # {device_id: {客户端: 最近请求时间}}
+        self.clients = {}
+        # {device_id: MJPEG连接数}
+        self.connections = {}
+        # {device_id: 最近写入标记文件的时间}
+        self.marked = {}
+        # 本进程运行的流 {device_id: {'format', 'origin', 'start_time', 'ready', 'first_frame'}}
+        self.streams = {}
+        # 最近的首帧时间样本 (格式, 启动来源, 秒)
+        self.first_frames = deque(maxlen=200)
+        self.reaped = 0
+        self.handlers = None
+        self.app = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def register_handlers(self, start, stop, running):
+        """start(device_id, output_format, origin) 启动视频流，stop(device_id) 停止本进程运行的流并释放租约，
+        running() 返回本进程正在运行（FFmpeg进程未退出）的设备ID"""
+        self.handlers = (start, stop, running)
+
+    # ---- 观看者 ----
+
+    def touch(self, device_id, client=None):
+        """记录一次播放请求；client为空时只更新最近观看时间（MJPEG连接另行计数）"""
+        now = time.time()
+        with self.lock:
+            if client is not None:
+                self.clients.setdefault(device_id, {})[client] = now
+            if now - self.marked.get(device_id, 0) < MARK_INTERVAL:
+                return
+            self.marked[device_id] = now
+        path = marker_path(device_id)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            try:
+                open(path, 'a').close()
+            except OSError:
+                pass
+        except OSError:
+            pass
+
+    @contextmanager
+    def watching(self, device_id):
+        """MJPEG连接期间计为一个观看者"""
+        with self.lock:
+            self.connections[device_id] = self.connections.get(device_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.connections[device_id] -= 1
+                if not self.connections[device_id]:
+                    del self.connections[device_id]
+            self.touch(device_id)
+
+    def viewers(self, device_id):
+        cutoff = time.time() - self.viewer_timeout
+        with self.lock:
+            clients = self.clients.get(device_id, {})
+            for client in [client for client, seen in clients.items() if seen < cutoff]:
+                del clients[client]
+            return len(clients) + self.connections.get(device_id, 0)
+
+    def last_viewed(self, device_id):
+        """最近观看时间（包括同一节点其他进程的播放请求），没有记录时返回None"""
+        with self.lock:
+            if self.connections.get(device_id):
+                return time.time()
+            seen = max(self.clients.get(device_id, {}).values(), default=None)
+        try:
+            marked = os.path.getmtime(marker_path(device_id))
+        except OSError:
+            marked = None
+        return max((t for t in (seen, marked) if t is not None), default=None)
+
+    def idle_seconds(self, device_id, now=None):
+        now = now or time.time()
+        if self.viewers(device_id):
+            return 0.0
+        info = self.streams.get(device_id)
+        last = max(self.last_viewed(device_id) or 0, info['start_time'] if info else now)
+        return max(0.0, now - last)
+
+    # ---- 流 ----
+
+    def stream_started(self, device_id, output_format, origin, ready):
+        """登记本进程启动的流；ready() 在第一个可播放输出生成后返回True"""
+        with self.lock:
+            self.streams[device_id] = {
+                'format': output_format,
+                'origin': origin,
+                'start_time': time.time(),
+                'ready': ready,
+                'first_frame': None
+            }
+
+    def stream_stopped(self, device_id):
+        with self.lock:
+            self.streams.pop(device_id, None)
+            self.clients.pop(device_id, None)
+            self.marked.pop(device_id, None)
+
+    def check_ready(self, device_id):
+        """检查流是否已有可播放输出，第一次就绪时记录首帧时间"""
+        info = self.streams.get(device_id)
+        if info is None:
+            return False
+        if info['first_frame'] is not None:
+            return True
+        try:
+            ready = info['ready']()
+        except Exception:
+            ready = False
+        if not ready:
+            return False
+        with self.lock:
+            if info['first_frame'] is None:
+                info['first_frame'] = time.time() - info['start_time']
+                self.first_frames.append((info['format'], info['origin'], info['first_frame']))
+                metrics.stream_first_frame.observe(info['first_frame'], format=info['format'])
+        return True
+
+    def wait_ready(self, device_id, timeout=STREAM_START_TIMEOUT):
+        deadline = time.time() + timeout
+        while not self.check_ready(device_id):
+            if time.time() >= deadline or device_id not in self.streams:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def warm_devices(self):
+        """当前应保持运行的设备：固定预热或处于预热时段内"""
+        from src.models.device import Device
+
+        warm = set()
+        devices = Device.query.filter(
+            (Device.stream_pinned.is_(True)) | (Device.stream_schedule.isnot(None))
+        ).with_entities(Device.device_id, Device.stream_pinned, Device.stream_schedule).all()
+        for device_id, pinned, schedule in devices:
+            try:
+                if pinned or in_schedule(parse_schedule(schedule)):
+                    warm.add(device_id)
+            except ValueError:
+                logger.warning("预热时段无效", extra={'device_id': device_id, 'schedule': schedule})
+        return warm
+
+    def reap(self, warm=()):
+        """停止空闲超时的流，返回停止的设备ID"""
+        if not self.idle_timeout or self.handlers is None:
+            return []
+        now = time.time()
+        reaped = []
+        for device_id in list(self.handlers[2]()):
+            if device_id in warm:
+                continue
+            idle = self.idle_seconds(device_id, now)
+            if idle < self.idle_timeout:
+                continue
+            logger.info("视频流无人观看，自动停止", extra={'device_id': device_id, 'idle_seconds': round(idle)})
+            try:
+                self.handlers[1](device_id)
+            except Exception:
+                logger.exception("停止空闲视频流失败", extra={'device_id': device_id})
+                continue
+            reaped.append(device_id)
+        if reaped:
+            with self.lock:
+                self.reaped += len(reaped)
+            metrics.streams_reaped.inc(len(reaped))
+        return reaped
+
+    def prewarm(self, warm):
+        """启动应保持运行但尚未运行的流（集群模式下只启动归属本节点的设备），返回启动的设备ID
+
+        进程已退出的流不计为运行，启动时先清理原来的记录再重新启动
+        """
+        from src.services.ownership import get_cluster
+
+        if self.handlers is None:
+            return []
+        cluster = get_cluster()
+        running = set(self.handlers[2]())
+        started = []
+        for device_id in sorted(set(warm) - running):
+            if cluster.owner(device_id) != cluster.node_id:
+                continue
+            try:
+                if self.handlers[0](device_id, STREAM_PREWARM_FORMAT, 'prewarm'):
+                    started.append(device_id)
+            except Exception:
+                logger.exception("预热视频流失败", extra={'device_id': device_id})
+        return started
+
+    def status(self):
+        samples = list(self.first_frames)
+        seconds = sorted(sample[2] for sample in samples)
+        by_origin = {}
+        for _, origin, value in samples:
+            by_origin.setdefault(origin, []).append(value)
+        return {
+            'on_demand': STREAM_ON_DEMAND,
+            'idle_timeout': self.idle_timeout,
+            'viewer_timeout': self.viewer_timeout,
+            'reaped': self.reaped,
+            'first_frame': {
+                'samples': len(seconds),
+                'p50': statistics.median(seconds) if seconds else None,
+                'p95': seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))] if seconds else None,
+                'by_origin': {origin: statistics.median(values) for origin, values in by_origin.items()}
+            }
+        }
+
+    def stream_status(self, device_id):
+        """单路流的观看者和首帧信息"""
+        info = self.streams.get(device_id, {})
+        return {
+            'viewers': self.viewers(device_id),
+            'idle_seconds': round(self.idle_seconds(device_id), 1) if info else None,
+            'origin': info.get('origin'),
+            'time_to_first_frame': info.get('first_frame')
+        }
+
+    # ---- 后台线程 ----
+
+    def start(self, app):
+        if self.thread is not None:
+            return
+        self.app = app
+        self.thread = threading.Thread(target=self.run, name='stream-lifecycle', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        next_reap = time.time() + REAP_INTERVAL
+        next_prewarm = time.time()
+        while not self.stopped.wait(READY_INTERVAL):
+            for device_id in list(self.streams):
+                self.check_ready(device_id)
+            now = time.time()
+            if now < next_reap and now < next_prewarm:
+                continue
+            try:
+                with self.app.app_context():
+                    warm = self.warm_devices()
+                    if now >= next_prewarm:
+                        next_prewarm = now + PREWARM_INTERVAL
+                        self.prewarm(warm)
+                    if now >= next_reap:
+                        next_reap = now + REAP_INTERVAL
+                        self.reap(warm)
+            except Exception:
+                logger.exception("视频流生命周期检查失败")
+                next_reap = now + REAP_INTERVAL
+                next_prewarm = max(next_prewarm, now + PREWARM_INTERVAL)
+
+
+_lifecycle = None
+_lifecycle_lock = threading.Lock()
+
+
+def get_lifecycle():
+    global _lifecycle
+    with _lifecycle_lock:
+        if _lifecycle is None:
+            _lifecycle = StreamLifecycle()
+        return _lifecycle